@@ -0,0 +1,202 @@
+"""Decide which code search hits might be ACLs worth a human look.
+
+The skip lists are heuristic, and were derived over many offboardings in
+the UserSearch notebook -- only add orgs, repositories, paths or files
+that could NEVER contain an ACL definition.
+
+Hits are the dicts produced by acl_search.slim_hit().
+"""
+
+import logging
+import re
+from urllib.parse import quote_plus, urlparse, urlunparse
+
+logger = logging.getLogger(__name__)
+
+FILENAMES_TO_SKIP = {
+    "setup.py",
+    "pyproject.toml",
+    "requirements.txt",
+    "Makefile",
+    "Dockerfile",
+    "package-lock.json",
+    "cacerts.txt",
+    "strings.xml",
+}
+EXTENSIONS_TO_SKIP = (
+    ".ics",
+    ".md",
+    ".markdown",
+    ".rst",
+    ".der",
+    ".pem",
+    ".crt",
+    ".html",
+    ".htm",
+    ".svg",
+    ".bib",
+    ".po",
+)
+
+# some orgs have patterns for repo names, take advantage of that
+REPOS_TO_SKIP_REGEXP = (
+    "mozilla-services/foxsec-results",
+    "mozilla-services/cloudops-jenkins",
+    "mozilla-services/cloudqa-jenkins",
+    "mozilla/gecko-dev",
+    "mozilla/eu2019-ad-transparency-report",
+    "mdn/archived-content",
+    "mozilla-releng/take-home-assignment.*",  # interview tests
+    "mozilla-it/www-archive.mozilla.org",
+    "mdn/retired.*content",  # history
+    "mozilla-it/sumo-l10n.*",
+    "mozmeao/sumo-l10n.*",
+    "mozmeao/www-l10n",
+    "mozilla-services/ms-language-packs",
+    "mozilladatascience/search-terms-sanitization",
+    "Pocket/AndroidHiring",
+    "Pocket/Localization",
+    "Pocket/data-explorations",
+    "mdn/translated-content",
+    "Pocket/parser-benchmark",
+    "mozilla/releases_insights",
+)
+RE_REPO_TO_SKIP = re.compile(
+    "(?:" + ")|(?:".join(REPOS_TO_SKIP_REGEXP) + ")", re.IGNORECASE
+)
+
+# These orgs are guaranteed not to have any current ACLs in them
+# - could be expanded for any parked or archived org
+ORGS_TO_SKIP = (
+    "fxos",
+    "fxos-eng",
+    "mozilla-b2g",
+    "moco-ghe-admin",
+    "mozilla-l10n",  # only translations, no apps or services
+    "common-voice",  # not supported by IT
+)
+# skip anything with these in a directory name (substring match)
+PATHS_TO_SKIP = (
+    "test",
+    "train",  # all the AI these days
+    "sample",
+    "locales",  # l10n stuff
+    "translations",
+    "template",
+    "resources",
+)
+
+
+def ignore_path(path_parts):
+    """True if any directory (not the org, not the file) should be skipped."""
+    for element in [x.lower() for x in path_parts[1:-1]]:
+        for ignorable in PATHS_TO_SKIP:
+            if ignorable in element:
+                return True
+    return False
+
+
+def search_hit_to_url(url, login=None):
+    """Turn a hit's html_url into a search for login in just that file.
+
+    Hits link to the blob at the sha GitHub indexed, which often 404s
+    by the time we look, so build a search url instead. Returns
+    (search url, "org/repo", directory, filename), or None if the hit
+    is one we ignore.
+    """
+    parts = urlparse(url)
+    path_parts = parts.path.split("/")
+    if path_parts[1] in ORGS_TO_SKIP:
+        logger.debug("ignoring based on org '%s'", path_parts[1])
+        return None
+    repo = "/".join(path_parts[1:3])
+    if RE_REPO_TO_SKIP.match(repo):
+        logger.debug("ignoring based on repo '%s'", repo)
+        return None
+    if ignore_path(path_parts):
+        logger.debug("ignoring based on path '%s'", parts.path)
+        return None
+    filename = path_parts[-1]
+    if "." in filename and filename[filename.rindex(".") :] in EXTENSIONS_TO_SKIP:
+        logger.debug("ignoring based on extension '%s'", filename)
+        return None
+    if filename in FILENAMES_TO_SKIP:
+        logger.debug("ignoring based on filename '%s'", filename)
+        return None
+    basepath = path_parts[3:-1]
+    if basepath and basepath[0] == "blob":
+        # get rid of 'blob' and sha1
+        basepath = basepath[2:]
+    basepath = "/".join(basepath)
+
+    # everything can be in one "path" filter
+    filename_filter = 'path:"'
+    if basepath:
+        filename_filter += f"{basepath}/"
+    filename_filter += f'{filename}"'
+    # form encode, but keep already escaped characters (e.g. spaces) as is
+    query = quote_plus(f"repo:{repo} {filename_filter} {login}", safe='/%"')
+    new_url = urlunparse(
+        (
+            parts.scheme,
+            parts.netloc,
+            "search",
+            None,
+            f"type=Code&ref=advsearch&q={query}",
+            None,
+        )
+    )
+    return new_url, repo, basepath, filename
+
+
+def prune_hits_to_ignore(hits, term, is_archived):
+    """Drop hits that can't be a live ACL for term.
+
+    That is hits in security advisory (*-ghsa-*) or archived repositories,
+    and hits where term doesn't appear as a word in any fragment.
+    is_archived is called with "org/repo" -- see archived_check().
+    """
+    term_re = re.compile(rf"\b{re.escape(term)}\b", re.IGNORECASE)
+    kept = []
+    for hit in hits:
+        if "-ghsa-" in hit["repository"]:
+            continue
+        if not any(term_re.search(fragment) for fragment in hit["fragments"]):
+            continue
+        if not is_archived(hit["repository"]):
+            kept.append(hit)
+    return kept
+
+
+def archived_check(gh, repo_cache):
+    """Return an is_archived(full_name) backed by a RepoMetadataCache.
+
+    Repositories we can't see are treated as not archived, so their
+    hits are still reported.
+    """
+
+    def is_archived(full_name):
+        data = repo_cache.lookup(gh, full_name)
+        return bool(data and data.get("archived"))
+
+    return is_archived
+
+
+def report_rows(results):
+    """Yield CSV rows (as in the notebook) for {(org, term): hits}."""
+    for (org, term), hits in sorted(results.items()):
+        search_urls = set()
+        for hit in hits:
+            new_url = search_hit_to_url(hit["html_url"], term)
+            if new_url:
+                context = "\n----\n".join(hit["fragments"])
+                search_urls.add((*new_url, context.replace("\n", "\\n")))
+        if search_urls:
+            yield [
+                "",
+                f"{len(search_urls)} files with possible ACLs in {org} for {term}:",
+                "",
+                "",
+            ]
+            for url, repo, path, filename, context in sorted(search_urls):
+                yield ["", "", "", "", f"{repo}/{path}/{filename}", url, context]
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Resumable code search for logins that might appear in ACL files.
+
+Offboarding searches every org for every login variant of a departing
+user. That is a lot of queries against a budget of 10 code searches per
+minute, so a run can take a long while. Pages are fetched explicitly,
+and the next page of each query (plus the hits so far) is written to a
+checkpoint file after every page -- an interrupted run picks up exactly
+where it stopped.
+
+Several terms (ORed) and org: qualifiers are packed into each search,
+and the hits are split back out per (org, term) locally from their text
+match fragments.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import io
+import os
+import re
+import sys
+
+import requests
+
+import acl_filters
+from client import (
+    CODE_SEARCH_URL,
+    DEFAULT_ORGS,
+    MAX_QUERY_LENGTH,
+    MAX_RESULTS,
+    PER_PAGE,
+    get_github3_client,
+    get_requests_session,
+    org_query,
+    pack_orgs,
+)
+from repo_metadata import RepoMetadataCache
+
+# text_match adds the fragments around each hit
+TEXT_MATCH = "application/vnd.github.text-match+json"
+# GitHub rejects queries with more boolean operators
+MAX_OPERATORS = 5
+CHECKPOINT_FILE = os.path.join(os.path.dirname(__file__), "cache", "acl_search.json")
+
+logger = logging.getLogger(__name__)
+
+
+def slim_hit(item):
+    """Keep only what we need from a search result item."""
+    repository = item["repository"]
+    return {
+        "html_url": item["html_url"],
+        "path": item["path"],
+        "repository": repository["full_name"],
+        "repository_id": repository["id"],
+        "fragments": [m["fragment"] for m in item.get("text_matches", [])],
+    }
+
+
+def quote_term(term):
+    return f'"{term}"' if re.search(r"[\s\"():]", term) else term
+
+
+def plan_queries(orgs, terms):
+    """Pack terms (ORed) and orgs into as few searches as GitHub allows.
+
+    Returns a list of (query, orgs, terms) -- the orgs & terms each query
+    covers, for demultiplex(). No orgs means nothing to search.
+    """
+    if not orgs:
+        return []
+    # leave room for at least one org qualifier
+    room = MAX_QUERY_LENGTH - len(f"org:{max(orgs, key=len)} ")
+    term_groups, group = [], []
+    for term in terms:
+        candidate = group + [term]
+        if group and (
+            len(candidate) > MAX_OPERATORS + 1
+            or len(" OR ".join(map(quote_term, candidate))) > room
+        ):
+            term_groups.append(group)
+            candidate = [term]
+        group = candidate
+    if group:
+        term_groups.append(group)
+
+    plan = []
+    for group in term_groups:
+        terms_query = " OR ".join(map(quote_term, group))
+        for org_group in pack_orgs(orgs, terms_query):
+            plan.append((org_query(org_group, terms_query), org_group, group))
+    return plan
+
+
+def demultiplex(hits, orgs, terms):
+    """Split the hits of a packed query back out per (org, term).
+
+    A hit belongs to a term if the term appears, as a word, in one of its
+    text match fragments or its path. Hits matching none of the terms
+    (e.g. on a stemmed form) are dropped.
+    """
+    by_org = {org.lower(): org for org in orgs}
+    patterns = {
+        term: re.compile(rf"(?<!\w){re.escape(term)}(?!\w)", re.IGNORECASE)
+        for term in terms
+    }
+    results = {(org, term): [] for org in orgs for term in terms}
+    for hit in hits:
+        org = by_org.get(hit["repository"].split("/")[0].lower())
+        if org is None:
+            continue
+        haystacks = hit["fragments"] + [hit["path"]]
+        for term, pattern in patterns.items():
+            if any(pattern.search(text) for text in haystacks):
+                results[(org, term)].append(hit)
+    return results
+
+
+class Checkpoint:
+    """Search progress, keyed by query, saved to a JSON file.
+
+    Each entry is {"next_page": n, "done": bool, "total": n, "hits": [...]}.
+    """
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        self.queries = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.queries = json.load(f)
+
+    def entry(self, query):
+        return self.queries.setdefault(
+            query, {"next_page": 1, "done": False, "total": None, "hits": []}
+        )
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # write & rename, so a crash mid-write can't lose the old checkpoint
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.queries, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        self.queries = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class CodeSearch:
+    """Run code searches one page at a time, checkpointing each page.
+
+    Requests go through the shared session, which paces them against the
+    code search budget and retries secondary rate limits.
+    """
+
+    def __init__(self, checkpoint=None, session=None):
+        self.checkpoint = checkpoint if checkpoint is not None else Checkpoint()
+        self.session = session or get_requests_session()
+
+    def fetch_page(self, query, page):
+        response = self.session.get(
+            CODE_SEARCH_URL,
+            params={"q": query, "per_page": PER_PAGE, "page": page},
+            headers={"Accept": TEXT_MATCH},
+        )
+        if response.status_code == 422 and page > 1:
+            # asked past the last page the index will give us
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, query, split_at=None):
+        """Return every hit for query, resuming from the checkpoint.
+
+        If split_at is given and the first page reports more results than
+        that, stop and return None -- the caller should narrow the query.
+        """
+        entry = self.checkpoint.entry(query)
+        while not entry["done"]:
+            page = entry["next_page"]
+            body = self.fetch_page(query, page)
+            if body is None:
+                entry["done"] = True
+            else:
+                if body.get("incomplete_results"):
+                    logger.warning("Search timed out, results incomplete: %s", query)
+                items = body.get("items", [])
+                entry["hits"].extend(slim_hit(item) for item in items)
+                entry["total"] = body.get("total_count", 0)
+                entry["next_page"] = page + 1
+                available = min(entry["total"], MAX_RESULTS)
+                entry["done"] = len(items) < PER_PAGE or page * PER_PAGE >= available
+                logger.debug("%s: page %d, %d hits", query, page, len(items))
+                if split_at is not None and entry["total"] > split_at:
+                    # the first page tells us; don't spend the rest on it
+                    entry["done"] = True
+            self.checkpoint.save()
+        if split_at is not None and entry["total"] > split_at:
+            return None
+        return entry["hits"]
+
+    def search_packed(self, orgs, terms):
+        """Return {(org, term): hits} for one packed query.
+
+        A packed query matching more than the API will return is split in
+        two (by terms first, then orgs) so no results are lost.
+        """
+        query = org_query(orgs, " OR ".join(map(quote_term, terms)))
+        can_split = len(terms) > 1 or len(orgs) > 1
+        hits = self.search(query, split_at=MAX_RESULTS if can_split else None)
+        if hits is not None:
+            return demultiplex(hits, orgs, terms)
+        logger.info("Too many results, splitting: %s", query)
+        if len(terms) > 1:
+            halves = [
+                (orgs, terms[: len(terms) // 2]),
+                (orgs, terms[len(terms) // 2 :]),
+            ]
+        else:
+            halves = [(orgs[: len(orgs) // 2], terms), (orgs[len(orgs) // 2 :], terms)]
+        results = {}
+        for half_orgs, half_terms in halves:
+            results.update(self.search_packed(half_orgs, half_terms))
+        return results
+
+    def search_all(self, orgs, terms):
+        """Return {(org, term): hits} for every org & term combination.
+
+        Several terms and orgs are packed into each search, which cuts
+        the number of searches by roughly the packing factor.
+        """
+        results = {}
+        plan = plan_queries(orgs, terms)
+        logger.info(
+            "%d searches for %d orgs x %d terms", len(plan), len(orgs), len(terms)
+        )
+        for _, query_orgs, query_terms in plan:
+            results.update(self.search_packed(query_orgs, query_terms))
+        return results
+
+
+def check_for_acls(search, gh, logins, orgs=DEFAULT_ORGS, repo_cache=None):
+    """Search orgs for logins, and return the notebook's CSV report lines.
+
+    Archived repositories are recognized from one repository listing per
+    org (repo_cache), not a request per hit.
+    """
+    possibles = sorted({login.lower() for login in logins})
+    results = search.search_all(orgs, possibles)
+    is_archived = acl_filters.archived_check(gh, repo_cache or RepoMetadataCache())
+    results = {
+        (org, term): acl_filters.prune_hits_to_ignore(hits, term, is_archived)
+        for (org, term), hits in results.items()
+    }
+
+    csvfile = io.StringIO()
+    writer = csv.writer(csvfile)
+    writer.writerow(
+        ["Action Taken", "Comment", "", "Context", "File", "Search URL", "Raw Context"]
+    )
+    # formula to copy down from R2C3 - still requires manual intervention
+    #  1. in cell C3 select, edit, and enter to make real formula
+    #  2. fill down for all rows in sheet
+    writer.writerow(
+        [
+            "",
+            "",
+            '=if(ISBLANK(F2),"", HYPERLINK(F2,"?"))',
+            '=if(isblank(G2),,SUBSTITUTE(G2,"\\n",char(10)))',
+            "",
+            "",
+        ]
+    )
+    writer.writerow([""] * 4)
+    writer.writerow([f"Checking for possible ACLs for: {', '.join(possibles)}", "", ""])
+    writer.writerow([""] * 4)
+    writer.writerows(acl_filters.report_rows(results))
+    return csvfile.getvalue().splitlines()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("terms", nargs="+", help="logins (or other terms) to find")
+    parser.add_argument(
+        "--orgs",
+        default=DEFAULT_ORGS,
+        nargs="*",
+        help=f"organizations to search (defaults to {DEFAULT_ORGS})",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=CHECKPOINT_FILE,
+        help=f"file to keep progress in (default {CHECKPOINT_FILE})",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="discard any saved progress and search from scratch",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="output the filtered report as CSV, for pasting into a sheet",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="log the plan and each page"
+    )
+    args = parser.parse_args()
+    if not args.orgs:
+        parser.error("--orgs needs at least one organization")
+    return args
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    args.terms = sorted({term.lower() for term in args.terms})
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    search = CodeSearch(checkpoint)
+    try:
+        if args.csv:
+            gh = get_github3_client()
+            print("\n".join(check_for_acls(search, gh, args.terms, args.orgs)))
+        else:
+            print("{:<24}{:<16}{:<40}{}".format("org", "term", "repo", "file path"))
+            results = search.search_all(args.orgs, args.terms)
+            for (org, term), hits in sorted(results.items()):
+                for hit in hits:
+                    print(f"{org:<24}{term:<16}{hit['repository']:<40}{hit['path']}")
+    except requests.RequestException as e:
+        print(f"Search stopped ({e}); rerun to resume.", file=sys.stderr)
+        raise SystemExit(1)
+    # everything is done, start fresh next time
+    checkpoint.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+"""Read GitHub audit log exports, and keep them in a queryable store.
+
+Exports are either one JSON array of events (the web UI's JSON export) or
+newline delimited JSON (API dumps). Either way they are read in a single
+streaming pass over an mmap of the file, so memory use doesn't grow with
+the size of the export.
+"""
+
+_epilog = """
+"ingest" adds exports to the store, skipping events it already has, so
+overlapping exports can be ingested as they come. "query" answers from
+the store, e.g. all org.* actions by the current owners of mozilla in
+the last 90 days:
+
+    auditlog.py query --owners-of mozilla --action 'org.*' --days 90
+
+"fetch" pulls new events from the audit log API (which needs an
+enterprise org, and the read:audit_log scope) into gzipped NDJSON files,
+one per org & run, in cache/auditlog. Where each org got to is kept in
+cache/auditlog/cursors.json, so the next run only gets newer events.
+"""
+import argparse
+import codecs
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import mmap
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from client import get_github3_client, get_requests_session, map_concurrently
+from snapshot import Snapshot, SnapshotMissing, add_snapshot_argument
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_STORE = os.path.join(os.path.dirname(__file__), "cache", "auditlog.sqlite")
+# events written per transaction while ingesting
+BATCH_SIZE = 10000
+DAY = 24 * 3600
+API_URL = "https://api.github.com"
+FETCH_DIR = os.path.join(os.path.dirname(__file__), "cache", "auditlog")
+CURSOR_FILE = os.path.join(FETCH_DIR, "cursors.json")
+# pages fetched ahead of the decoding & writing
+PAGES_AHEAD = 4
+
+logger = logging.getLogger(__name__)
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    """Yield the bytes of path, chunk_size at a time.
+
+    Plain files are read through an mmap; .gz files are decompressed as
+    they are read.
+    """
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from iter(lambda: f.read(chunk_size), b"")
+        return
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for offset in range(0, len(m), chunk_size):
+            yield m[offset : offset + chunk_size]
+
+
+def iter_events(path, chunk_size=CHUNK_SIZE):
+    """Yield each event (a dict) in the export at path, in file order."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = read_chunks(path, chunk_size)
+    buffer, pos, at_end = "", 0, False
+    while not at_end:
+        chunk = next(chunks, None)
+        at_end = chunk is None
+        if not at_end:
+            buffer = buffer[pos:] + utf8.decode(chunk)
+            pos = 0
+        while True:
+            # skip the array punctuation & whitespace between events
+            while pos < len(buffer) and buffer[pos] in "[], \t\r\n":
+                pos += 1
+            if pos == len(buffer):
+                break
+            try:
+                event, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                break  # incomplete, read some more
+            pos = end
+            yield event
+
+
+def timestamp(event):
+    """created_at (milliseconds since the epoch) as an ISO 8601 string."""
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(event["created_at"] / 1000))
+
+
+def owner_actions(events, owners):
+    """Return {login: [event, ...]} of org.* actions by each of owners.
+
+    One pass over events, however many owners there are.
+    """
+    actions = {login: [] for login in owners}
+    for event in events:
+        found = actions.get(event.get("actor"))
+        if found is not None and event.get("action", "").startswith("org."):
+            found.append(event)
+    return actions
+
+
+def write_csv(out, events):
+    """Write (created_at, actor, action) rows, as jq's @csv did."""
+    writer = csv.writer(out, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+    for event in events:
+        writer.writerow([timestamp(event), event["actor"], event["action"]])
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    created_at INTEGER NOT NULL,  -- milliseconds since the epoch
+    day TEXT NOT NULL,            -- YYYY-MM-DD, UTC
+    org TEXT,
+    actor TEXT,
+    action TEXT NOT NULL,
+    repo TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_day ON events (day);
+CREATE INDEX IF NOT EXISTS events_actor ON events (actor, created_at);
+CREATE INDEX IF NOT EXISTS events_action ON events (action, created_at);
+CREATE INDEX IF NOT EXISTS events_repo ON events (repo, created_at);
+"""
+
+
+def event_id(event):
+    """GitHub's document id if present, else a digest of the event itself."""
+    if event.get("_document_id"):
+        return event["_document_id"]
+    canonical = json.dumps(event, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()  # nosec
+
+
+class AuditStore:
+    """Audit log events in SQLite, indexed by day, actor, action & repo."""
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def ingest(self, events, batch_size=BATCH_SIZE):
+        """Add events not already stored; return (added, duplicates)."""
+        added = seen = 0
+        batch = []
+
+        def flush():
+            with self.db:
+                before = self.db.total_changes
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    batch,
+                )
+                return self.db.total_changes - before
+
+        for event in events:
+            seen += 1
+            batch.append(
+                (
+                    event_id(event),
+                    event["created_at"],
+                    time.strftime("%Y-%m-%d", time.gmtime(event["created_at"] / 1000)),
+                    event.get("org"),
+                    event.get("actor"),
+                    event["action"],
+                    event.get("repo"),
+                    json.dumps(event, separators=(",", ":")),
+                )
+            )
+            if len(batch) >= batch_size:
+                added += flush()
+                batch = []
+        if batch:
+            added += flush()
+        return added, seen - added
+
+    def query(self, actors=None, action=None, repo=None, org=None, since=None):
+        """Yield matching events, oldest first.
+
+        action may be a glob (e.g. "org.*"); since is in seconds since the
+        epoch.
+        """
+        clauses, params = [], []
+        if actors is not None:
+            actors = list(actors)
+            clauses.append(f"actor IN ({', '.join('?' * len(actors))})")
+            params.extend(actors)
+        if action:
+            clauses.append("action GLOB ?")
+            params.append(action)
+        if repo:
+            clauses.append("repo = ?")
+            params.append(repo)
+        if org:
+            clauses.append("org = ?")
+            params.append(org)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(int(since * 1000))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        for (data,) in self.db.execute(
+            f"SELECT data FROM events{where} ORDER BY created_at", params
+        ):
+            yield json.loads(data)
+
+    def stats(self):
+        count, first, last = self.db.execute(
+            "SELECT COUNT(*), MIN(day), MAX(day) FROM events"
+        ).fetchone()
+        return {"events": count, "first_day": first, "last_day": last}
+
+
+def current_owners(org, snapshot=None):
+    if snapshot is not None:
+        return [m["login"] for m in snapshot.members(org, role="admin")]
+    gh = get_github3_client()
+    return [u.login for u in gh.organization(org).members(role="admin")]
+
+
+def load_cursors(path=CURSOR_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_cursors(cursors, path=CURSOR_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # write & rename, so a crash mid-write can't lose the old cursors
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cursors, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _after(url):
+    return parse_qs(urlsplit(url).query).get("after", [None])[0]
+
+
+def fetch_pages(session, url, params, pages):
+    """Put (cursor, body) for each page on the queue pages, then None.
+
+    An exception is put on the queue, rather than raised.
+    """
+    try:
+        cursor = params.get("after")
+        while url:
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            pages.put((cursor, response.content))
+            url = response.links.get("next", {}).get("url")
+            # the next url already carries the query string
+            params, cursor = None, _after(url) if url else None
+    except Exception as e:
+        pages.put(e)
+    pages.put(None)
+
+
+def fetch_org(session, org, cursor=None, out_dir=FETCH_DIR, api_url=API_URL):
+    """Fetch org's audit log events newer than cursor, oldest first.
+
+    cursor is what an earlier call returned. The next page is fetched
+    while the current one is decoded & written. Returns (path of the
+    gzipped NDJSON file or None if nothing was new, count, new cursor).
+    """
+    params = {"per_page": 100, "order": "asc", "include": "all"}
+    last_id = None
+    if cursor:
+        # re-read the page the last run ended on, skipping what it had
+        params["after"] = cursor["after"]
+        last_id = cursor["last_id"]
+    pages = queue.Queue(maxsize=PAGES_AHEAD)
+    fetcher = threading.Thread(
+        target=fetch_pages,
+        args=(session, f"{api_url}/orgs/{org}/audit-log", params, pages),
+        daemon=True,
+    )
+    fetcher.start()
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, f"{org}.ndjson.gz.tmp")
+    count, first, last = 0, None, None
+    try:
+        with gzip.open(tmp, "wt", encoding="utf-8") as out:
+            while True:
+                page = pages.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                after, body = page
+                events = json.loads(body)
+                if last_id is not None:
+                    ids = [e.get("_document_id") for e in events]
+                    if last_id in ids:
+                        events = events[ids.index(last_id) + 1 :]
+                    last_id = None
+                for event in events:
+                    out.write(json.dumps(event, separators=(",", ":")) + "\n")
+                count += len(events)
+                if events:
+                    first = first or events[0].get("created_at")
+                    last = events[-1].get("created_at")
+                    cursor = {"after": after, "last_id": events[-1].get("_document_id")}
+    except BaseException:
+        os.remove(tmp)
+        raise
+    if not count:
+        os.remove(tmp)
+        return None, 0, cursor
+    # named for the span of created_at (milliseconds) it holds
+    path = os.path.join(out_dir, f"{org}-{first}-{last}.ndjson.gz")
+    os.replace(tmp, path)
+    return path, count, cursor
+
+
+def do_ingest(args):
+    store = AuditStore(args.store)
+    try:
+        for path in args.exports:
+            added, duplicates = store.ingest(iter_events(path))
+            print(f"{path}: {added} events added, {duplicates} already stored")
+        stats = store.stats()
+        print(
+            "{events} events from {first_day} to {last_day} in the store".format(
+                **stats
+            )
+        )
+    finally:
+        store.close()
+
+
+def do_query(args):
+    actors = list(args.actor or [])
+    if args.owners_of:
+        snapshot = (
+            Snapshot(args.from_snapshot, read_only=True) if args.from_snapshot else None
+        )
+        try:
+            actors.extend(current_owners(args.owners_of, snapshot))
+        except SnapshotMissing as e:
+            raise SystemExit(f"Error: {e}")
+    since = time.time() - args.days * DAY if args.days is not None else None
+    store = AuditStore(args.store)
+    try:
+        events = store.query(
+            actors if (args.actor or args.owners_of) else None,
+            args.action,
+            args.repo,
+            args.org,
+            since,
+        )
+        if args.json:
+            for event in events:
+                print(json.dumps(event))
+        else:
+            write_csv(sys.stdout, events)
+    finally:
+        store.close()
+
+
+def do_fetch(args):
+    session = get_requests_session()
+    cursors = load_cursors(args.cursors)
+
+    def fetch(org):
+        try:
+            return fetch_org(session, org, cursors.get(org), args.out_dir)
+        except Exception as e:
+            logger.error("Fetching %s failed: %s", org, e)
+            return None
+
+    paths = []
+    for org, result in zip(args.orgs, map_concurrently(fetch, args.orgs, args.workers)):
+        if result is None:
+            continue
+        path, count, cursors[org] = result
+        save_cursors(cursors, args.cursors)
+        print(f"{org}: {count} new events" + (f" in {path}" if path else ""))
+        if path:
+            paths.append(path)
+    if args.ingest and paths:
+        args.exports = paths
+        do_ingest(args)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--store",
+        default=DEFAULT_STORE,
+        help=f"audit log database (default {DEFAULT_STORE})",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add exports to the store")
+    ingest.add_argument(
+        "exports", nargs="+", help="JSON or NDJSON (optionally .gz) audit log files"
+    )
+    ingest.set_defaults(func=do_ingest)
+
+    query = commands.add_parser("query", help="print matching events, as CSV")
+    query.add_argument(
+        "--actor", action="append", help="events by this login (may be repeated)"
+    )
+    query.add_argument(
+        "--owners-of", metavar="ORG", help="events by the current owners of ORG"
+    )
+    query.add_argument("--action", help="action, or glob such as 'org.*'")
+    query.add_argument("--repo", help="events for this org/repo")
+    query.add_argument("--org", help="events in this org")
+    query.add_argument("--days", type=int, help="only the last DAYS days")
+    query.add_argument(
+        "--json", action="store_true", help="print whole events, as NDJSON"
+    )
+    add_snapshot_argument(query)
+    query.set_defaults(func=do_query)
+
+    fetch = commands.add_parser("fetch", help="pull new events from the API")
+    fetch.add_argument("orgs", nargs="+", help="orgs to fetch")
+    fetch.add_argument(
+        "--workers", type=int, default=4, help="orgs to fetch at once (default 4)"
+    )
+    fetch.add_argument(
+        "--out-dir",
+        default=FETCH_DIR,
+        help=f"where to write the events (default {FETCH_DIR})",
+    )
+    fetch.add_argument(
+        "--cursors",
+        default=CURSOR_FILE,
+        help=f"where each org got to (default {CURSOR_FILE})",
+    )
+    fetch.add_argument(
+        "--ingest", action="store_true", help="also add the new events to the store"
+    )
+    fetch.set_defaults(func=do_fetch)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARN, format="%(asctime)s %(message)s")
+    main()
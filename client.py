@@ -1,11 +1,58 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import hashlib
+import json
+import logging
 import os
+import random
+import sqlite3
+import threading
 import time
+import urllib.parse
 
-from github3 import login
+import github3
+import requests
+from github3 import GitHub
+from github3.session import GitHubSession
 
 
 CREDENTIALS_FILE = ".credentials"
+HTTP_CACHE_FILE = os.path.join(os.path.dirname(__file__), "cache", "http.sqlite")
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# Published budgets per resource, as (requests, window in seconds). These
+# only seed the token buckets -- the X-RateLimit-* headers on each response
+# are the real source of truth.
+DEFAULT_BUDGETS = {
+    "core": (5000, 3600),
+    "search": (30, 60),
+    "code_search": (10, 60),
+    "graphql": (5000, 3600),
+}
+# GitHub rejects longer search queries
+MAX_QUERY_LENGTH = 256
+CODE_SEARCH_URL = "https://api.github.com/search/code"
+PER_PAGE = 100
+# GitHub won't return search results past the first 1000
+MAX_RESULTS = 1000
+# the orgs code searches cover by default
+DEFAULT_ORGS = [
+    "mozilla",
+    "mozilla-conduit",
+    "mozilla-platform-ops",
+    "mozilla-releng",
+    "mozilla-services",
+    "taskcluster",
+]
+MAX_RETRIES = 5
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 120.0
+# attempts at a single write (add member, close PR, ...) on transient errors
+STEP_ATTEMPTS = 3
+TRANSIENT_ERRORS = (github3.exceptions.ServerError, github3.exceptions.TransportError)
 
 
 def get_token():
@@ -22,31 +69,574 @@ def get_token():
 # get_token()
 
 
-def get_github3_client():
-    token = get_token()
-    gh = login(token=token)
-    return gh
+def resource_for(url):
+    """Guess which rate limit bucket a request will be charged to.
 
+    GitHub tells us the answer in the X-RateLimit-Resource header, but
+    we need to know before the request is sent.
+    """
+    path = urllib.parse.urlparse(url).path
+    if path.endswith("/graphql"):
+        return "graphql"
+    if path.startswith("/search/code"):
+        return "code_search"
+    if path.startswith("/search/"):
+        return "search"
+    return "core"
 
-def sleep_if_rate_limited(gh, verbose=False):
-    rates = gh.rate_limit()
 
-    if not rates["resources"]["search"]["remaining"]:
-        reset_epoch = rates["resources"]["search"]["reset"]
+class TokenBucket:
+    """Pacing for a single rate limit resource.
+
+    Tokens refill continuously at the published rate, but are clamped to
+    whatever the server last said was remaining. Once the server reports
+    the budget as spent, nothing is released until the reset time.
+    """
+
+    def __init__(self, limit, window, reserve=0):
+        self.limit = limit
+        self.window = window
+        self.reserve = reserve
+        self.tokens = float(limit)
+        self.remaining = None
+        self.reset = None
+        self.stamp = time.time()
+
+    @property
+    def rate(self):
+        return self.limit / self.window
+
+    def _refill(self, now):
+        if self.reset is not None and now >= self.reset:
+            # window rolled over, server will have restored the budget
+            self.tokens = float(self.limit)
+            self.remaining = self.reset = None
+        else:
+            elapsed = max(now - self.stamp, 0)
+            self.tokens = min(float(self.limit), self.tokens + elapsed * self.rate)
+            if self.remaining is not None:
+                self.tokens = min(self.tokens, self.remaining - self.reserve)
+        self.stamp = now
+
+    def delay(self, now):
+        """Return seconds to wait before a token is available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.remaining is not None and self.remaining <= self.reserve:
+            return max(self.reset - now, 0) + random.uniform(0, 1)
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def update(self, limit, remaining, reset):
+        if limit:
+            self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.tokens = min(self.tokens, remaining - self.reserve)
+
+
+class RateLimitScheduler:
+    """Shared pacing for every request made through our sessions.
+
+    A single instance is shared by all sessions created by this module,
+    so concurrent workers draw from the same budget. State is learned
+    passively from response headers -- we never poll /rate_limit.
+    """
+
+    def __init__(self, budgets=None, reserve=0):
+        self.lock = threading.Lock()
+        self.buckets = {
+            name: TokenBucket(limit, window, reserve)
+            for name, (limit, window) in (budgets or DEFAULT_BUDGETS).items()
+        }
+        # secondary rate limits apply to the whole token, so every worker
+        # has to back off, not just the one that tripped it.
+        self.paused_until = 0.0
+
+    def bucket(self, resource):
+        if resource not in self.buckets:
+            limit, window = DEFAULT_BUDGETS["core"]
+            self.buckets[resource] = TokenBucket(limit, window)
+        return self.buckets[resource]
+
+    def acquire(self, resource="core"):
+        """Block until a request against resource may be sent."""
+        while True:
+            with self.lock:
+                now = time.time()
+                nap = max(self.paused_until - now, 0)
+                if not nap:
+                    nap = self.bucket(resource).delay(now)
+                if not nap:
+                    self.bucket(resource).take()
+                    return
+            logger.info("rate limit: napping %.1f seconds for %s", nap, resource)
+            time.sleep(nap)
+
+    def wait(self, resource="core"):
+        """Block until a token is available, without consuming it."""
+        while True:
+            with self.lock:
+                now = time.time()
+                nap = max(self.paused_until - now, 0)
+                nap = nap or self.bucket(resource).delay(now)
+            if not nap:
+                return
+            logger.info("rate limit: napping %.1f seconds for %s", nap, resource)
+            time.sleep(nap)
+
+    def observe(self, response, attempt=0):
+        """Learn from a response; return seconds to wait before a retry.
+
+        Returns None when the response should be handed back to the
+        caller as is.
+        """
+        headers = response.headers
+        resource = headers.get("X-RateLimit-Resource") or resource_for(
+            response.request.url if response.request else response.url
+        )
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset = int(headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            limit = remaining = reset = None
+        with self.lock:
+            if remaining is not None:
+                self.bucket(resource).update(limit, remaining, reset)
+            if response.status_code not in (403, 429) or attempt >= MAX_RETRIES:
+                return None
+            now = time.time()
+            retry_after = headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    delay = BACKOFF_BASE
+            elif remaining == 0:
+                delay = max(reset - now, 0) + 1
+            elif "secondary rate limit" in response.text.lower():
+                delay = BACKOFF_BASE * 2**attempt
+            else:
+                # plain permission problem - not ours to retry
+                return None
+            # full jitter, so concurrent workers don't retry in lock step
+            delay = min(delay, BACKOFF_CAP)
+            delay += random.uniform(0, delay / 2 + 1)
+            self.paused_until = max(self.paused_until, now + delay)
+        logger.warning(
+            "rate limited on %s (attempt %d), retrying in %.1f seconds",
+            resource,
+            attempt + 1,
+            delay,
+        )
+        return delay
+
+    def refund(self, resource):
+        """Return a token for a request GitHub didn't charge us for."""
+        with self.lock:
+            bucket = self.bucket(resource)
+            bucket.tokens = min(float(bucket.limit), bucket.tokens + 1)
+
+    def snapshot(self):
+        """Current view of each resource, for reporting."""
+        with self.lock:
+            return {
+                name: {
+                    "limit": b.limit,
+                    "remaining": b.remaining,
+                    "reset": b.reset,
+                }
+                for name, b in self.buckets.items()
+            }
+
+
+_scheduler = RateLimitScheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+class HTTPCache:
+    """On disk store of GET responses, for conditional requests.
+
+    GitHub doesn't charge 304 Not Modified responses against the rate
+    limit, so we remember the ETag/Last-Modified of every response (each
+    page of a listing is its own URL) and replay the stored body when the
+    server says nothing changed. Least recently used entries are evicted
+    once the store grows past max_bytes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+    """
+
+    def __init__(self, path=HTTP_CACHE_FILE, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        self.total_bytes = total
+
+    @staticmethod
+    def key(url, headers, credential=""):
+        # responses differ by media type and by who is asking
+        parts = [url, headers.get("Accept", ""), credential]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT etag, last_modified, headers, body FROM responses"
+                " WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, headers, body = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": json.loads(headers),
+            "body": body,
+        }
+
+    def touch(self, key):
+        with self.lock:
+            self.hits += 1
+            self.db.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+
+    def put(self, key, response):
+        body = response.content
+        headers = {
+            k: v for k, v in response.headers.items() if not k.startswith("X-RateLimit")
+        }
+        with self.lock:
+            self.misses += 1
+            old = self.db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.total_bytes -= old[0] if old else 0
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, url, etag, last_modified, headers, body, size, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    response.url,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    json.dumps(headers),
+                    body,
+                    len(body),
+                    time.time(),
+                ),
+            )
+            self.total_bytes += len(body)
+            self._evict()
+            self.db.commit()
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            row = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.total_bytes -= row[1]
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self.total_bytes,
+        }
+
+
+_http_cache = None
+
 
-        reset_dt, now = datetime.utcfromtimestamp(reset_epoch), datetime.utcnow()
+def get_http_cache():
+    """Shared HTTPCache, or None if disabled via GITHUB_HTTP_CACHE=0."""
+    global _http_cache
+    if _http_cache is None and os.environ.get("GITHUB_HTTP_CACHE", "1") != "0":
+        _http_cache = HTTPCache()
+    return _http_cache
 
-        if reset_dt > now:
-            sleep_secs = (reset_dt - now).seconds + 1
 
-            if verbose:
-                print(
-                    (
-                        "sleeping for",
-                        sleep_secs,
-                        "got rate limit",
-                        rates["resources"]["search"],
-                    )
+class ScheduledSessionMixin:
+    """Route every request through the shared RateLimitScheduler.
+
+    GET requests also go through the shared HTTPCache, unless the caller
+    is already doing its own conditional request.
+    """
+
+    scheduler = None
+    http_cache = None
+
+    def credential(self, headers, auth=None):
+        """Who a request is made as, for keying the cache.
+
+        requests sessions carry the token in the Authorization header;
+        github3's sessions carry it in their auth (a TokenAuth).
+        """
+        auth = auth or self.auth
+        if headers.get("Authorization"):
+            return headers["Authorization"]
+        if getattr(auth, "token", None):
+            return f"token {auth.token}"
+        return repr(auth) if auth else ""
+
+    def request(self, method, url, *args, **kwargs):
+        scheduler = self.scheduler or get_scheduler()
+        cache = self.http_cache or get_http_cache()
+        resource = resource_for(url)
+        key = entry = None
+        if cache is not None and method.upper() == "GET" and not args:
+            headers = dict(self.headers)
+            headers.update(kwargs.get("headers") or {})
+            if not {"If-None-Match", "If-Modified-Since"} & set(headers):
+                full_url = (
+                    requests.Request("GET", url, params=kwargs.get("params"))
+                    .prepare()
+                    .url
+                )
+                key = cache.key(
+                    full_url, headers, self.credential(headers, kwargs.get("auth"))
                 )
+                entry = cache.get(key)
+                if entry:
+                    conditional = {}
+                    if entry["etag"]:
+                        conditional["If-None-Match"] = entry["etag"]
+                    if entry["last_modified"]:
+                        conditional["If-Modified-Since"] = entry["last_modified"]
+                    kwargs["headers"] = dict(kwargs.get("headers") or {})
+                    kwargs["headers"].update(conditional)
+        attempt = 0
+        while True:
+            scheduler.acquire(resource)
+            response = super().request(method, url, *args, **kwargs)
+            delay = scheduler.observe(response, attempt)
+            if delay is None:
+                break
+            time.sleep(delay)
+            attempt += 1
+        if key is None:
+            return response
+        if response.status_code == 304 and entry:
+            cache.touch(key)
+            scheduler.refund(resource)
+            return replay(response, entry)
+        if response.status_code == 200 and (
+            response.headers.get("ETag") or response.headers.get("Last-Modified")
+        ):
+            cache.put(key, response)
+        else:
+            cache.miss()
+        return response
+
+
+def replay(not_modified, entry):
+    """Turn a 304 into the 200 it stands for, using the stored body."""
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = "OK"
+    response.headers.update(entry["headers"])
+    # keep the live rate limit (and other) headers from the server
+    response.headers.update(not_modified.headers)
+    response._content = entry["body"]
+    response.url = not_modified.url
+    response.request = not_modified.request
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.elapsed = not_modified.elapsed
+    response.history = not_modified.history + [not_modified]
+    response.from_cache = True
+    return response
+
+
+class ScheduledGitHubSession(ScheduledSessionMixin, GitHubSession):
+    pass
+
+
+class ScheduledSession(ScheduledSessionMixin, requests.Session):
+    pass
+
+
+def retry_step(step, description, attempts=STEP_ATTEMPTS):
+    """Call step(attempt) until it doesn't raise a transient error.
+
+    Rate limits are already retried by the session; this covers server
+    and connection errors. step is told the attempt number, so it can
+    check whether an earlier attempt got through before the error
+    (steps must be idempotent).
+    """
+    for attempt in range(attempts):
+        try:
+            return step(attempt)
+        except TRANSIENT_ERRORS as e:
+            if attempt + 1 == attempts:
+                raise
+            logger.warning("Retrying %s after: %s", description, e)
+            time.sleep(2**attempt)
+
+
+def map_concurrently(func, items, workers=1):
+    """Like map(), but with up to workers calls in flight at once.
+
+    Results are yielded in the same order as items, regardless of which
+    call finishes first. Only a small window of items is consumed ahead
+    of the caller, so lazy iterators (e.g. github3 listings) stay lazy.
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def paginate(session, url, params=None, per_page=100):
+    """Yield the items of a REST listing, a page at a time, as they arrive.
+
+    Follows the Link header's "next" relation until there isn't one.
+    """
+    params = dict(params or {}, per_page=per_page)
+    while url:
+        response = session.get(url, params=params)
+        response.raise_for_status()
+        yield from response.json()
+        url = response.links.get("next", {}).get("url")
+        # the next url already carries the query string
+        params = None
+
+
+def paginate_concurrently(session, url, params=None, per_page=100, workers=4):
+    """Like paginate(), but fetch pages 2..last up to workers at a time.
 
-            time.sleep(sleep_secs)
+    The first page's Link header tells us how many pages there are; the
+    items are still yielded in order.
+    """
+    params = dict(params or {}, per_page=per_page)
+    response = session.get(url, params=params)
+    response.raise_for_status()
+    yield from response.json()
+    last = response.links.get("last", {}).get("url")
+    if not last:
+        return
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(last).query)
+    pages = range(2, int(query["page"][0]) + 1)
+
+    def fetch(page):
+        response = session.get(url, params=dict(params, page=page))
+        response.raise_for_status()
+        return response.json()
+
+    for items in map_concurrently(fetch, pages, workers):
+        yield from items
+
+
+def qualified_query(qualifier, values, query=""):
+    return " ".join([f"{qualifier}:{value}" for value in values] + [query]).strip()
+
+
+def pack_qualifiers(qualifier, values, query=""):
+    """Split values into groups that fit one "qualifier:a qualifier:b query".
+
+    GitHub ORs repeated org:, repo: and user: qualifiers, and they don't
+    count towards the limit on boolean operators.
+    """
+    groups, group = [], []
+    for value in values:
+        candidate = group + [value]
+        too_long = len(qualified_query(qualifier, candidate, query)) > MAX_QUERY_LENGTH
+        if group and too_long:
+            groups.append(group)
+            candidate = [value]
+        group = candidate
+    if group:
+        groups.append(group)
+    return groups
+
+
+def org_query(orgs, query):
+    return qualified_query("org", orgs, query)
+
+
+def pack_orgs(orgs, query):
+    """Split orgs into groups whose "org:a org:b ... query" fits one search."""
+    return pack_qualifiers("org", orgs, query)
+
+
+def get_github3_client():
+    token = get_token()
+    gh = GitHub(token=token, session=ScheduledGitHubSession())
+    return gh
+
+
+def get_requests_session():
+    """Return an authenticated requests session for raw API calls."""
+    session = ScheduledSession()
+    session.headers.update(
+        {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"token {get_token()}",
+        }
+    )
+    return session
+
+
+def sleep_if_rate_limited(gh, verbose=False):
+    # The scheduler already knows the search budget from prior responses,
+    # so there's no need to spend a request on /rate_limit.
+    scheduler = getattr(gh.session, "scheduler", None) or get_scheduler()
+    if verbose:
+        search = scheduler.snapshot()["search"]
+        if search["remaining"] == 0:
+            print(
+                (
+                    "sleeping until",
+                    datetime.utcfromtimestamp(search["reset"]),
+                    "got rate limit",
+                    search,
+                )
+            )
+    scheduler.wait("search")
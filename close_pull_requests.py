@@ -6,9 +6,18 @@ Provide a closing comment, and print the lock URL if desired
 
 import argparse
 import logging
+
+import github3
 import yaml
 
-from client import get_github3_client
+from client import (
+    MAX_RESULTS,
+    get_github3_client,
+    map_concurrently,
+    pack_qualifiers,
+    qualified_query,
+    retry_step,
+)
 
 DEFAULT_MESSAGE = (
     "We do not use Pull Requests on this repo. Please see "
@@ -39,61 +48,142 @@ def lock_pr(repo, number):
     return success
 
 
+def already_commented(pr, message, login):
+    return any(c.user.login == login and c.body == message for c in pr.issue_comments())
+
+
+def close_pr(repo, pr, message, lock, login):
+    """Comment on, close and maybe lock pr; return False if lock failed."""
+    name = f"{repo.full_name}#{pr.number}"
+
+    def comment(attempt):
+        # an earlier attempt may have posted it, then failed
+        if attempt and already_commented(pr, message, login):
+            return
+        pr.create_comment(message)
+
+    retry_step(comment, f"comment on {name}")
+    # closing & locking are idempotent, just repeat them
+    retry_step(lambda attempt: pr.close(), f"close of {name}")
+    logger.info("Closed PR %s", name)
+    if lock:
+        return retry_step(lambda attempt: lock_pr(repo, pr.number), f"lock of {name}")
+    return True
+
+
 def close_prs(
-    gh, organization=None, repository=None, message=None, lock=False, close=False
+    gh,
+    organization=None,
+    repository=None,
+    message=None,
+    lock=False,
+    close=False,
+    workers=1,
+    login=None,
 ):
+    """Handle the open PRs of one repository; return how many there were."""
     if message is None:
         message = DEFAULT_MESSAGE
     try:
         repo = gh.repository(organization, repository)
         logger.debug("Checking for PRs in %s", repo.name)
-        for pr in repo.pull_requests(state="open"):
-            logger.debug(
-                "Examining PR %s for %s/%s", pr.number, organization, repository
-            )
-            if close:
-                pr.create_comment(message)
-                pr.close()
-                logger.info(
-                    "Closed PR %s for %s/%s", pr.number, organization, repository
-                )
-                if lock:
-                    success = lock_pr(repo, pr.number)
-                    if not success:
-                        print(
-                            "Lock PR manually: "
-                            "https://github.com/%s/%s/pull/%s"
-                            % (organization, repository, pr.number)
-                        )
-            else:
-                print(
-                    "PR %s open for %s/%s at: "
-                    "https://github.com/%s/%s/pull/%s"
-                    % (
-                        pr.number,
-                        organization,
-                        repository,
-                        organization,
-                        repository,
-                        pr.number,
-                    )
-                )
-        else:
-            logger.debug("no open PR's in %s!", repo.name)
-    except AttributeError:
+        prs = list(repo.pull_requests(state="open"))
+    except (AttributeError, github3.exceptions.NotFoundError):
         logger.error("No access to repository %s/%s", organization, repository)
         update_exit_code(1)
+        return 0
+    if not prs:
+        logger.debug("no open PR's in %s!", repo.name)
+        return 0
+    if not close:
+        for pr in prs:
+            print(
+                "PR %s open for %s/%s at: "
+                "https://github.com/%s/%s/pull/%s"
+                % (
+                    pr.number,
+                    organization,
+                    repository,
+                    organization,
+                    repository,
+                    pr.number,
+                )
+            )
+        return len(prs)
+
+    def handle(pr):
+        try:
+            return pr, close_pr(repo, pr, message, lock, login)
+        except github3.exceptions.GitHubException as e:
+            logger.error(
+                "Failed on PR %s for %s/%s: %s", pr.number, organization, repository, e
+            )
+            update_exit_code(1)
+            return pr, None
+
+    for pr, locked in map_concurrently(handle, prs, workers):
+        if locked is False:
+            print(
+                "Lock PR manually: "
+                "https://github.com/%s/%s/pull/%s"
+                % (organization, repository, pr.number)
+            )
+    return len(prs)
+
+
+def repos_with_open_prs(gh, names):
+    """Return which of names ("org/repo") have open PRs, lower cased.
+
+    Uses one search per group of repositories that fits in a query,
+    rather than listing PRs of every repository. If a group's search
+    can't return every match (more than MAX_RESULTS, or timed out), all
+    of that group is assumed to have open PRs.
+    """
+    found = set()
+    for group in pack_qualifiers("repo", names, "is:pr is:open"):
+        results = gh.search_issues(qualified_query("repo", group, "is:pr is:open"))
+        for result in results:
+            if results.total_count > MAX_RESULTS:
+                break
+            url = result.issue.as_dict()["repository_url"]
+            found.add("/".join(url.split("/")[-2:]).lower())
+        response = results.last_response
+        incomplete = response is not None and response.json().get("incomplete_results")
+        if results.total_count > MAX_RESULTS or incomplete:
+            logger.warning(
+                "Search for open PRs in %d repositories incomplete, checking each",
+                len(group),
+            )
+            found.update(name.lower() for name in group)
+    return found
 
 
-def close_configured_prs(gh, config_file, dry_run=False):
+def close_configured_prs(
+    gh, config_file, dry_run=False, workers=4, precheck=True, login=None
+):
     config = []
     with open(config_file, "rb") as yaml_file:
         config = yaml.safe_load(yaml_file)
-    for repository in config:
+    if precheck:
+        busy = repos_with_open_prs(
+            gh, [f"{r['organization']}/{r['repository']}" for r in config]
+        )
+        configured = len(config)
+        config = [
+            r
+            for r in config
+            if f"{r['organization']}/{r['repository']}".lower() in busy
+        ]
+        logger.debug("%d repositories have no open PRs", configured - len(config))
+
+    def handle(repository):
         if dry_run:
             repository["lock"] = False
             repository["close"] = False
-        close_prs(gh, **repository)
+        return close_prs(gh, workers=workers, login=login, **repository)
+
+    total = sum(map_concurrently(handle, config, workers))
+    logger.info("%d open PRs in %d repositories", total, len(config))
 
 
 def parse_args():
@@ -115,6 +205,19 @@ def parse_args():
     parser.add_argument(
         "--dry-run", action="store_true", help="Just show, regardless of config"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="repositories, and PRs in each, to handle at once (default 4)",
+    )
+    parser.add_argument(
+        "--no-precheck",
+        dest="precheck",
+        action="store_false",
+        help="look at every configured repository, even if search finds no "
+        "open PRs (the search index can lag by a minute or so)",
+    )
     return parser.parse_args()
 
 
@@ -135,9 +238,18 @@ def main():
             close=args.close,
             lock=args.lock,
             message=args.message,
+            workers=args.workers,
+            login=me.login,
         )
     else:
-        close_configured_prs(gh, args.config, args.dry_run)
+        close_configured_prs(
+            gh,
+            args.config,
+            args.dry_run,
+            args.workers,
+            args.precheck,
+            login=me.login,
+        )
 
 
 if __name__ == "__main__":
@@ -1,27 +1,201 @@
 __doc__ = """Searches for code across multiple github orgs."""
 
+_epilog = """
+Orgs are packed into as few searches as the query length allows, and the
+searches run concurrently, paced by the shared code search budget. A
+search that matches more than the API will return (1000 results) is
+split in two, by orgs, until each part fits; the parts run concurrently
+too. Results are written as they arrive, each file once. If any search
+fails, the output is incomplete and the exit status is 1.
+
+--fields picks what to keep of each result, as dotted paths into the
+API's result items (e.g. repository.full_name,path,html_url); nothing
+else is held in memory.
+"""
+
 import argparse
-import jsonstreams
+import csv
+import json
+import logging
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
 
 from client import (
-    get_github3_client,
-    sleep_if_rate_limited,
+    CODE_SEARCH_URL,
+    DEFAULT_ORGS,
+    MAX_RESULTS,
+    PER_PAGE,
+    get_requests_session,
+    org_query,
+    pack_orgs,
 )
 
+DEFAULT_FIELDS = ["repository.owner.login", "repository.name", "path"]
+# heading & width of the text format's columns
+COLUMNS = {
+    "repository.owner.login": ("org", 16),
+    "repository.name": ("repo", 32),
+    "path": ("file path", 64),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def project(item, fields):
+    """Return {field: value} for each dotted field path of item."""
+    record = {}
+    for field in fields:
+        value = item
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        record[field] = value
+    return record
+
+
+class TooManyResults(Exception):
+    """The search matches more than split_at results."""
+
+
+def search_pages(session, query, split_at=None):
+    """Yield the items of a code search, a page at a time, as they arrive.
+
+    If split_at is given and the first page reports more results than
+    that, raise TooManyResults before yielding anything -- the caller
+    should narrow the query.
+    """
+    page = 1
+    while True:
+        response = session.get(
+            CODE_SEARCH_URL, params={"q": query, "per_page": PER_PAGE, "page": page}
+        )
+        if response.status_code == 422 and page > 1:
+            # asked past the last page the index will give us
+            return
+        response.raise_for_status()
+        body = response.json()
+        total = body.get("total_count", 0)
+        if page == 1 and split_at is not None and total > split_at:
+            raise TooManyResults(total)
+        if page == 1 and total > MAX_RESULTS:
+            logger.warning(
+                "%d results, only the first %d can be fetched: %s",
+                total,
+                MAX_RESULTS,
+                query,
+            )
+        if body.get("incomplete_results"):
+            logger.warning("Search timed out, results incomplete: %s", query)
+        items = body.get("items", [])
+        yield from items
+        available = min(total, MAX_RESULTS)
+        if len(items) < PER_PAGE or page * PER_PAGE >= available:
+            return
+        page += 1
+
+
+def stream_results(session, query, org_groups, fields, workers=4):
+    """Yield the projected results of query in each group of orgs, as they arrive.
+
+    Groups are searched up to workers at a time; a file found by more
+    than one search (or on two pages, as the index shifts) is only
+    yielded once. Like acl_search's CodeSearch.search_packed(), a group
+    matching more than the API will return is split in two, and the
+    halves go back on the pool.
+
+    If a search fails, the others stop at their next result and the
+    error is raised here.
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def run(orgs):
+        split_at = MAX_RESULTS if len(orgs) > 1 else None
+        try:
+            for item in search_pages(session, org_query(orgs, query), split_at):
+                if stop.is_set():
+                    break
+                key = (item["repository"]["full_name"], item["path"])
+                results.put(("result", (key, project(item, fields))))
+        except TooManyResults as e:
+            logger.info("%d results, splitting: %s", e.args[0], org_query(orgs, query))
+            half = len(orgs) // 2
+            results.put(("split", [orgs[:half], orgs[half:]]))
+        except Exception as e:
+            results.put(("error", e))
+        finally:
+            results.put(("done", None))
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        try:
+            for orgs in org_groups:
+                pool.submit(run, orgs)
+            remaining = len(org_groups)
+            while remaining:
+                kind, value = results.get()
+                if kind == "done":
+                    remaining -= 1
+                elif kind == "split":
+                    for orgs in value:
+                        pool.submit(run, orgs)
+                    remaining += len(value)
+                elif kind == "error":
+                    raise value
+                else:
+                    key, record = value
+                    if key not in seen:
+                        seen.add(key)
+                        yield record
+        finally:
+            stop.set()
+
+
+class TextSink:
+    """Fixed width columns, as code_search has always printed."""
+
+    def __init__(self, out, fields):
+        self.out = out
+        self.columns = [COLUMNS.get(field, (field, 32)) for field in fields]
+        print("".join(f"{h:<{w}}" for h, w in self.columns), file=out)
+
+    def write(self, record):
+        values = ("" if v is None else str(v) for v in record.values())
+        print(
+            "".join(f"{v:<{w}}" for v, (_, w) in zip(values, self.columns)),
+            file=self.out,
+        )
 
-DEFAULT_ORGS = [
-    "mozilla",
-    "mozilla-conduit",
-    "mozilla-platform-ops",
-    "mozilla-releng",
-    "mozilla-services",
-    "taskcluster",
-]
+
+class CSVSink:
+    def __init__(self, out, fields):
+        self.writer = csv.writer(out)
+        self.writer.writerow(fields)
+
+    def write(self, record):
+        self.writer.writerow(record.values())
+
+
+class NDJSONSink:
+    def __init__(self, out, fields):
+        self.out = out
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + "\n")
+
+
+SINKS = {"text": TextSink, "csv": CSVSink, "ndjson": NDJSONSink}
 
 
 def parse_args():
-    parser = argparse.ArgumentParser(description=__doc__)
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
 
     parser.add_argument(
         "query",
@@ -35,10 +209,28 @@ def parse_args():
         help=f"organizations to search (defaults to {DEFAULT_ORGS})",
     )
     parser.add_argument(
-        "--json", help="path to output json results", type=str, default=None
+        "--format", choices=SINKS, default="text", help="output format (text)"
     )
     parser.add_argument(
-        "--verbose", action="store_true", help="print logins for all changes"
+        "--fields",
+        type=lambda s: s.split(","),
+        default=DEFAULT_FIELDS,
+        help="comma separated fields to output (default %s)" % ",".join(DEFAULT_FIELDS),
+    )
+    parser.add_argument(
+        "--json",
+        help="also write the results, as NDJSON, to this path",
+        type=str,
+        default=None,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="searches to run at once (default 4)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="log each query as it's run"
     )
 
     return parser.parse_args()
@@ -46,32 +238,31 @@ def parse_args():
 
 def main():
     args = parse_args()
-    gh = get_github3_client()
-
-    json_fout = (
-        jsonstreams.Stream(jsonstreams.Type.array, args.json, indent=4)
-        if args.json
-        else None
-    )
-
-    for org in args.orgs:
-        full_query = f"org:{org} {args.query}"
-
-        if args.verbose:
-            print(f"searching with query {full_query}")
-
-        sleep_if_rate_limited(gh, verbose=args.verbose)
-
-        print("{:<16}{:<32}{:<64}".format("org", "repo", "file path"))
-        for result in gh.search_code(full_query):
-            print("{0:<16}{1.repository.name:<32}{1.path:<64}".format(org, result))
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    session = get_requests_session()
 
-            if json_fout:
-                json_fout.write(result.to_json())
+    # GitHub ORs repeated org: qualifiers, so search as many orgs at once
+    # as the query length allows
+    org_groups = pack_orgs(args.orgs, args.query)
+    for orgs in org_groups:
+        logger.info("searching with query %s", org_query(orgs, args.query))
 
+    sinks = [SINKS[args.format](sys.stdout, args.fields)]
+    json_fout = open(args.json, "w") if args.json else None
     if json_fout:
-        # must explicitly close -- that's what outputs the closing delimiter
-        json_fout.close()
+        sinks.append(NDJSONSink(json_fout, args.fields))
+    try:
+        for record in stream_results(
+            session, args.query, org_groups, args.fields, args.workers
+        ):
+            for sink in sinks:
+                sink.write(record)
+    except requests.RequestException as e:
+        print(f"Search failed, results are incomplete: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    finally:
+        if json_fout:
+            json_fout.close()
 
 
 if __name__ == "__main__":
@@ -1,71 +1,192 @@
 #!/usr/bin/env python
+"""Report which source repositories of an org lack CONTRIBUTING (or other) files.
+
+Looks only at the top level of each repository's default branch.
+"""
+import argparse
+import csv
+import fnmatch
+import json
+import logging
+import os
 import sys
 
-from client import get_github3_client
-from github3.exceptions import UnprocessableResponseBody, NotFoundError
+import github_graphql
+from client import map_concurrently
 
+_epilog = f"""
+Patterns are shell style, matched case sensitively against the names at
+the top of the default branch, e.g. --file 'CONTRIBUTING*'. --hygiene
+checks for all of CONTRIBUTING*, CODE_OF_CONDUCT*, LICEN[CS]E* and
+SECURITY.md.
 
-def get_files(repo, directory):
-    """Get the files from this repo.
+The top level listing of each repository is cached, by default branch
+sha, in {os.path.join("cache", "root_entries.json")} -- only repositories
+changed since the last run are fetched again.
+"""
 
-    The interface on this for github3.py version 1.0.0a4 is not yet
-    stable, so some coding-by-coincidence is used.
-    """
-    names = None
-    try:
-        response = repo.file_contents(directory)
-    except UnprocessableResponseBody as e:
-        response = e
-        pass
-    except NotFoundError:
-        print(f"\nNo data for {repo.full_name}! (maybe empty)")
-        return names
-    if isinstance(response, UnprocessableResponseBody):
-        # response.body contains json of the directory contents as a list of
-        # dictionaries. The calling code wants a dictionary with file
-        # names as keys.
-        names = {x["name"]: None for x in response.body}
-    else:
-        raise Exception("github3.py behavior changed")
-    return names
+CACHE_FILE = os.path.join(os.path.dirname(__file__), "cache", "root_entries.json")
+HYGIENE_FILES = ("CONTRIBUTING*", "CODE_OF_CONDUCT*", "LICEN[CS]E*", "SECURITY.md")
 
+logger = logging.getLogger(__name__)
 
-if __name__ == "__main__":
-    gh = get_github3_client()
 
-    # Divvy up into repositories that need/do not need a CONTRIBUTING file.
-    good_repos = []
-    bad_repos = []
+class EntriesCache:
+    """Top level names of repositories, keyed by "org/repo" & head sha."""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.repos = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.repos = json.load(f)
+
+    def get(self, full_name, sha):
+        entry = self.repos.get(full_name)
+        if entry and entry["sha"] == sha:
+            return entry["entries"]
+        return None
+
+    def put(self, full_name, sha, entries):
+        self.repos[full_name] = {"sha": sha, "entries": entries}
 
-    repos = gh.organization("mozilla-services").repositories(type="sources")
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.repos, f)
+        os.replace(tmp, self.path)
+
+
+def root_entries(org, repos, cache, workers=4):
+    """Return {repo name: [top level names] or None (empty repository)}.
+
+    repos are from github_graphql.org_repositories(); anything not cached
+    at its current sha is fetched, many repositories per query.
+    """
+    entries, todo = {}, []
     for repo in repos:
-        # All files in this repo's default branch.
-        # {'filename.md': Content(), 'filename2.txt': Contents(), ...}
-        files = get_files(repo, "/")
-
-        if files:
-            contrib_files = [
-                f for f in list(files.keys()) if f.startswith("CONTRIBUTING")
-            ]
-        else:
-            contrib_files = None
-
-        if contrib_files:
-            good_repos.append(repo.name)
-        else:
-            bad_repos.append(repo.name)
-
-        sys.stderr.write(".")
-
-    good_repos.sort()
-    print()
-    print("The following repos HAVE a CONTRIBUTING file:")
-    for r in good_repos:
-        print(r)
-
-    bad_repos.sort()
-    print()
-    print()
-    print("The following repos DO NOT HAVE a CONTRIBUTING file:")
-    for r in bad_repos:
-        print(r)
+        if repo["sha"] is None:
+            entries[repo["name"]] = None
+            continue
+        entries[repo["name"]] = cache.get(f"{org}/{repo['name']}", repo["sha"])
+        if entries[repo["name"]] is None:
+            todo.append(repo)
+    logger.info("%d of %d repositories cached", len(entries) - len(todo), len(entries))
+    batches = list(github_graphql.chunks(todo, github_graphql.TREES_PER_QUERY))
+    for batch, found in zip(
+        batches,
+        map_concurrently(
+            lambda batch: github_graphql.root_entries(
+                [(org, r["name"]) for r in batch]
+            ),
+            batches,
+            workers,
+        ),
+    ):
+        for repo in batch:
+            names = found.get(f"{org}/{repo['name']}")
+            if names is not None:
+                cache.put(f"{org}/{repo['name']}", repo["sha"], names)
+            entries[repo["name"]] = names
+    return entries
+
+
+def check_files(entries, patterns):
+    """Return {pattern: (repos having a match, repos without)}, names sorted."""
+    results = {}
+    for pattern in patterns:
+        have, lack = [], []
+        for name, names in sorted(entries.items()):
+            if names and fnmatch.filter(names, pattern):
+                have.append(name)
+            else:
+                lack.append(name)
+        results[pattern] = (have, lack)
+    return results
+
+
+def report_text(results, entries):
+    for name, names in sorted(entries.items()):
+        if names is None:
+            print(f"No data for {name}! (maybe empty)", file=sys.stderr)
+    for pattern, (have, lack) in results.items():
+        print()
+        print(f"The following repos HAVE a {pattern} file:")
+        for r in have:
+            print(r)
+        print()
+        print()
+        print(f"The following repos DO NOT HAVE a {pattern} file:")
+        for r in lack:
+            print(r)
+
+
+def report_csv(results, entries):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["repo"] + list(results))
+    haves = [set(have) for have, _ in results.values()]
+    for name in sorted(entries):
+        writer.writerow([name] + [name in have for have in haves])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--org", default="mozilla-services", help="org to check (mozilla-services)"
+    )
+    parser.add_argument(
+        "--file",
+        dest="patterns",
+        action="append",
+        metavar="PATTERN",
+        help="file name pattern to look for (may be repeated; 'CONTRIBUTING*')",
+    )
+    parser.add_argument(
+        "--hygiene",
+        action="store_true",
+        help="look for all the usual project files (see below)",
+    )
+    parser.add_argument(
+        "--csv", action="store_true", help="one line per repo, True/False per pattern"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="queries (of up to %d repos each) to run at once (default 4)"
+        % github_graphql.TREES_PER_QUERY,
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="ignore, and don't update, the cache"
+    )
+    args = parser.parse_args()
+    patterns = list(args.patterns or [])
+    if args.hygiene:
+        patterns.extend(p for p in HYGIENE_FILES if p not in patterns)
+    args.patterns = patterns or ["CONTRIBUTING*"]
+    return args
+
+
+def main():
+    args = parse_args()
+    cache = EntriesCache(None if args.no_cache else CACHE_FILE)
+    repos = github_graphql.org_repositories(args.org, is_fork=False)
+    entries = root_entries(args.org, repos, cache, args.workers)
+    cache.save()
+    results = check_files(entries, args.patterns)
+    if args.csv:
+        report_csv(results, entries)
+    else:
+        report_text(results, entries)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARN, format="%(asctime)s %(message)s")
+    main()
@@ -2,16 +2,32 @@
 """Report on Service & Web hooks for organization."""
 _epilog = """
 To avoid issues with large organizations and API rate limits, the data
-for each organization is cached in a tinydb database named <org>.db.
-While new repositories will be automatically added, deletes & updates
-are not handled. Manually remove the database to force a full query.
+for each organization is cached in a SQLite database named
+<org>-hooks.sqlite. Each run re-fetches hooks only for repositories that
+are new, have been pushed to or updated since they were cached, or whose
+entry is older than --max-age. Conditional requests are used for those,
+so unchanged hook lists don't count against the rate limit. Repositories
+no longer in the org are dropped from the cache.
+
+Adding or changing a hook doesn't change a repository's pushed_at or
+updated_at, so --max-age (a day by default) bounds how stale the cached
+hooks can be. Use --max-age 0 to revalidate every repository.
 """
 import argparse
 import client
+import json
 import logging
+import sqlite3
+import sys
+import time
 import urllib.parse
 import yaml
-import tinydb
+from snapshot import (
+    DEFAULT_MAX_AGE,
+    Snapshot,
+    SnapshotMissing,
+    add_snapshot_argument,
+)
 
 #     Lore:   swapping hook.test for hook.ping will cause repetition of the
 #             actions.  In particular, a number of repos post to IRC channels
@@ -20,20 +36,6 @@ import tinydb
 logger = logging.getLogger(__name__)
 
 
-def wait_for_karma(gh, min_karma=25, msg=None):
-    while gh:
-        core = gh.rate_limit()["resources"]["core"]
-        if core["remaining"] < min_karma:
-            now = time.time()
-            nap = max(core["reset"] - now, 0.1)
-            logger.info("napping for %s seconds", nap)
-            if msg:
-                logger.info(msg)
-            time.sleep(nap)
-        else:
-            break
-
-
 def get_hook_name(hook):
     # we might have a github3 object or a dictionary - convert to
     # dictionary if not that
@@ -55,48 +57,160 @@ def get_hook_name(hook):
     return name
 
 
+class HookCache:
+    """Per org store of repository hook lists, keyed by repository id."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS repos (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            pushed_at TEXT,
+            updated_at TEXT,
+            etag TEXT,
+            fetched_at REAL NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS repos_name ON repos (name);
+    """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.db.commit()
+        self.db.close()
+
+    def get(self, repo_id):
+        row = self.db.execute(
+            "SELECT pushed_at, updated_at, etag, fetched_at, data"
+            " FROM repos WHERE id = ?",
+            (repo_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        pushed_at, updated_at, etag, fetched_at, data = row
+        return {
+            "pushed_at": pushed_at,
+            "updated_at": updated_at,
+            "etag": etag,
+            "fetched_at": fetched_at,
+            "repo_struct": json.loads(data),
+        }
+
+    def is_fresh(self, entry, repo_struct):
+        if entry is None:
+            return False
+        if (entry["pushed_at"], entry["updated_at"]) != (
+            repo_struct.get("pushed_at"),
+            repo_struct.get("updated_at"),
+        ):
+            return False
+        if self.max_age is not None:
+            return time.time() - entry["fetched_at"] < self.max_age
+        return True
+
+    def put(self, repo_struct, etag):
+        self.db.execute(
+            "INSERT OR REPLACE INTO repos"
+            " (id, name, pushed_at, updated_at, etag, fetched_at, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                repo_struct["id"],
+                repo_struct["name"],
+                repo_struct.get("pushed_at"),
+                repo_struct.get("updated_at"),
+                etag,
+                time.time(),
+                json.dumps(repo_struct),
+            ),
+        )
+        self.db.commit()
+
+    def prune(self, live_ids):
+        """Drop every repository not in live_ids; return count dropped."""
+        cached_ids = {row[0] for row in self.db.execute("SELECT id FROM repos")}
+        gone = cached_ids - set(live_ids)
+        self.db.executemany("DELETE FROM repos WHERE id = ?", [(i,) for i in gone])
+        self.db.commit()
+        return len(gone)
+
+
+def fetch_hooks(repo, cached=None, do_ping=False):
+    """Fetch (and optionally ping) the hooks of one repository.
+
+    If we have a cached entry, the request is conditional, and the cached
+    hook list is reused when GitHub reports no change -- except when
+    pinging, which needs the hooks themselves. Safe to run from a
+    worker thread - it only talks to GitHub, all persistence is left to
+    the caller.
+    """
+    repo_struct = repo.as_dict()
+    hooks = repo.hooks(etag=cached["etag"] if cached and not do_ping else None)
+    hook_objects = list(hooks)
+    if hooks.last_status == 304:
+        hook_list = cached["repo_struct"]["hook_list"]
+    else:
+        hook_list = [hook.as_dict() for hook in hook_objects]
+    repo_struct["hook_list"] = hook_list
+    ping_attempts = ping_fails = 0
+    for hook in hook_objects if do_ping else []:
+        if hook.active:
+            ping_attempts += 1
+            if not hook.ping():
+                ping_fails += 1
+                logger.warning("Ping failed for %s", get_hook_name(hook))
+    etag = hooks.etag or (cached["etag"] if cached else None)
+    return repo_struct, etag, ping_attempts, ping_fails
+
+
 def report_hooks(
-    gh, org, active_only=False, unique_only=False, do_ping=False, yaml_out=False
+    gh,
+    org,
+    active_only=False,
+    unique_only=False,
+    do_ping=False,
+    yaml_out=False,
+    workers=1,
+    max_age=DEFAULT_MAX_AGE,
 ):
     org_handle = gh.organization(org)
-    with tinydb.TinyDB(f"{org}.db") as db:
-        q = tinydb.Query()
+    with HookCache(f"{org}-hooks.sqlite", max_age) as cache:
         org_struct = org_handle.as_dict()
         repo_list = []
         org_struct["repo_list"] = repo_list
         unique_hooks = set()
+        live_ids = []
+        fetched = 0
         msg = "Active" if active_only else "All"
-        for repo in org_handle.repositories():
-            repo_hooks = set()
-            # try for existing data
-            l = db.search(q.name == repo.name)
-            have_data = len(l) == 1
-            if have_data:
-                # already have data
+
+        def with_cache_entries():
+            # cache reads stay on this thread - sqlite connections aren't
+            # shared with the workers
+            for repo in org_handle.repositories():
+                live_ids.append(repo.id)
+                yield repo, cache.get(repo.id)
+
+        def lookup(job):
+            repo, cached = job
+            if not do_ping and cache.is_fresh(cached, repo.as_dict()):
                 logger.debug(f"Already have data for {repo.name}")
-                # load existing data
-                repo_struct = l[0]
-                hook_list = repo_struct["hook_list"]
-                repo_hooks = {get_hook_name(x) for x in hook_list}
-            else:
-                wait_for_karma(gh, 100, msg=f"waiting at {repo.name}")
-                repo_struct = repo.as_dict()
-                hook_list = []
-                repo_struct["hook_list"] = hook_list
-                repo_list.append(repo_struct)
-                ping_attempts = ping_fails = 0
-                for hook in repo.hooks():
-                    wait_for_karma(gh, 100, msg=f"waiting at hooks() for  {repo.name}")
-                    hook_struct = hook.as_dict()
-                    hook_list.append(hook_struct)
-                    name = get_hook_name(hook)
-                    if hook.active or not active_only:
-                        repo_hooks.add(name)
-                    if do_ping and hook.active:
-                        ping_attempts += 1
-                        if not hook.ping():
-                            ping_fails += 1
-                            logger.warning("Ping failed for %s", name)
+                return repo, False, cached["repo_struct"], None, 0, 0
+            return (repo, True) + fetch_hooks(repo, cached, do_ping)
+
+        results = client.map_concurrently(lookup, with_cache_entries(), workers)
+        for result in results:
+            repo, refreshed, repo_struct, etag, ping_attempts, ping_fails = result
+            repo_hooks = {
+                get_hook_name(h)
+                for h in repo_struct["hook_list"]
+                if h["active"] or not active_only
+            }
             if repo_hooks and not unique_only:
                 print(f"{msg} hooks for {repo.name}:")
                 if do_ping:
@@ -104,9 +218,19 @@ def report_hooks(
                 for h in repo_hooks:
                     print(f"    {h:s}")
             unique_hooks = unique_hooks.union(repo_hooks)
+            repo_list.append(repo_struct)
             # now that we're done with this repo, persist the data
-            if not have_data:
-                db.insert(repo_struct)
+            if refreshed:
+                fetched += 1
+                cache.put(repo_struct, etag)
+        dropped = cache.prune(live_ids)
+        logger.info(
+            "%s: %d repositories, %d refreshed, %d dropped from cache",
+            org,
+            len(live_ids),
+            fetched,
+            dropped,
+        )
     if yaml_out:
         print(
             yaml.safe_dump(
@@ -121,13 +245,45 @@ def report_hooks(
             print(h)
 
 
+def report_snapshot_hooks(
+    snapshot, org, active_only=False, unique_only=False, yaml_out=False
+):
+    """Report hooks as recorded in a snapshot database."""
+    org_struct = snapshot.org(org)
+    hooks = snapshot.hooks(org)
+    repo_list = []
+    for repo_struct in snapshot.repos(org):
+        repo_struct["hook_list"] = hooks.get(repo_struct["name"], [])
+        repo_list.append(repo_struct)
+    org_struct["repo_list"] = repo_list
+    unique_hooks = set()
+    msg = "Active" if active_only else "All"
+    for repo_struct in repo_list:
+        repo_hooks = {
+            get_hook_name(h)
+            for h in repo_struct["hook_list"]
+            if h["active"] or not active_only
+        }
+        if repo_hooks and not unique_only and not yaml_out:
+            print(f"{msg} hooks for {repo_struct['name']}:")
+            for h in repo_hooks:
+                print(f"    {h:s}")
+        unique_hooks |= repo_hooks
+    if yaml_out:
+        print(yaml.safe_dump([org_struct]))
+    elif unique_only and unique_hooks:
+        print(f"{msg} hooks for org {org}")
+        for h in unique_hooks:
+            print(h)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description=__doc__, epilog=_epilog)
     parser.add_argument("org", help="Organization", default=["mozilla"], nargs="*")
     parser.add_argument(
         "--active",
         action="store_true",
-        help="Show active hooks only (not for cached repositories)",
+        help="Show active hooks only",
     )
     parser.add_argument(
         "--unique", help="Show unique hook names only", action="store_true"
@@ -135,23 +291,59 @@ def parse_args():
     parser.add_argument(
         "--ping",
         action="store_true",
-        help="Ping all hooks (not for cached repositories)",
+        help="Ping all hooks (forces a refresh of every repository)",
     )
     parser.add_argument("--yaml", help="Yaml ouput only", action="store_true")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Fetch hooks for this many repositories at once (default 1)",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=DEFAULT_MAX_AGE / 3600,
+        metavar="HOURS",
+        help="Re-fetch cached hooks older than this, even if the repository"
+        " looks unchanged (default %(default)g)",
+    )
+    add_snapshot_argument(parser)
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
+    if args.from_snapshot:
+        snapshot = Snapshot(args.from_snapshot, read_only=True)
+        exit_code = 0
+        for org in args.org:
+            try:
+                report_snapshot_hooks(
+                    snapshot, org, args.active, args.unique, args.yaml
+                )
+            except SnapshotMissing as e:
+                print(f"Error: {e}", file=sys.stderr)
+                exit_code = 1
+        return exit_code
     gh = client.get_github3_client()
     for org in args.org:
-        report_hooks(gh, org, args.active, args.unique, args.ping, args.yaml)
+        report_hooks(
+            gh,
+            org,
+            args.active,
+            args.unique,
+            args.ping,
+            args.yaml,
+            args.workers,
+            args.max_age * 3600,
+        )
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
     logging.getLogger("github3").setLevel(logging.WARNING)
     try:
-        main()
+        raise SystemExit(main())
     except KeyboardInterrupt:
         raise SystemExit
@@ -16,13 +16,17 @@ import base64
 import logging  # NOQA
 import json
 import sys
+import threading
 import time
 import typing
 from collections import defaultdict  # NOQA
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import argcomplete
 import github3  # NOQA
-from client import get_github3_client  # NOQA
+import github_graphql  # NOQA
+from client import get_github3_client, map_concurrently, paginate  # NOQA
+from snapshot import Snapshot, add_snapshot_argument  # NOQA
 
 logger = logging.getLogger(__name__)
 DEBUG = False
@@ -33,6 +37,95 @@ def jsonl_out(d):
     print(json.dumps(d))
 
 
+# Future of owner details, by login -- many owners own several orgs. The
+# first thread to ask for a login fetches it, any others wait for that.
+OWNER_DETAILS = {}
+OWNER_DETAILS_LOCK = threading.Lock()
+
+
+def owner_details(gh, login):
+    with OWNER_DETAILS_LOCK:
+        future = OWNER_DETAILS.get(login)
+        fetching = future is None
+        if fetching:
+            future = OWNER_DETAILS[login] = Future()
+    if fetching:
+        try:
+            owner = gh.user(login)  # get name
+            future.set_result(
+                {
+                    "name": owner.name,
+                    "login": owner.login,
+                    "id": owner.id,
+                    "node_id": owner.node_id,
+                    "email": owner.email,
+                }
+            )
+        except Exception as e:
+            # let a later call try again
+            with OWNER_DETAILS_LOCK:
+                del OWNER_DETAILS[login]
+            future.set_exception(e)
+    return future.result()
+
+
+def get_owners(gh, org_name, use_graphql=False, snapshot=None, workers=8, pool=None):
+    """Yield owner details (name, login, email, ids) for org.
+
+    Details are fetched workers at a time -- or on pool, if given, so
+    several orgs can share one.
+    """
+    if snapshot is not None:
+        yield from snapshot.members(org_name, role="admin")
+    elif use_graphql:
+        # names & emails come back with the listing, 100 per request
+        yield from github_graphql.org_members(org_name, role="admin")
+    elif pool is not None:
+        logins = [o.login for o in gh.organization(org_name).members(role="admin")]
+        futures = [pool.submit(owner_details, gh, login) for login in logins]
+        yield from (future.result() for future in futures)
+    else:
+        logins = (o.login for o in gh.organization(org_name).members(role="admin"))
+        yield from map_concurrently(
+            lambda login: owner_details(gh, login), logins, workers
+        )
+
+
+def my_owned_orgs(gh):
+    """Return the logins of the orgs the authenticated user owns.
+
+    One listing of the user's memberships, which include the role.
+    """
+    memberships = paginate(
+        gh.session, gh.session.base_url + "/user/memberships/orgs", {"state": "active"}
+    )
+    return sorted(
+        m["organization"]["login"] for m in memberships if m["role"] == "admin"
+    )
+
+
+def fetch_info(
+    gh,
+    org_name,
+    show_owners=False,
+    use_graphql=False,
+    snapshot=None,
+    workers=8,
+    pool=None,
+):
+    """Return (org dict, list of owner details or None) for org_name."""
+    if snapshot is not None:
+        orgd = snapshot.org(org_name)
+    else:
+        orgd = gh.organization(org_name).as_dict()
+    owners = None
+    if show_owners:
+        owners = list(
+            get_owners(gh, orgd["login"], use_graphql, snapshot, workers, pool)
+        )
+    return orgd, owners
+
+
 def show_info(
     gh,
     org_name,
@@ -40,26 +133,38 @@ def show_info(
     show_emails=False,
     show_json=False,
     owners_only=False,
+    use_graphql=False,
+    snapshot=None,
+    info=None,
 ):
+    """Print org_name's details; info is from fetch_info(), if already fetched."""
+
     def miss():
         return "<hidden>"
 
+    orgd = {}
     try:
-        org = gh.organization(org_name)
-        orgd = defaultdict(miss, org.as_dict())
+        if info is None:
+            info = fetch_info(gh, org_name, show_owners, use_graphql, snapshot)
+        elif isinstance(info, Exception):
+            raise info
+        orgd, owners = info
+        orgd = defaultdict(miss, orgd)
         if show_json and not show_owners:
             jsonl_out(orgd)
         if not owners_only:
             v4decoded = "{:03}:{}{}".format(
-                len(orgd["type"]), orgd["type"], str(org.id)
+                len(orgd["type"]), orgd["type"], str(orgd["id"])
             )
             v4encoded = base64.b64encode(bytes(v4decoded, "utf-8"))
             print(
-                "{:>15}: {!s} ({})".format("Name", org.name or org_name, orgd["login"])
+                "{:>15}: {!s} ({})".format(
+                    "Name", orgd["name"] or org_name, orgd["login"]
+                )
             )
-            print("{:>15}: {!s}".format("API v3 id", org.id))
+            print("{:>15}: {!s}".format("API v3 id", orgd["id"]))
             print("{:>15}: {!s}".format("API v4 id", f"{v4encoded} ({v4decoded})"))
-            print("{:>15}: {!s}".format("contact", org.email))
+            print("{:>15}: {!s}".format("contact", orgd["email"]))
             print("{:>15}: {!s}".format("billing", orgd["billing_email"]))
             print(
                 "{:>15}: {!s}".format(
@@ -77,17 +182,16 @@ def show_info(
             if not owners_only:
                 print("{:>15}:".format("Org Owners"))
             owner_info = defaultdict(miss)
-            owner_info["org"] = org.login
-            owner_info["org_v3_id"] = org.id
-            owner_info["org_v4_id"] = org.as_dict()["node_id"]
-            for owner in org.members(role="admin"):
-                owner = owner.refresh()  # get name
-                owner_info["name"] = owner.name or "<hidden>"
-                owner_info["login"] = owner.login or "<hidden>"
-                owner_info["id_v3"] = owner.id or "<hidden>"
-                owner_info["id_v4"] = owner.node_id or "<hidden>"
+            owner_info["org"] = orgd["login"]
+            owner_info["org_v3_id"] = orgd["id"]
+            owner_info["org_v4_id"] = orgd["node_id"]
+            for owner in owners:
+                owner_info["name"] = owner["name"] or "<hidden>"
+                owner_info["login"] = owner["login"] or "<hidden>"
+                owner_info["id_v3"] = owner["id"] or "<hidden>"
+                owner_info["id_v4"] = owner["node_id"] or "<hidden>"
                 if show_emails:
-                    email = " " + (owner.email or "<email hidden>")
+                    email = " " + (owner["email"] or "<email hidden>")
                 else:
                     email = ""
                 owner_info["email"] = email
@@ -98,7 +202,7 @@ def show_info(
                         f'                  {owner_info["name"]} ({owner_info["login"]}{email})'
                     )
     except Exception as e:
-        logger.error("Error %s obtaining data for org '%s'", str(e), str(org))
+        logger.error("Error %s obtaining data for org '%s'", str(e), org_name)
     finally:
         if DEBUG:
             from pprint import pprint
@@ -115,6 +219,12 @@ def parse_args():
     parser.add_argument("--owners-only", action="store_true", help="Only show owners")
     parser.add_argument("--email", action="store_true", help="include owner email")
     parser.add_argument("--json", action="store_true", help="output as json lines")
+    parser.add_argument(
+        "--graphql",
+        action="store_true",
+        help="use GraphQL bulk queries for owner details",
+    )
+    add_snapshot_argument(parser)
     parser.add_argument(
         "--all-my-orgs",
         action="store_true",
@@ -125,6 +235,12 @@ def parse_args():
         action="store_true",
         help="Only output your org names for which you're an owner",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="orgs, and owners of each, to look up at once (default 8)",
+    )
     parser.add_argument(
         "orgs",
         nargs="*",
@@ -136,6 +252,8 @@ def parse_args():
         args.all_my_orgs = True
         if args.owners or args.email:
             parser.error("Can't specify owners or emails with --all-my-orgs")
+    if args.from_snapshot and args.all_my_orgs:
+        parser.error("Can't use --all-my-orgs with --from-snapshot")
     if not args.all_my_orgs and len(args.orgs) == 0:
         args.orgs = ["mozilla"]
     if args.owners_only and args.json and not args.email:
@@ -150,18 +268,6 @@ def parse_args():
     return args
 
 
-# api.github.com/user/orgs endpoint not natively supported
-# belongs in authenticated user
-class MyOrganizationsIterator(github3.structs.GitHubIterator):
-    def __init__(self, me):
-        super().__init__(
-            count=-1,  # get all
-            url=me.session.base_url + "/user/orgs",
-            cls=github3.orgs.ShortOrganization,
-            session=me.session,
-        )
-
-
 def print_limits(e=None, verbose=False):
     if e:
         #         display("API limit reached, try again in 5 minutes.\\n")
@@ -212,27 +318,62 @@ def print_limits(e=None, verbose=False):
 
 def main():
     args = parse_args()
-    if args.orgs or args.all_my_orgs:
+    if args.from_snapshot:
+        snapshot = Snapshot(args.from_snapshot, read_only=True)
+        newline = ""
+        for org in args.orgs:
+            if len(args.orgs) > 1 and not args.json:
+                print(f"{newline}Processing org {org}")
+                newline = "\n"
+            show_info(
+                None,
+                org,
+                args.owners,
+                args.email,
+                args.json,
+                args.owners_only,
+                snapshot=snapshot,
+            )
+    elif args.orgs or args.all_my_orgs:
         global gh
         gh = get_github3_client()
         try:
             if args.all_my_orgs:
-                authorized_user = gh.me()
-                me = gh.user(authorized_user.login)
-                my_orgs = MyOrganizationsIterator(me)
-                for org in my_orgs:
-                    owner_logins = [u.login for u in org.members(role="admin")]
-                    if me.login in owner_logins:
-                        args.orgs.append(org.login)
+                args.orgs.extend(my_owned_orgs(gh))
                 if args.names_only:
                     print("\n".join(sorted(args.orgs)))
                     return
-            newline = ""
-            for org in args.orgs:
-                if len(args.orgs) > 1 and not args.json:
-                    print(f"{newline}Processing org {org}")
-                    newline = "\n"
-                show_info(gh, org, args.owners, args.email, args.json, args.owners_only)
+
+            # one pool of owner lookups for all the orgs, rather than one
+            # per org fetching thread
+            with ThreadPoolExecutor(max_workers=args.workers) as owner_pool:
+
+                def fetch(org):
+                    try:
+                        return fetch_info(
+                            gh, org, args.owners, args.graphql, pool=owner_pool
+                        )
+                    except Exception as e:
+                        # reported by show_info(), as before
+                        return e
+
+                # fetch concurrently, but print in order
+                infos = map_concurrently(fetch, args.orgs, args.workers)
+                newline = ""
+                for org, info in zip(args.orgs, infos):
+                    if len(args.orgs) > 1 and not args.json:
+                        print(f"{newline}Processing org {org}")
+                        newline = "\n"
+                    show_info(
+                        gh,
+                        org,
+                        args.owners,
+                        args.email,
+                        args.json,
+                        args.owners_only,
+                        args.graphql,
+                        info=info,
+                    )
         except github3.exceptions.ForbiddenError as e:
             print_limits(e)
 
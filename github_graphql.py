@@ -0,0 +1,254 @@
+"""Bulk queries against the GitHub GraphQL (v4) API.
+
+The REST API needs one call per entity for several things we do a lot:
+owner names & emails, collaborator lists per repository, user lookups.
+GraphQL returns 100 nodes per page, and lets us alias many repositories
+or users into a single request.
+
+All requests go through the shared, rate limited session from client.py.
+"""
+
+import logging
+
+from client import get_requests_session
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+PAGE_SIZE = 100
+# GitHub caps the "node cost" of a query -- 10 repositories with 100
+# collaborators each stays comfortably below it.
+REPOS_PER_QUERY = 10
+USERS_PER_QUERY = 50
+# top level tree listings are small, so more repositories fit in a query
+TREES_PER_QUERY = 25
+
+logger = logging.getLogger(__name__)
+
+_session = None
+
+
+class GraphQLError(Exception):
+    """GitHub answered, but reported errors for the query."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(e.get("message", str(e)) for e in errors))
+
+
+def session():
+    global _session
+    if _session is None:
+        _session = get_requests_session()
+    return _session
+
+
+def run_query(query, variables=None, allow_partial=False):
+    """Run one query; return the 'data' member of the response.
+
+    With allow_partial, errors for individual aliases (e.g. a repository
+    we can't see) are logged rather than raised.
+    """
+    response = session().post(
+        GRAPHQL_URL, json={"query": query, "variables": variables or {}}
+    )
+    response.raise_for_status()
+    body = response.json()
+    errors = body.get("errors")
+    if errors:
+        if not (allow_partial and body.get("data")):
+            raise GraphQLError(errors)
+        for error in errors:
+            logger.warning("GraphQL: %s", error.get("message"))
+    return body["data"]
+
+
+def chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+MEMBERS_QUERY = """
+query($org: String!, $cursor: String) {
+  organization(login: $org) {
+    membersWithRole(first: %d, after: $cursor) {
+      pageInfo { hasNextPage endCursor }
+      edges {
+        role
+        node { login name email id databaseId }
+      }
+    }
+  }
+}
+""" % (
+    PAGE_SIZE
+)
+
+
+def user_record(node):
+    return {
+        "login": node["login"],
+        "name": node.get("name"),
+        "email": node.get("email") or None,
+        "node_id": node["id"],
+        "id": node.get("databaseId"),
+    }
+
+
+def org_members(org, role=None):
+    """Yield every member of org, with name, email and role.
+
+    role may be "admin" or "member" (REST spelling) to filter, the
+    returned "role" is the GraphQL spelling ("ADMIN"/"MEMBER").
+    """
+    wanted = None if role in (None, "all") else role.upper()
+    if wanted not in (None, "ADMIN", "MEMBER"):
+        raise ValueError(f"unknown role '{role}'")
+    cursor = None
+    while True:
+        data = run_query(MEMBERS_QUERY, {"org": org, "cursor": cursor})
+        members = data["organization"]["membersWithRole"]
+        for edge in members["edges"]:
+            if wanted and edge["role"] != wanted:
+                continue
+            record = user_record(edge["node"])
+            record["role"] = edge["role"]
+            yield record
+        if not members["pageInfo"]["hasNextPage"]:
+            break
+        cursor = members["pageInfo"]["endCursor"]
+
+
+COLLABORATORS_FRAGMENT = """
+  r%(n)d: repository(owner: $o%(n)d, name: $n%(n)d) {
+    collaborators(first: %(page)d, after: $c%(n)d, affiliation: %(affiliation)s) {
+      pageInfo { hasNextPage endCursor }
+      edges { permission node { login } }
+    }
+  }
+"""
+
+
+def _collaborators_query(count, affiliation):
+    params = ", ".join(
+        f"$o{n}: String!, $n{n}: String!, $c{n}: String" for n in range(count)
+    )
+    body = "".join(
+        COLLABORATORS_FRAGMENT % {"n": n, "page": PAGE_SIZE, "affiliation": affiliation}
+        for n in range(count)
+    )
+    return f"query({params}) {{{body}}}"
+
+
+def repo_collaborators(repos, affiliation="ALL"):
+    """Return {"owner/repo": [{"login":..., "permission":...}, ...]}.
+
+    repos is an iterable of (owner, repo) pairs. Several repositories are
+    aliased into each query; the rare repository with more than a page of
+    collaborators is followed up in later rounds. Repositories we can't
+    see are left out of the result.
+    """
+    results = {}
+    for batch in chunks(repos, REPOS_PER_QUERY):
+        # each entry is (owner, repo, cursor) still to be fetched
+        todo = [(owner, repo, None) for owner, repo in batch]
+        while todo:
+            variables = {}
+            for n, (owner, repo, cursor) in enumerate(todo):
+                variables.update({f"o{n}": owner, f"n{n}": repo, f"c{n}": cursor})
+            data = run_query(
+                _collaborators_query(len(todo), affiliation),
+                variables,
+                allow_partial=True,
+            )
+            next_todo = []
+            for n, (owner, repo, cursor) in enumerate(todo):
+                node = data.get(f"r{n}")
+                if not node or not node["collaborators"]:
+                    continue
+                collaborators = results.setdefault(f"{owner}/{repo}", [])
+                page = node["collaborators"]
+                collaborators.extend(
+                    {"login": e["node"]["login"], "permission": e["permission"]}
+                    for e in page["edges"]
+                )
+                if page["pageInfo"]["hasNextPage"]:
+                    next_todo.append((owner, repo, page["pageInfo"]["endCursor"]))
+            todo = next_todo
+    return results
+
+
+def users(logins):
+    """Return {login: user_record} for each login that exists."""
+    found = {}
+    for batch in chunks(logins, USERS_PER_QUERY):
+        params = ", ".join(f"$l{n}: String!" for n in range(len(batch)))
+        body = "".join(
+            f" u{n}: user(login: $l{n}) {{ login name email id databaseId }}"
+            for n in range(len(batch))
+        )
+        variables = {f"l{n}": login for n, login in enumerate(batch)}
+        data = run_query(f"query({params}) {{{body} }}", variables, allow_partial=True)
+        for n, login in enumerate(batch):
+            node = data.get(f"u{n}")
+            if node:
+                found[login] = user_record(node)
+    return found
+
+
+REPOSITORIES_QUERY = """
+query($org: String!, $cursor: String, $isFork: Boolean) {
+  organization(login: $org) {
+    repositories(first: %d, after: $cursor, isFork: $isFork) {
+      pageInfo { hasNextPage endCursor }
+      nodes { name defaultBranchRef { target { oid } } }
+    }
+  }
+}
+""" % (
+    PAGE_SIZE
+)
+
+
+def org_repositories(org, is_fork=None):
+    """Yield {"name", "sha"} for org's repositories.
+
+    sha is that of the default branch head, None for an empty repository.
+    is_fork=False gives only "sources" (REST spelling).
+    """
+    cursor = None
+    while True:
+        data = run_query(
+            REPOSITORIES_QUERY, {"org": org, "cursor": cursor, "isFork": is_fork}
+        )
+        repos = data["organization"]["repositories"]
+        for node in repos["nodes"]:
+            ref = node["defaultBranchRef"]
+            yield {"name": node["name"], "sha": ref["target"]["oid"] if ref else None}
+        if not repos["pageInfo"]["hasNextPage"]:
+            break
+        cursor = repos["pageInfo"]["endCursor"]
+
+
+def root_entries(repos):
+    """Return {"owner/repo": [name, ...]} of the files & directories at HEAD.
+
+    repos is a list of (owner, repo) pairs, all fetched in one query (see
+    TREES_PER_QUERY). Empty repositories, and those we can't see, are
+    left out of the result.
+    """
+    params = ", ".join(f"$o{n}: String!, $n{n}: String!" for n in range(len(repos)))
+    body = "".join(
+        f" r{n}: repository(owner: $o{n}, name: $n{n}) {{"
+        ' object(expression: "HEAD:") { ... on Tree { entries { name } } } }'
+        for n in range(len(repos))
+    )
+    variables = {}
+    for n, (owner, repo) in enumerate(repos):
+        variables.update({f"o{n}": owner, f"n{n}": repo})
+    data = run_query(f"query({params}) {{{body} }}", variables, allow_partial=True)
+    entries = {}
+    for n, (owner, repo) in enumerate(repos):
+        node = data.get(f"r{n}")
+        if node and node["object"]:
+            entries[f"{owner}/{repo}"] = [e["name"] for e in node["object"]["entries"]]
+    return entries
@@ -4,9 +4,6 @@
 
 # additional help text
 _epilog = """
-This script uses a preview API, so may cease to function without
-warning.
-
 The output always has the GitHub login as first field, so you can get
 those with:
     manage_invitations | cut -d ' ' -f1
@@ -21,114 +18,248 @@ ToDo:
 """
 # hwine believes keeping the doc above together is more important than PEP-8
 import argparse  # NOQA
+import json  # NOQA
 import logging  # NOQA
-import arrow  # NOQA
-
-from client import get_github3_client  # NOQA
-
-# hack until invitations are supported upstream
-import github3  # NOQA
-from github3.exceptions import ForbiddenError  # NOQA
-
-if not hasattr(github3.orgs.Organization, "invitations"):
-    raise NotImplementedError(
-        "Your version of github3.py does not support "
-        "invitations. Try "
-        "https://github.com/hwine/github3.py/tree/invitations"
-    )  # NOQA
-if (1, 3, 0) > github3.__version_info__:
-    raise NotImplementedError(
-        "Your version of github3.py does not support "
-        "collaborator invitations. Version '1.3.0' or later is known to work."
-    )
+import sys  # NOQA
+import time  # NOQA
+from datetime import datetime  # NOQA
+
+import requests  # NOQA
 
+from client import get_requests_session, map_concurrently, paginate  # NOQA
+from snapshot import Snapshot, SnapshotMissing, add_snapshot_argument  # NOQA
+
+API = "https://api.github.com"
+# seconds per unit of --cutoff; months & years are approximate
+CUTOFF_UNITS = {
+    "seconds": 1,
+    "minutes": 60,
+    "hours": 3600,
+    "days": 24 * 3600,
+    "weeks": 7 * 24 * 3600,
+    "months": 30 * 24 * 3600,
+    "years": 365 * 24 * 3600,
+}
 
 logger = logging.getLogger(__name__)
 
 
-def get_cutoff_time(cutoff_delta):
-    k, v = cutoff_delta.split("=", 2)
-    args = {k: int(v)}
-    ok_after = arrow.now().replace(**args)
-    return ok_after
+def get_cutoff_time(cutoff_delta, now=None):
+    """Seconds since the epoch for e.g. "weeks=-2" before now."""
+    k, v = cutoff_delta.split("=", 1)
+    if k not in CUTOFF_UNITS:
+        raise ValueError(f"unknown unit '{k}'")
+    return int((now or time.time()) + int(v) * CUTOFF_UNITS[k])
 
 
-def check_invites(gh, org_name, cancel=False, cutoff_delta="weeks=-2"):
+def parse_timestamp(tst):
+    """GitHub's ISO 8601 timestamps (Z or +hh:mm) to seconds since the epoch."""
+    return int(datetime.fromisoformat(tst.replace("Z", "+00:00")).timestamp())
 
-    org = gh.organization(org_name)
-    if not org:
-        logger.error("No such org '%s'", org_name)
-        return
-    cutoff_time = get_cutoff_time(cutoff_delta)
+
+def humanize(seconds):
+    """Describe an age in seconds the way arrow does ("3 days ago")."""
+    for limit, one, many, unit in (
+        (45, "seconds ago", None, 1),
+        (90, "a minute ago", None, 60),
+        (2700, None, "{} minutes ago", 60),
+        (5400, "an hour ago", None, 3600),
+        (79200, None, "{} hours ago", 3600),
+        (129600, "a day ago", None, 86400),
+        (2592000, None, "{} days ago", 86400),
+        (3888000, "a month ago", None, 2592000),
+        (29808000, None, "{} months ago", 2592000),
+        (47260800, "a year ago", None, 31536000),
+    ):
+        if seconds < limit:
+            return one or many.format(max(2, round(seconds / unit)))
+    return "{} years ago".format(max(2, round(seconds / 31536000)))
+
+
+class Invitation:
+    """The parts of an org or repository invitation we report on."""
+
+    __slots__ = ("id", "login", "email", "inviter", "repo", "permission", "created_at")
+
+    def __init__(self, id, login, email, inviter, repo, permission, created_at):
+        self.id = id
+        self.login = login
+        self.email = email
+        self.inviter = inviter
+        self.repo = repo
+        self.permission = permission
+        self.created_at = created_at
+
+    @classmethod
+    def from_json(cls, data, repo=""):
+        """Build from the API's JSON; repo is "" for org invitations."""
+        if repo:
+            # invitee is null for invitations sent to an email address
+            login = (data.get("invitee") or {}).get("login")
+            permission = data.get("permissions")
+        else:
+            login, permission = data.get("login"), data.get("role")
+        return cls(
+            data["id"],
+            login,
+            data.get("email"),
+            (data.get("inviter") or {}).get("login"),
+            repo,
+            permission,
+            parse_timestamp(data["created_at"]),
+        )
+
+    def line(self, now):
+        ago = humanize(now - self.created_at)
+        if not self.repo:
+            return f"{self.login} ({self.email}) was invited {ago} by {self.inviter}"
+        return (
+            f"{self.login} was invited to {self.repo} {ago} by "
+            f"{self.inviter} for {self.permission} access."
+        )
+
+    def as_json(self, org):
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.created_at))
+        return dict(
+            org=org,
+            repo=self.repo,
+            id=self.id,
+            login=self.login,
+            email=self.email,
+            inviter=self.inviter,
+            permission=self.permission,
+            created_at=created_at,
+        )
+
+
+def stale_invitations(invitations, cutoff_time):
+    """The invitations created before cutoff_time, in the same order."""
+    return [i for i in invitations if i.created_at < cutoff_time]
+
+
+def fetch_repo_invitations(session, org_name, repo_name):
+    """Return (invitations, error) -- error is None if all went well."""
+    url = f"{API}/repos/{org_name}/{repo_name}/invitations"
     try:
-        for invite in org.invitations():
-            extended_at = arrow.get(invite.created_at)
-            line_end = ": " if cancel else "\n"
-            if extended_at < cutoff_time:
-                context = invite.as_dict()
-                context["ago"] = extended_at.humanize()
-                print(
-                    "{login} ({email}) was invited {ago} by "
-                    "{inviter[login]}".format(**context),
-                    end=line_end,
-                )
-                if cancel:
-                    success = org.remove_membership(invite.id)
-                    if success:
-                        print("Cancelled")
-                    else:
-                        print("FAILED to cancel")
-                        logger.warning(
-                            "Couldn't cancel invite for {login} "
-                            "from {created_at}".format(**context)
-                        )
-    except ForbiddenError:
-        logger.error("You don't have 'admin:org' permissions for org '%s'", org_name)
-    else:
-        # now handle collaborator invitations (GH-57)
-        for repo in org.repositories():
+        return [
+            Invitation.from_json(i, repo_name) for i in paginate(session, url)
+        ], None
+    except (requests.HTTPError, requests.ConnectionError) as e:
+        return [], e
+
+
+def find_stale_invites(session, org_name, cutoff_time, workers=8):
+    """Return the stale invitations of org_name.
+
+    Org invitations come first, then repository invitations in the order
+    the repositories are listed; repositories are checked concurrently.
+    """
+    stale = stale_invitations(
+        (
+            Invitation.from_json(i)
+            for i in paginate(session, f"{API}/orgs/{org_name}/invitations")
+        ),
+        cutoff_time,
+    )
+
+    # now handle collaborator invitations (GH-57)
+    repo_names = (r["name"] for r in paginate(session, f"{API}/orgs/{org_name}/repos"))
+    for repo_name, (invitations, error) in map_concurrently(
+        lambda name: (name, fetch_repo_invitations(session, org_name, name)),
+        repo_names,
+        workers,
+    ):
+        if error:
             # occasionally get a 404 when looking for invitations.
             # Assume this is a race condition and ignore. That may leave
             # some invites uncanceled, but a 2nd run should catch.
-            try:
-                for invite in repo.invitations():
-                    extended_at = arrow.get(invite.created_at)
-                    line_end = ": " if cancel else "\n"
-                    if extended_at < cutoff_time:
-                        context = invite.as_dict()
-                        context["ago"] = extended_at.humanize()
-                        context["repo"] = repo.name
-                        context["inviter"] = invite.inviter.login
-                        context["invitee"] = invite.invitee.login
-                        print(
-                            "{invitee} was invited to {repo} {ago} by "
-                            "{inviter} for {permissions} access.".format(**context),
-                            end=line_end,
-                        )
-                        if cancel:
-                            # Deletion not directly supported, so hack url &
-                            # use send delete verb directly
-                            delete_url = repo.url + "/invitations/" + str(invite.id)
-                            success = repo._delete(delete_url)
-                            if success:
-                                print("Cancelled")
-                            else:
-                                print("FAILED to cancel")
-                                logger.warning(
-                                    "Couldn't cancel invite for {login} "
-                                    "from {created_at}".format(**context)
-                                )
-            except (
-                github3.exceptions.NotFoundError,
-                github3.exceptions.ConnectionError,
-            ) as e:
-                # just report, unless it's a security repo
-                if "-ghsa-" not in repo.name:
-                    logger.warning(
-                        "Got 404 for invitation in {}, may be unhandled inviations. '{}'".format(
-                            repo.name, str(e)
-                        )
+            # just report, unless it's a security repo
+            if "-ghsa-" not in repo_name:
+                logger.warning(
+                    "Got 404 for invitation in {}, may be unhandled inviations. '{}'".format(
+                        repo_name, str(error)
                     )
+                )
+            continue
+        stale.extend(stale_invitations(invitations, cutoff_time))
+    return stale
+
+
+def cancel_invitation(session, org_name, invite):
+    if invite.repo:
+        url = f"{API}/repos/{org_name}/{invite.repo}/invitations/{invite.id}"
+    else:
+        url = f"{API}/orgs/{org_name}/invitations/{invite.id}"
+    try:
+        return session.delete(url).status_code == 204
+    except requests.ConnectionError as e:
+        logger.debug("Cancelling failed: %s", e)
+        return False
+
+
+def check_invites(
+    session, org_name, cancel=False, cutoff_delta="weeks=-2", workers=8, rows=None
+):
+    """Report (and with cancel, cancel) org_name's stale invitations.
+
+    With rows, append a dict per invitation to it instead of printing.
+    """
+    cutoff_time = get_cutoff_time(cutoff_delta)
+    try:
+        stale = find_stale_invites(session, org_name, cutoff_time, workers)
+    except requests.HTTPError as e:
+        if e.response.status_code == 404:
+            logger.error("No such org '%s'", org_name)
+        else:
+            logger.error(
+                "You don't have 'admin:org' permissions for org '%s'", org_name
+            )
+        return
+    if cancel:
+        # cancel concurrently, but report in the same order as above
+        cancelled = map_concurrently(
+            lambda invite: cancel_invitation(session, org_name, invite),
+            stale,
+            workers,
+        )
+    else:
+        cancelled = [None] * len(stale)
+    now = time.time()
+    for invite, success in zip(stale, cancelled):
+        if rows is not None:
+            row = invite.as_json(org_name)
+            if cancel:
+                row["cancelled"] = success
+            rows.append(row)
+        elif not cancel:
+            print(invite.line(now))
+        elif success:
+            print(invite.line(now), end=": Cancelled\n")
+        else:
+            print(invite.line(now), end=": FAILED to cancel\n")
+        if cancel and not success:
+            logger.warning(
+                "Couldn't cancel invite for %s from %s",
+                invite.login,
+                invite.as_json(org_name)["created_at"],
+            )
+
+
+def report_snapshot_invites(snapshot, org_name, cutoff_delta="weeks=-2", rows=None):
+    """Report stale invitations recorded in a snapshot (no cancelling)."""
+    stale = stale_invitations(
+        (
+            Invitation.from_json(data, repo)
+            for repo, data in snapshot.invitations(org_name)
+        ),
+        get_cutoff_time(cutoff_delta),
+    )
+    now = time.time()
+    for invite in stale:
+        if rows is not None:
+            rows.append(invite.as_json(org_name))
+        else:
+            print(invite.line(now))
 
 
 def parse_args():
@@ -147,7 +278,9 @@ def parse_args():
     )
     parser.add_argument(
         "--cutoff",
-        help="When invitations go stale " '(arrow replace syntax; default "weeks=-2")',
+        help="When invitations go stale ("
+        + ", ".join(CUTOFF_UNITS)
+        + ' with a negative count; default "weeks=-2")',
         default="weeks=-2",
     )
     parser.add_argument(
@@ -158,28 +291,59 @@ def parse_args():
         ],
         help="github organizations to check (defaults to " "mozilla)",
     )
-    # make sure arrow is happy with the cutoff syntax
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="repositories to check, or invitations to cancel, at once",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="print a JSON list of the invitations (and whether cancelled)",
+    )
+    add_snapshot_argument(parser)
     args = parser.parse_args()
+    if args.from_snapshot and args.cancel:
+        parser.error("Can't --cancel from a snapshot")
     try:
         get_cutoff_time(args.cutoff)
-    except (AttributeError, TypeError):
+    except ValueError:
         parser.error("invalid cutoff value")
     return args
 
 
 def main():
     args = parse_args()
+    rows = [] if args.json else None
+    exit_code = 0
     if args.orgs:
-        gh = get_github3_client()
+        if args.from_snapshot:
+            snapshot = Snapshot(args.from_snapshot, read_only=True)
+        else:
+            session = get_requests_session()
         for org in args.orgs:
-            if len(args.orgs) > 1:
+            if len(args.orgs) > 1 and not args.json:
                 print(f"Processing org {org}")
-            check_invites(gh, org, args.cancel, args.cutoff)
+            if args.from_snapshot:
+                try:
+                    report_snapshot_invites(snapshot, org, args.cutoff, rows)
+                except SnapshotMissing as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                    exit_code = 1
+            else:
+                check_invites(
+                    session, org, args.cancel, args.cutoff, args.workers, rows
+                )
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    return exit_code
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.WARN, format="%(asctime)s %(message)s")
     try:
-        main()
+        raise SystemExit(main())
     except KeyboardInterrupt:
         raise SystemExit("\nCancelled by user")
@@ -1,88 +1,339 @@
 #!/usr/bin/env python
+"""Report small/empty, long untouched and other stale repositories.
+
+Any number of orgs are listed concurrently; each org's listing is cached
+(as NDJSON) for --max-age hours. All selected rules are evaluated in a
+single pass over the combined repositories.
+"""
+import argparse
+import calendar
+import csv
 import json
+import logging
 import os
-import re
-from datetime import datetime, timedelta
+import sys
+import time
+from array import array
+
+from client import get_requests_session, map_concurrently, paginate
+from snapshot import Snapshot, SnapshotMissing, add_snapshot_argument
 
-import requests
+_epilog = f"""
+Rules (select with --rules, default "small untouched"):
+  small       smaller than --max-size KB, no open issues, and not updated
+              in --small-age days
+  untouched   not updated in --untouched-age days
+  unpushed    not pushed to in --unpushed-age days
+  stale-fork  a fork not pushed to in --fork-age days
+  archived    archived
 
-from client import get_token
+Listings are cached in {os.path.join("cache", "<org>_all_repos.ndjson")}.
+"""
 
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+DEFAULT_MAX_AGE = 24
+# all the rules & reports need from each repository
+FIELDS = (
+    "name",
+    "size",
+    "open_issues_count",
+    "updated_at",
+    "pushed_at",
+    "archived",
+    "fork",
+)
+RULES = ("small", "untouched", "unpushed", "stale-fork", "archived")
+DAY = 24 * 3600
 
-CACHEFILE = "cache/mozilla_all_repos.json"
+logger = logging.getLogger(__name__)
 
 
 def parse_timestamp(tst):
-    return datetime.strptime(tst, "%Y-%m-%dT%H:%M:%SZ")
+    """Seconds since the epoch; never pushed (None) counts as very old."""
+    if not tst:
+        return 0.0
+    return float(calendar.timegm(time.strptime(tst, "%Y-%m-%dT%H:%M:%SZ")))
 
 
-if __name__ == "__main__":
-    headers = {
-        "Accept": "application/vnd.github.moondragon+json",
-        "Authorization": "token %s" % get_token(),
+def format_timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+def cache_file(org):
+    return os.path.join(CACHE_DIR, f"{org}_all_repos.ndjson")
+
+
+def cache_is_fresh(path, max_age):
+    try:
+        return time.time() - os.path.getmtime(path) < max_age * 3600
+    except OSError:
+        return False
+
+
+def read_cache(path):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def fetch_repos(session, org, path):
+    """Yield org's repositories as they arrive, caching them as NDJSON.
+
+    The new cache replaces the old one only once the listing completes,
+    so an interrupted run leaves the previous cache intact.
+    """
+    tmp = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp, "w") as f:
+        for repo in paginate(session, f"https://api.github.com/orgs/{org}/repos"):
+            repo = {k: repo[k] for k in FIELDS}
+            f.write(json.dumps(repo) + "\n")
+            yield repo
+    os.replace(tmp, path)
+
+
+class RepoTable:
+    """The fields the rules use, one compact column per field.
+
+    Timestamps are parsed once, on the way in, to seconds since the epoch.
+    """
+
+    COLUMNS = (
+        "orgs",
+        "names",
+        "size",
+        "open_issues",
+        "updated",
+        "pushed",
+        "archived",
+        "fork",
+    )
+
+    def __init__(self, org=None, repos=()):
+        self.orgs = []
+        self.names = []
+        self.size = array("q")
+        self.open_issues = array("q")
+        self.updated = array("d")
+        self.pushed = array("d")
+        self.archived = array("b")
+        self.fork = array("b")
+        for repo in repos:
+            self.append(org, repo)
+
+    def __len__(self):
+        return len(self.names)
+
+    def append(self, org, repo):
+        self.orgs.append(org)
+        self.names.append(repo["name"])
+        self.size.append(repo["size"])
+        self.open_issues.append(repo["open_issues_count"])
+        self.updated.append(parse_timestamp(repo["updated_at"]))
+        self.pushed.append(parse_timestamp(repo["pushed_at"]))
+        self.archived.append(bool(repo["archived"]))
+        self.fork.append(bool(repo["fork"]))
+
+    def extend(self, other):
+        for column in self.COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+
+    def row(self, i):
+        """Row i as a dict: "org", then FIELDS."""
+        return {
+            "org": self.orgs[i],
+            "name": self.names[i],
+            "size": self.size[i],
+            "open_issues_count": self.open_issues[i],
+            "updated_at": format_timestamp(self.updated[i]),
+            "pushed_at": format_timestamp(self.pushed[i]) if self.pushed[i] else None,
+            "archived": bool(self.archived[i]),
+            "fork": bool(self.fork[i]),
+        }
+
+
+def make_rules(names, args, now=None):
+    """Return [(rule name, predicate)] for the selected rules.
+
+    Predicates take (size, open issues, updated, pushed, archived, fork);
+    every cutoff is computed once, here.
+    """
+    now = now or time.time()
+    small_cutoff = now - args.small_age * DAY
+    untouched_cutoff = now - args.untouched_age * DAY
+    unpushed_cutoff = now - args.unpushed_age * DAY
+    fork_cutoff = now - args.fork_age * DAY
+    max_size = args.max_size
+    predicates = {
+        "small": lambda size, issues, updated, pushed, archived, fork: (
+            size < max_size and issues == 0 and updated < small_cutoff
+        ),
+        "untouched": lambda size, issues, updated, pushed, archived, fork: (
+            updated < untouched_cutoff
+        ),
+        "unpushed": lambda size, issues, updated, pushed, archived, fork: (
+            pushed < unpushed_cutoff
+        ),
+        "stale-fork": lambda size, issues, updated, pushed, archived, fork: (
+            fork and pushed < fork_cutoff
+        ),
+        "archived": lambda size, issues, updated, pushed, archived, fork: archived,
     }
+    return [(name, predicates[name]) for name in names]
 
-    if os.path.exists(CACHEFILE):
-        repos = json.loads(open(CACHEFILE).read())
-        print(
-            "Found cached repository list. Delete %s if you want a new "
-            "one.\n" % CACHEFILE
-        )
 
-    else:
-        repos = []
-        repos_api = "https://api.github.com/orgs/%s/repos" % "mozilla"
-        while True:
-            resp = requests.get(repos_api, headers=headers)
-            repos += resp.json()
-
-            # Next page.
-            next_match = re.search(r'<([^>]+)>; rel="next"', resp.headers["Link"])
-            if not next_match:
-                break
+def evaluate(table, rules, skip_archived=False):
+    """Return {rule name: [row index, ...]}, in one pass over table."""
+    matches = {name: [] for name, _ in rules}
+    columns = zip(
+        table.size,
+        table.open_issues,
+        table.updated,
+        table.pushed,
+        table.archived,
+        table.fork,
+    )
+    for i, values in enumerate(columns):
+        if skip_archived and values[4]:
+            continue
+        for name, predicate in rules:
+            if predicate(*values):
+                matches[name].append(i)
+    for indexes in matches.values():
+        indexes.sort(key=lambda i: (table.orgs[i].lower(), table.names[i].lower()))
+    return matches
+
+
+def load_org(org, args, session=None, snapshot=None):
+    if snapshot:
+        return RepoTable(org, snapshot.repos(org))
+    path = cache_file(org)
+    if cache_is_fresh(path, args.max_age):
+        logger.info("Using cached repository list for %s", org)
+        return RepoTable(org, read_cache(path))
+    return RepoTable(org, fetch_repos(session, org, path))
+
+
+def report_text(table, matches, args):
+    multi_org = len(args.orgs) > 1
+    headers = {
+        "small": f"small/empty repositories older than {args.small_age} days",
+        "untouched": f"repos touched less recently than {args.untouched_age} days ago.",
+        "unpushed": f"repos not pushed to in {args.unpushed_age} days",
+        "stale-fork": f"forks not pushed to in {args.fork_age} days",
+        "archived": "archived repos",
+    }
+    for n, (rule, indexes) in enumerate(matches.items()):
+        if n:
+            print("\n\n")
+        print(f"## {len(indexes)} {headers[rule]}")
+        for i in indexes:
+            row = table.row(i)
+            name = f"{row['org']}/{row['name']}" if multi_org else row["name"]
+            if rule == "small":
+                print(name, ":", row["size"], "(%s)" % row["updated_at"])
+            elif rule in ("unpushed", "stale-fork"):
+                print(name, ":", row["pushed_at"] or "never")
             else:
-                repos_api = next_match.group(1)
-
-        open(CACHEFILE, "w").write(json.dumps(repos))
-
-    # Find small/empty repos older than a month.
-    SMALL_MINAGE = 31
-    small_repos = [
-        r
-        for r in repos
-        if (
-            r["size"] < 50
-            and r["open_issues_count"] == 0
-            and parse_timestamp(r["updated_at"]) + timedelta(days=SMALL_MINAGE)
-            < datetime.now()
-        )
-    ]
-    small_repos.sort(key=lambda r: r["name"])
-    print(
-        "## {} small/empty repositories older than {} days".format(
-            len(small_repos), SMALL_MINAGE
-        )
+                print(name, ":", row["updated_at"])
+
+
+def report_csv(table, matches):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(("rule", "org") + FIELDS)
+    for rule, indexes in matches.items():
+        for i in indexes:
+            writer.writerow((rule,) + tuple(table.row(i).values()))
+
+
+def report_json(table, matches):
+    json.dump(
+        {rule: [table.row(i) for i in indexes] for rule, indexes in matches.items()},
+        sys.stdout,
+        indent=2,
+    )
+    print()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "orgs", nargs="*", default=["mozilla"], help="orgs to report on (mozilla)"
     )
-    for repo in small_repos:
-        print(repo["name"], ":", repo["size"], "(%s)" % repo["updated_at"])
-
-    print("\n\n")
-
-    # Find recently untouched repos.
-    UNTOUCHED_MINAGE = 2 * 365
-    old_repos = [
-        r
-        for r in repos
-        if (
-            parse_timestamp(r["updated_at"]) + timedelta(days=(UNTOUCHED_MINAGE))
-            < datetime.now()
-        )
-    ]
-    old_repos.sort(key=lambda r: r["name"])
-    print(
-        "## {} repos touched less recently than {} days ago.".format(
-            len(old_repos), UNTOUCHED_MINAGE
-        )
+    add_snapshot_argument(parser)
+    parser.add_argument(
+        "--rules",
+        nargs="+",
+        choices=RULES,
+        default=["small", "untouched"],
+        help="rules to report (see below)",
     )
-    for repo in old_repos:
-        print(repo["name"], ":", repo["updated_at"])
+    parser.add_argument("--max-size", type=int, default=50, metavar="KB")
+    parser.add_argument("--small-age", type=int, default=31, metavar="DAYS")
+    parser.add_argument("--untouched-age", type=int, default=2 * 365, metavar="DAYS")
+    parser.add_argument("--unpushed-age", type=int, default=365, metavar="DAYS")
+    parser.add_argument("--fork-age", type=int, default=180, metavar="DAYS")
+    parser.add_argument(
+        "--skip-archived",
+        action="store_true",
+        help="leave archived repos out of every rule",
+    )
+    parser.add_argument(
+        "--format", choices=("text", "csv", "json"), default="text", help="(text)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of orgs to list at once (default 8)",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=DEFAULT_MAX_AGE,
+        metavar="HOURS",
+        help=f"refetch if a cached list is older than this (default {DEFAULT_MAX_AGE})",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    snapshot = (
+        Snapshot(args.from_snapshot, read_only=True) if args.from_snapshot else None
+    )
+    session = None if snapshot else get_requests_session()
+
+    def load(org):
+        try:
+            return load_org(org, args, session, snapshot)
+        except SnapshotMissing as e:
+            # reported below, in order
+            return e
+
+    exit_code = 0
+    table = RepoTable()
+    for org_table in map_concurrently(load, args.orgs, args.workers):
+        if isinstance(org_table, SnapshotMissing):
+            print(f"Error: {org_table}", file=sys.stderr)
+            exit_code = 1
+            continue
+        table.extend(org_table)
+
+    matches = evaluate(table, make_rules(args.rules, args), args.skip_archived)
+    if args.format == "csv":
+        report_csv(table, matches)
+    elif args.format == "json":
+        report_json(table, matches)
+    else:
+        report_text(table, matches, args)
+    return exit_code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,199 @@
+"""Look up many logins across many orgs at once.
+
+Offboarding asks "which of these ~40 orgs does any of these logins have
+a role in?". Rather than scanning member lists per (login, org) pair,
+load owners, members and outside collaborators of every org concurrently
+and invert them into one index of login -> [(org, role), ...]. Each
+lookup is then a dictionary access.
+
+The index can be saved to disk and reloaded while still fresh, so a
+notebook kernel restart doesn't mean re-crawling every org.
+"""
+
+import json
+import logging
+import os
+import time
+
+import github3
+
+import client
+from snapshot import OutsideCollaboratorIterator
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "cache", "membership.json")
+DEFAULT_MAX_AGE = 4 * 3600
+ROLES = ("owner", "member", "outside_collaborator")
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_org_roles(gh, org_name):
+    """Return (org login, {login: role}) for one org.
+
+    Owners are reported only as "owner", even though they are also
+    members. Raises github3 exceptions if we can't inspect the org.
+    """
+    org = gh.organization(org_name)
+    roles = {}
+    for user in OutsideCollaboratorIterator(org):
+        roles[user.login.lower()] = "outside_collaborator"
+    for user in org.members():
+        roles[user.login.lower()] = "member"
+    for user in org.members(role="admin"):
+        roles[user.login.lower()] = "owner"
+    return org.login, roles
+
+
+class MembershipIndex:
+    """Inverted index of login -> [(org, role), ...] for a set of orgs."""
+
+    def __init__(self):
+        self.index = {}
+        self.orgs = []
+        # org name -> reason it couldn't be inspected
+        self.skipped = {}
+        self.loaded_at = None
+
+    def add_org(self, org, roles):
+        self.orgs.append(org)
+        for login, role in roles.items():
+            self.index.setdefault(login.lower(), []).append((org, role))
+
+    @classmethod
+    def load(cls, gh, org_names, workers=8):
+        """Build the index from the API, fetching up to workers orgs at once."""
+
+        def fetch(org_name):
+            try:
+                return org_name, fetch_org_roles(gh, org_name), None
+            except github3.exceptions.NotFoundError:
+                return org_name, None, "no such organization"
+            except github3.exceptions.ForbiddenError as e:
+                return org_name, None, f"not enough permissions ({e})"
+
+        index = cls()
+        for org_name, result, problem in client.map_concurrently(
+            fetch, sorted(set(org_names)), workers
+        ):
+            if problem:
+                logger.warning("Skipping org '%s': %s", org_name, problem)
+                index.skipped[org_name] = problem
+            else:
+                index.add_org(*result)
+        index.loaded_at = time.time()
+        return index
+
+    @classmethod
+    def from_snapshot(cls, snapshot, org_names=None):
+        """Build the index from a snapshot database instead of the API."""
+        index = cls()
+        for org in org_names or snapshot.orgs():
+            roles = {
+                login: "outside_collaborator"
+                for login in snapshot.outside_collaborators(org)
+            }
+            for member in snapshot.members(org):
+                roles[member["login"]] = (
+                    "owner" if member["role"] == "admin" else "member"
+                )
+            index.add_org(snapshot.org(org)["login"], roles)
+        index.loaded_at = time.time()
+        return index
+
+    def save(self, path=DEFAULT_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "loaded_at": self.loaded_at,
+                    "orgs": self.orgs,
+                    "skipped": self.skipped,
+                    "index": self.index,
+                },
+                f,
+            )
+
+    @classmethod
+    def load_saved(cls, path=DEFAULT_PATH, max_age=DEFAULT_MAX_AGE, org_names=None):
+        """Return the saved index if fresh and covering org_names, else None."""
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - saved["loaded_at"] > max_age:
+            return None
+        known = {o.lower() for o in saved["orgs"]} | {
+            o.lower() for o in saved["skipped"]
+        }
+        if org_names and not {o.lower() for o in org_names} <= known:
+            return None
+        index = cls()
+        index.orgs = saved["orgs"]
+        index.skipped = saved["skipped"]
+        index.loaded_at = saved["loaded_at"]
+        index.index = {
+            login: [tuple(entry) for entry in entries]
+            for login, entries in saved["index"].items()
+        }
+        return index
+
+    @classmethod
+    def get(cls, gh, org_names, path=DEFAULT_PATH, max_age=DEFAULT_MAX_AGE, workers=8):
+        """Warm start from path when possible, otherwise load and save."""
+        index = cls.load_saved(path, max_age, org_names)
+        if index is None:
+            index = cls.load(gh, org_names, workers)
+            index.save(path)
+        return index
+
+    def lookup(self, login):
+        """Return [(org, role), ...] for login, sorted by org."""
+        return sorted(self.index.get(login.lower(), []))
+
+    def lookup_many(self, logins):
+        return {login: self.lookup(login) for login in logins}
+
+
+def check_login_perms(index, logins, headers=None):
+    """Report on logins, in the same format as the UserSearch notebook.
+
+    Returns (lines of output, set of logins with any role).
+    """
+    any_perms = ["=" * 30]
+    logins_with_hits = set()
+    if headers:
+        any_perms.extend(headers)
+    if not len(logins):
+        any_perms.append("\nFound no valid usernames")
+        return any_perms, logins_with_hits
+    any_perms.append(
+        "\nChecking {} usernames for membership in {} orgs".format(
+            len(logins), len(index.orgs)
+        )
+    )
+    for login in logins:
+        hits = index.lookup(login)
+        if not hits:
+            any_perms.append(f"No permissions found for {login}")
+            continue
+        any_perms.append("\nFound {:d} orgs for {}:".format(len(hits), login))
+        for org, role in hits:
+            if role == "outside_collaborator":
+                url = "https://github.com/orgs/{}/outside-collaborators?utf8=%E2%9C%93&query={}".format(
+                    org, login
+                )
+                any_perms.append(f"FOUND! {org} has {login} as a collaborator: {url}")
+                continue
+            url = "https://github.com/orgs/{}/people?utf8=%E2%9C%93&query={}".format(
+                org, login
+            )
+            phonebook_url = f"https://people.mozilla.org/a/ghe_{org}_users/"
+            msg = f"FOUND! {org} has {login} as a member: {url}"
+            msg += f"\n\tRemove from phonebook group if needed: {phonebook_url}"
+            if role == "owner":
+                msg += f"\n  NOTE: {login} is an OWNER of {org}"
+            any_perms.append(msg)
+        any_perms.append("")
+        logins_with_hits.add(login)
+    return any_perms, logins_with_hits
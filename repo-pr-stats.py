@@ -1,52 +1,194 @@
 #!/usr/bin/env python
-from datetime import datetime
-import getopt
-import urllib.request, urllib.parse, urllib.error
-import sys
+"""Report how long closed pull requests took to merge.
 
-import requests
-from functools import reduce
+Pages through the whole closed pull request history of each repository
+(several pages at a time), and reports the mean, median, 90th and 99th
+percentile time to merge -- overall, per repository, and by month merged.
+"""
+import argparse
+import calendar
+import time
+from array import array
+from datetime import timedelta
+from statistics import mean, median
+
+from client import (
+    get_requests_session,
+    map_concurrently,
+    paginate,
+    paginate_concurrently,
+)
+
+_epilog = """
+Targets are "owner/repo", or use --org for every repository in an org.
+The older "owner repo" form (two arguments without a slash) still works.
+"""
 
 
 def _parse_github_datetime(datetime_string):
-    try:
-        return datetime.strptime(datetime_string, "%Y-%m-%dT%H:%M:%SZ")
-    except TypeError:
-        pass
+    return float(calendar.timegm(time.strptime(datetime_string, "%Y-%m-%dT%H:%M:%SZ")))
+
+
+def percentile(ordered, pct):
+    """pct percentile of the sorted sequence ordered, interpolating linearly."""
+    position = (len(ordered) - 1) * pct / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class MergeTimes:
+    """Created & merged timestamps (epoch seconds) of merged pull requests."""
+
+    def __init__(self):
+        self.created = array("d")
+        self.merged = array("d")
 
+    def __len__(self):
+        return len(self.merged)
 
-def usage():
-    print("python repo-pr-stats.py <owner> <repo>")
+    def add(self, pull):
+        self.created.append(_parse_github_datetime(pull["created_at"]))
+        self.merged.append(_parse_github_datetime(pull["merged_at"]))
 
+    def extend(self, other):
+        self.created.extend(other.created)
+        self.merged.extend(other.merged)
 
-def main(argv):
-    owner = argv[0]
-    repo = argv[1]
+    def durations(self):
+        return array("d", (m - c for c, m in zip(self.created, self.merged)))
 
-    params = {"state": "closed", "per_page": 100}
+    def by_month(self):
+        """Return {"YYYY-MM": MergeTimes} keyed by month merged."""
+        months = {}
+        for created, merged in zip(self.created, self.merged):
+            month = time.strftime("%Y-%m", time.gmtime(merged))
+            bucket = months.setdefault(month, MergeTimes())
+            bucket.created.append(created)
+            bucket.merged.append(merged)
+        return dict(sorted(months.items()))
 
-    all_pulls_url = "{}?{}".format(
-        f"https://api.github.com/repos/{owner}/{repo}/pulls",
-        urllib.parse.urlencode(params),
+    def summary(self):
+        """Return {"count", "mean", "median", "p90", "p99"}; times in seconds.
+
+        Everything but count is None when nothing was merged.
+        """
+        durations = sorted(self.durations())
+        if not durations:
+            return dict(count=0, mean=None, median=None, p90=None, p99=None)
+        return dict(
+            count=len(durations),
+            mean=mean(durations),
+            median=median(durations),
+            p90=percentile(durations, 90),
+            p99=percentile(durations, 99),
+        )
+
+
+def fetch_merge_times(session, full_name, workers=4, verbose=False):
+    """Return (MergeTimes, lines to print) for one repository.
+
+    Runs in a worker thread, so it leaves the printing to the caller.
+    """
+    times = MergeTimes()
+    lines = []
+    pulls = paginate_concurrently(
+        session,
+        f"https://api.github.com/repos/{full_name}/pulls",
+        {"state": "closed"},
+        workers=workers,
     )
-    resp = requests.get(all_pulls_url)
+    for pull in pulls:
+        if pull["merged_at"] is None:
+            continue
+        times.add(pull)
+        if verbose:
+            review_time = timedelta(seconds=times.merged[-1] - times.created[-1])
+            lines.append(f"Pull {pull['id']} review took {review_time} to merge")
+    return times, lines
+
+
+def format_summary(label, summary):
+    if not summary["count"]:
+        return f"{label}: no merged pull requests"
+
+    def fmt(seconds):
+        return str(timedelta(seconds=round(seconds)))
+
+    return "{}: {} pulls, mean {}, median {}, p90 {}, p99 {}".format(
+        label,
+        summary["count"],
+        *(fmt(summary[k]) for k in ("mean", "median", "p90", "p99")),
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog=_epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("targets", nargs="*", help="owner/repo to report on")
+    parser.add_argument(
+        "--org",
+        action="append",
+        default=[],
+        help="report on every repository in this org (may be repeated)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="repositories, and pages of each, to fetch at once (default 4)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="print each pull's time to merge"
+    )
+    args = parser.parse_args()
+    if len(args.targets) == 2 and not any("/" in t for t in args.targets):
+        args.targets = ["/".join(args.targets)]
+    for target in args.targets:
+        if target.count("/") != 1:
+            parser.error(f"'{target}' isn't owner/repo")
+    if not (args.targets or args.org):
+        parser.error("nothing to report on")
+    return args
+
+
+def main():
+    args = parse_args()
+    session = get_requests_session()
+
+    repos = list(args.targets)
+    for org in args.org:
+        repos.extend(
+            r["full_name"]
+            for r in paginate(session, f"https://api.github.com/orgs/{org}/repos")
+        )
 
-    all_pulls = resp.json()
-    review_times = []
-    for pull in all_pulls:
-        if pull["merged_at"] is not None:
-            created_at = _parse_github_datetime(pull["created_at"])
-            merged_at = _parse_github_datetime(pull["merged_at"])
-            review_time = merged_at - created_at
-            print("Pull {} review took {} to merge".format(pull["id"], review_time))
-            review_times.append(review_time)
+    total = MergeTimes()
+    for full_name, (times, lines) in zip(
+        repos,
+        map_concurrently(
+            lambda name: fetch_merge_times(session, name, args.workers, args.verbose),
+            repos,
+            args.workers,
+        ),
+    ):
+        for line in lines:
+            print(line)
+        if len(repos) > 1:
+            print(format_summary(full_name, times.summary()))
+        total.extend(times)
 
-    print("Total Average Review Time (%s pulls): " % len(review_times))
-    print(reduce(lambda x, y: x + y, review_times) / len(review_times))
+    if len(repos) > 1:
+        print()
+    print(format_summary(f"Total ({len(repos)} repos)", total.summary()))
+    print()
+    print("By month merged:")
+    for month, times in total.by_month().items():
+        print(format_summary(f"  {month}", times.summary()))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        usage()
-    else:
-        main(sys.argv[1:])
+    main()
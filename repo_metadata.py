@@ -0,0 +1,92 @@
+"""In memory cache of repository metadata, filled an org at a time.
+
+Listing an org's repositories returns the same metadata (archived,
+fork, pushed_at, ...) as fetching each repository, at 100 repositories
+per request. Code paths that need a field for many repositories --
+e.g. dropping search hits in archived repositories -- should ask this
+cache instead of calling repository.refresh() per item.
+"""
+
+import logging
+import threading
+import time
+
+import github3
+
+DEFAULT_TTL = 3600
+
+logger = logging.getLogger(__name__)
+
+
+class RepoMetadataCache:
+    """Map "owner/repo" -> repository JSON, entries expire after ttl."""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.repos = {}
+        # org name -> time its listing was loaded
+        self.filled = {}
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _fresh(self, stamp):
+        return stamp is not None and time.time() - stamp <= self.ttl
+
+    def put(self, data):
+        with self.lock:
+            self.repos[data["full_name"].lower()] = (time.time(), data)
+
+    def fill_org(self, gh, org_name):
+        """Load metadata for every repository in org_name; return the count."""
+        count = 0
+        for repo in gh.organization(org_name).repositories():
+            self.put(repo.as_dict())
+            count += 1
+        with self.lock:
+            self.filled[org_name.lower()] = time.time()
+        logger.debug("Cached metadata for %d repositories in %s", count, org_name)
+        return count
+
+    def get(self, full_name):
+        """Return cached metadata for full_name, or None if missing or stale."""
+        with self.lock:
+            stamp, data = self.repos.get(full_name.lower(), (None, None))
+            if self._fresh(stamp):
+                self.hits += 1
+                return data
+            self.misses += 1
+            return None
+
+    def lookup(self, gh, full_name):
+        """Return metadata for full_name, loading it if needed.
+
+        The owning org's listing is loaded (once per ttl) rather than the
+        single repository, since more lookups in that org usually follow.
+        Returns None for repositories we can't see.
+        """
+        data = self.get(full_name)
+        if data is not None:
+            return data
+        owner, name = full_name.split("/", 1)
+        if not self._fresh(self.filled.get(owner.lower())):
+            try:
+                self.fill_org(gh, owner)
+            except github3.exceptions.NotFoundError:
+                # a user, rather than an org, owns it
+                pass
+            data = self.get(full_name)
+            if data is not None:
+                return data
+        try:
+            repo = gh.repository(owner, name)
+        except github3.exceptions.NotFoundError:
+            return None
+        self.put(repo.as_dict())
+        return repo.as_dict()
+
+    def stats(self):
+        return {
+            "repositories": len(self.repos),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
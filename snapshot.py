@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+"""Crawl organizations into a local snapshot database."""
+
+_epilog = """
+The snapshot holds members (with role), outside collaborators, teams and
+their members, invitations, repositories, and each repository's
+collaborators and hooks. Scripts given '--from-snapshot' answer from it
+instead of the API.
+
+Re-running the crawl refreshes the snapshot. Org level data is always
+re-read (cheap with the HTTP cache), but per repository data is only
+re-fetched for repositories that are new, have changed since the last
+crawl, or are older than --max-age. Deleted repositories are dropped.
+
+Changing a repository's collaborators or hooks doesn't change its
+pushed_at or updated_at, so --max-age (a day by default) bounds how
+stale those can be. Use --max-age 0 to re-fetch everything.
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+
+import github3
+
+import client
+import github_graphql
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "cache", "snapshot.sqlite")
+# collaborator & hook changes don't show in a repository's timestamps
+DEFAULT_MAX_AGE = 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+# what we get for repositories we're not an admin of
+NOT_VISIBLE = (github3.exceptions.NotFoundError, github3.exceptions.ForbiddenError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orgs (
+    org TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    crawled_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    org TEXT NOT NULL,
+    login TEXT NOT NULL,
+    role TEXT NOT NULL,
+    name TEXT,
+    email TEXT,
+    id INTEGER,
+    node_id TEXT,
+    PRIMARY KEY (org, login)
+);
+CREATE INDEX IF NOT EXISTS members_login ON members (login);
+CREATE TABLE IF NOT EXISTS outside_collaborators (
+    org TEXT NOT NULL,
+    login TEXT NOT NULL,
+    PRIMARY KEY (org, login)
+);
+CREATE INDEX IF NOT EXISTS outside_collaborators_login
+    ON outside_collaborators (login);
+CREATE TABLE IF NOT EXISTS teams (
+    org TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (org, slug)
+);
+CREATE TABLE IF NOT EXISTS team_members (
+    org TEXT NOT NULL,
+    slug TEXT NOT NULL,
+    login TEXT NOT NULL,
+    PRIMARY KEY (org, slug, login)
+);
+CREATE TABLE IF NOT EXISTS repos (
+    org TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    pushed_at TEXT,
+    updated_at TEXT,
+    crawled_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (org, id)
+);
+CREATE INDEX IF NOT EXISTS repos_name ON repos (org, name);
+CREATE TABLE IF NOT EXISTS collaborators (
+    org TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    login TEXT NOT NULL,
+    permission TEXT NOT NULL,
+    PRIMARY KEY (org, repo, login)
+);
+CREATE TABLE IF NOT EXISTS hooks (
+    org TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hooks_repo ON hooks (org, repo);
+-- repo is '' for org level invitations
+CREATE TABLE IF NOT EXISTS invitations (
+    org TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS invitations_repo ON invitations (org, repo);
+"""
+
+
+class SnapshotMissing(LookupError):
+    """The requested org has never been crawled into this snapshot."""
+
+
+class OutsideCollaboratorIterator(github3.structs.GitHubIterator):
+    def __init__(self, org):
+        super().__init__(
+            count=-1,  # get all
+            url=org.url + "/outside_collaborators",
+            cls=github3.users.ShortUser,
+            session=org.session,
+        )
+
+
+class Snapshot:
+    """Local copy of org data; crawl() fills it, the rest query it.
+
+    The queries may be made from any thread (e.g. scripts answering from
+    the snapshot under client.map_concurrently); they take turns on the
+    one connection. Scripts only querying should open it read_only, so a
+    mistyped path fails rather than creating an empty snapshot.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, read_only=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if read_only:
+            url = urllib.request.pathname2url(os.path.abspath(path))
+            self.db = sqlite3.connect(
+                f"file:{url}?mode=ro", uri=True, check_same_thread=False
+            )
+            return
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # crawling
+
+    def crawl(self, gh, org_name, workers=8, max_age=DEFAULT_MAX_AGE):
+        """Fetch org_name into the snapshot; return count of repos refreshed.
+
+        Unchanged repositories are re-fetched once older than max_age
+        seconds (never, if None).
+        """
+        org = gh.organization(org_name)
+        org_name = org.login
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO orgs VALUES (?, ?, ?)",
+                (org_name, json.dumps(org.as_dict()), now),
+            )
+            self._crawl_people(org)
+            self._crawl_teams(org)
+        refreshed = self._crawl_repos(org, workers, max_age)
+        return refreshed
+
+    def _crawl_people(self, org):
+        self.db.execute("DELETE FROM members WHERE org = ?", (org.login,))
+        self.db.executemany(
+            "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    org.login,
+                    m["login"],
+                    m["role"].lower(),
+                    m["name"],
+                    m["email"],
+                    m["id"],
+                    m["node_id"],
+                )
+                for m in github_graphql.org_members(org.login)
+            ],
+        )
+        try:
+            outside = [u.login for u in OutsideCollaboratorIterator(org)]
+            invitations = [i.as_dict() for i in org.invitations()]
+        except github3.exceptions.ForbiddenError:
+            logger.warning("No 'admin:org' permissions for org '%s'", org.login)
+            outside, invitations = [], []
+        self.db.execute("DELETE FROM outside_collaborators WHERE org = ?", (org.login,))
+        self.db.executemany(
+            "INSERT INTO outside_collaborators VALUES (?, ?)",
+            [(org.login, login) for login in outside],
+        )
+        self.db.execute(
+            "DELETE FROM invitations WHERE org = ? AND repo = ''", (org.login,)
+        )
+        self.db.executemany(
+            "INSERT INTO invitations VALUES (?, '', ?)",
+            [(org.login, json.dumps(i)) for i in invitations],
+        )
+
+    def _crawl_teams(self, org):
+        teams = list(org.teams())
+
+        def team_members(team):
+            return team, [m.login for m in team.members()]
+
+        self.db.execute("DELETE FROM teams WHERE org = ?", (org.login,))
+        self.db.execute("DELETE FROM team_members WHERE org = ?", (org.login,))
+        for team, logins in client.map_concurrently(team_members, teams, 8):
+            self.db.execute(
+                "INSERT INTO teams VALUES (?, ?, ?, ?)",
+                (org.login, team.slug, team.name, team.id),
+            )
+            self.db.executemany(
+                "INSERT INTO team_members VALUES (?, ?, ?)",
+                [(org.login, team.slug, login) for login in logins],
+            )
+
+    def _crawl_repos(self, org, workers, max_age):
+        cached = {
+            row[0]: row[1:]
+            for row in self.db.execute(
+                "SELECT id, pushed_at, updated_at, crawled_at FROM repos"
+                " WHERE org = ?",
+                (org.login,),
+            )
+        }
+        now = time.time()
+        live, stale = {}, []
+        for repo in org.repositories():
+            data = repo.as_dict()
+            live[repo.id] = repo
+            entry = cached.get(repo.id)
+            if (
+                entry is None
+                or entry[:2] != (data.get("pushed_at"), data.get("updated_at"))
+                or (max_age is not None and now - entry[2] > max_age)
+            ):
+                stale.append(repo)
+
+        def details(repo):
+            hooks = invitations = []
+            try:
+                hooks = [h.as_dict() for h in repo.hooks()]
+            except NOT_VISIBLE:
+                pass
+            try:
+                invitations = [i.as_dict() for i in repo.invitations()]
+            except NOT_VISIBLE:
+                pass
+            return repo, hooks, invitations
+
+        collaborators = github_graphql.repo_collaborators(
+            [(org.login, repo.name) for repo in stale]
+        )
+        with self.db:
+            for repo, hooks, invitations in client.map_concurrently(
+                details, stale, workers
+            ):
+                self._store_repo(org.login, repo, hooks, invitations, collaborators)
+            gone = set(cached) - set(live)
+            for repo_id in gone:
+                self._drop_repo(org.login, repo_id)
+        logger.info(
+            "%s: %d repositories, %d refreshed, %d dropped",
+            org.login,
+            len(live),
+            len(stale),
+            len(gone),
+        )
+        return len(stale)
+
+    def _store_repo(self, org, repo, hooks, invitations, collaborators):
+        data = repo.as_dict()
+        self._drop_repo(org, repo.id)
+        self.db.execute(
+            "INSERT INTO repos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                org,
+                repo.id,
+                repo.name,
+                data.get("pushed_at"),
+                data.get("updated_at"),
+                time.time(),
+                json.dumps(data),
+            ),
+        )
+        self.db.executemany(
+            "INSERT INTO collaborators VALUES (?, ?, ?, ?)",
+            [
+                (org, repo.name, c["login"], c["permission"].lower())
+                for c in collaborators.get(f"{org}/{repo.name}", [])
+            ],
+        )
+        self.db.executemany(
+            "INSERT INTO hooks VALUES (?, ?, ?)",
+            [(org, repo.name, json.dumps(h)) for h in hooks],
+        )
+        self.db.executemany(
+            "INSERT INTO invitations VALUES (?, ?, ?)",
+            [(org, repo.name, json.dumps(i)) for i in invitations],
+        )
+
+    def _drop_repo(self, org, repo_id):
+        row = self.db.execute(
+            "SELECT name FROM repos WHERE org = ? AND id = ?", (org, repo_id)
+        ).fetchone()
+        if row is None:
+            return
+        for table in ("collaborators", "hooks", "invitations"):
+            self.db.execute(
+                f"DELETE FROM {table} WHERE org = ? AND repo = ?",  # nosec
+                (org, row[0]),
+            )
+        self.db.execute("DELETE FROM repos WHERE org = ? AND id = ?", (org, repo_id))
+
+    # queries
+
+    def _rows(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _org_key(self, org):
+        # GitHub logins are case insensitive, be the same
+        rows = self._rows("SELECT org FROM orgs WHERE org = ? COLLATE NOCASE", (org,))
+        if not rows:
+            raise SnapshotMissing(f"org '{org}' not in snapshot {self.path}")
+        return rows[0][0]
+
+    def orgs(self):
+        return [row[0] for row in self._rows("SELECT org FROM orgs ORDER BY 1")]
+
+    def org(self, org):
+        org = self._org_key(org)
+        ((data,),) = self._rows("SELECT data FROM orgs WHERE org = ?", (org,))
+        return json.loads(data)
+
+    def members(self, org, role=None):
+        """Return member dicts; role is 'admin', 'member' or None for all."""
+        org = self._org_key(org)
+        sql = "SELECT login, role, name, email, id, node_id FROM members WHERE org = ?"
+        params = [org]
+        if role and role != "all":
+            sql += " AND role = ?"
+            params.append(role)
+        keys = ("login", "role", "name", "email", "id", "node_id")
+        return [
+            dict(zip(keys, row)) for row in self._rows(sql + " ORDER BY login", params)
+        ]
+
+    def member(self, login):
+        """Return the member dict for login from any org, or None."""
+        keys = ("login", "role", "name", "email", "id", "node_id")
+        rows = self._rows(
+            "SELECT login, role, name, email, id, node_id FROM members"
+            " WHERE login = ? COLLATE NOCASE ORDER BY email IS NULL LIMIT 1",
+            (login,),
+        )
+        return dict(zip(keys, rows[0])) if rows else None
+
+    def outside_collaborators(self, org):
+        org = self._org_key(org)
+        return [
+            row[0]
+            for row in self._rows(
+                "SELECT login FROM outside_collaborators WHERE org = ? ORDER BY 1",
+                (org,),
+            )
+        ]
+
+    def team_members(self, org, slug):
+        org = self._org_key(org)
+        return [
+            row[0]
+            for row in self._rows(
+                "SELECT login FROM team_members WHERE org = ? AND slug = ?"
+                " ORDER BY 1",
+                (org, slug),
+            )
+        ]
+
+    def repos(self, org):
+        org = self._org_key(org)
+        return [
+            json.loads(row[0])
+            for row in self._rows(
+                "SELECT data FROM repos WHERE org = ? ORDER BY name", (org,)
+            )
+        ]
+
+    def collaborators(self, org, repo, permission=None):
+        org = self._org_key(org)
+        sql = "SELECT login FROM collaborators WHERE org = ? AND repo = ?"
+        params = [org, repo]
+        if permission:
+            sql += " AND permission = ?"
+            params.append(permission)
+        return [row[0] for row in self._rows(sql + " ORDER BY 1", params)]
+
+    def hooks(self, org):
+        """Return {repo name: [hook dict, ...]} for repos with hooks."""
+        org = self._org_key(org)
+        result = {}
+        for repo, data in self._rows(
+            "SELECT repo, data FROM hooks WHERE org = ? ORDER BY repo", (org,)
+        ):
+            result.setdefault(repo, []).append(json.loads(data))
+        return result
+
+    def invitations(self, org):
+        """Return [(repo name or '', invitation dict), ...]."""
+        org = self._org_key(org)
+        return [
+            (repo, json.loads(data))
+            for repo, data in self._rows(
+                "SELECT repo, data FROM invitations WHERE org = ? ORDER BY repo",
+                (org,),
+            )
+        ]
+
+
+def add_snapshot_argument(parser):
+    """Add the common '--from-snapshot [PATH]' option to parser."""
+    parser.add_argument(
+        "--from-snapshot",
+        nargs="?",
+        const=DEFAULT_PATH,
+        default=None,
+        metavar="PATH",
+        help=f"answer from a snapshot database (default {DEFAULT_PATH})"
+        " instead of the API - see snapshot.py",
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, epilog=_epilog)
+    parser.add_argument("orgs", nargs="+", help="github organizations to crawl")
+    parser.add_argument(
+        "--db", default=DEFAULT_PATH, help=f"snapshot database (default {DEFAULT_PATH})"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="repositories to fetch at once (default 8)",
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=DEFAULT_MAX_AGE / 3600,
+        metavar="HOURS",
+        help="re-fetch repository details older than this, even if unchanged"
+        " (default %(default)g)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    gh = client.get_github3_client()
+    snapshot = Snapshot(args.db)
+    max_age = args.max_age * 3600
+    try:
+        for org in args.orgs:
+            refreshed = snapshot.crawl(gh, org, args.workers, max_age)
+            print(f"{org}: refreshed {refreshed} repositories")
+    finally:
+        snapshot.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logging.getLogger("github3").setLevel(logging.WARNING)
+    try:
+        main()
+    except KeyboardInterrupt:
+        raise SystemExit("\nCancelled by user")
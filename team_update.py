@@ -7,10 +7,11 @@ see --help output for names
 
 import argparse
 import logging
-import sys
+import re
 
-from client import get_github3_client
+from client import get_github3_client, map_concurrently, retry_step
 import github3
+from snapshot import Snapshot, SnapshotMissing, add_snapshot_argument
 
 
 TEAM = "admin-all-org-"
@@ -26,86 +27,136 @@ def team_name(user_type):
     return team_name
 
 
+def team_slug(team_name):
+    """GitHub's slug for a team name: lower case, other characters as '-'."""
+    return re.sub(r"[^a-z0-9_]+", "-", team_name.lower()).strip("-")
+
+
 def get_or_create_team(org, team_name):
     try:
-        team = [x for x in org.teams() if x.name == team_name][0]
-    except IndexError:
-        # no such team
+        team = org.team_by_name(team_slug(team_name))
+    except github3.exceptions.NotFoundError:
+        # our slug may not be GitHub's (punctuation), so check the names
+        # before deciding there's no such team
+        for team in org.teams():
+            if team.name.lower() == team_name.lower():
+                return team
         team = org.create_team(team_name)
-        logger.warn(f"created team {team_name} in {org.login}")
+        logger.warning(f"created team {team_name} in {org.login}")
     return team
 
 
-def update_team_membership(org, new_member_list, team_name=None, do_update=False):
+class TeamDiff:
+    """Changes needed to make a team's members exactly new_logins."""
+
+    def __init__(self, current, new_logins):
+        current, new = set(current), set(new_logins)
+        self.to_remove = sorted(current - new)
+        self.to_add = sorted(new - current)
+        self.no_change = sorted(new & current)
+        self.failed = []
+
+
+def apply_diff(team, diff, workers=4):
+    """Make the adds & removes in diff, up to workers at once.
+
+    Each login is retried on transient errors; a login that still fails
+    is recorded in diff.failed, and doesn't stop the others.
+    """
+
+    def change(item):
+        action, login = item
+        # both are idempotent, so safe to retry
+        if action == "add":
+            method = team.add_or_update_membership
+        else:
+            method = team.revoke_membership
+        try:
+            ok = bool(retry_step(lambda attempt: method(login), f"{action} of {login}"))
+        except github3.exceptions.GitHubException as e:
+            logger.warning(f"Failed to {action} '{login}': {e}")
+            ok = False
+        return action, login, ok
+
+    changes = [("remove", login) for login in diff.to_remove]
+    changes += [("add", login) for login in diff.to_add]
+    for action, login, ok in map_concurrently(change, changes, workers):
+        if not ok:
+            diff.failed.append((action, login))
+    return diff
+
+
+def update_team_membership(
+    org, new_logins, team_name=None, do_update=False, current=None, workers=4
+):
+    """Report (and with do_update, make) the changes to team_name.
+
+    Returns (lines of report, TeamDiff). current may be supplied (from a
+    snapshot), for reporting only.
+    """
     # we're using a team to communicate with these folks, update
-    # that team to contain exactly new_member_list members
-    # team must already exist in the org
-    team = get_or_create_team(org, team_name)
-    # get set of current members
-    current = {x.login for x in team.members()}
-    # get set of new members
-    new = {x.login for x in new_member_list}
-    to_remove = current - new
-    to_add = new - current
-    no_change = new & current
-    update_success = True
+    # that team to contain exactly new_logins members
+    if current is None:
+        team = get_or_create_team(org, team_name)
+        current = {x.login for x in team.members()}
+    diff = TeamDiff(current, new_logins)
+    if do_update:
+        apply_diff(team, diff, workers)
+
+    lines = []
     if VERBOSE:
-        print("%5d unchanged" % len(no_change))
-        for login in no_change:
-            print(f"    {login} is unchanged")
-    print("%5d alumni" % len(to_remove))
-    for login in to_remove:
-        if do_update and not team.remove_member(login):
-            logger.warn(
-                "Failed to remove a member" " - you need 'admin:org' permissions"
-            )
-            update_success = False
-            break
-        if VERBOSE:
-            print(f"    {login} has departed")
-    print("%5d new" % len(to_add))
-    for login in to_add:
-        if VERBOSE:
-            print(f"    {login} is new")
-        try:
-            if do_update and not team.add_member(login):
-                logger.warn(
-                    "Failed to add a member" " - you need 'admin:org' permissions"
-                )
-                update_success = False
-                break
-        except github3.exceptions.ForbiddenError:
-            # this occurs occasionally, don't stop work
-            logger.warn(f"Failed to add member '{login}'")
-            update_success = False
-    print("%5d no change" % len(no_change))
+        lines.append("%5d unchanged" % len(diff.no_change))
+        lines.extend(f"    {login} is unchanged" for login in diff.no_change)
+    lines.append("%5d alumni" % len(diff.to_remove))
+    if VERBOSE:
+        lines.extend(f"    {login} has departed" for login in diff.to_remove)
+    lines.append("%5d new" % len(diff.to_add))
+    if VERBOSE:
+        lines.extend(f"    {login} is new" for login in diff.to_add)
+    lines.append("%5d no change" % len(diff.no_change))
     # if we're running in the ipython notebook, the log message isn't
     # displayed. Output something useful
-    if not update_success:
-        print(f"Updates were not all made to team '{team_name}' in '{org.name}'.")
-        print(
+    if diff.failed:
+        lines.append(
+            f"{len(diff.failed)} updates were not made to team '{team_name}' in"
+            f" '{org.name}': "
+            + ", ".join(f"{action} {login}" for action, login in diff.failed)
+        )
+        lines.append(
             "Make sure your API token has 'admin:org' permissions for that organization."
         )
+    return lines, diff
 
 
-def check_users(gh, org_name, admins_only=True, update_team=False):
-
-    try:
-        org = gh.organization(org_name)
-    except github3.exceptions.NotFoundError:
-        print(f"Org '{org_name}' does not exist")
-        sys.exit(1)
+def check_users(
+    gh, org_name, admins_only=True, update_team=False, snapshot=None, workers=4
+):
+    """Return (lines of report, TeamDiff or None) for one org & team.
 
+    Raises github3.exceptions.NotFoundError for an org that doesn't exist.
+    """
     role = "admin" if admins_only else "all"
     user_type = "owners" if admins_only else "members"
-    members = list(org.members(role=role))
+    if snapshot is not None:
+        org = None
+        members = [m["login"] for m in snapshot.members(org_name, role=role)]
+        current = set(snapshot.team_members(org_name, team_slug(team_name(user_type))))
+    else:
+        org = gh.organization(org_name)
+        members = [m.login for m in org.members(role=role)]
+        current = None
 
     if members:
-        print("There are %d %s for org %s:" % (len(members), user_type, org_name))
+        lines = ["There are %d %s for org %s:" % (len(members), user_type, org_name)]
     else:
-        print(f"Error: no {user_type} found for {org_name}")
+        lines = [f"Error: no {user_type} found for {org_name}"]
+    diff = None
     if update_team or VERBOSE:
-        update_team_membership(org, members, team_name(user_type), update_team)
+        more, diff = update_team_membership(
+            org, members, team_name(user_type), update_team, current, workers
+        )
+        lines.extend(more)
+    return lines, diff
 
 
 def parse_args():
@@ -115,6 +166,11 @@ def parse_args():
         action="store_true",
         help="Report only for org owners (default all members)",
     )
+    parser.add_argument(
+        "--both",
+        action="store_true",
+        help="Handle both the owners and the members team of each org",
+    )
     parser.add_argument(
         "orgs",
         nargs="*",
@@ -131,10 +187,25 @@ def parse_args():
     parser.add_argument(
         "--update-team", action="store_true", help="apply changes to GitHub"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="teams, and changes to each, to handle at once (default 4)",
+    )
     parser.add_argument(
         "--verbose", action="store_true", help="print logins for all changes"
     )
-    return parser.parse_args()
+    add_snapshot_argument(parser)
+    args = parser.parse_args()
+    if args.from_snapshot and args.update_team:
+        parser.error("Can't --update-team from a snapshot")
+    if args.both and args.team[-1:] not in ("-", "_"):
+        # both jobs would reconcile the same team, against each other
+        parser.error(
+            f"--both needs a --team prefix ending in '-' or '_', not '{args.team}'"
+        )
+    return args
 
 
 def main():
@@ -143,12 +214,46 @@ def main():
     VERBOSE = args.verbose
     global TEAM
     TEAM = args.team
-    if args.orgs:
-        gh = get_github3_client()
-        for org in args.orgs:
-            check_users(gh, org, args.owners, args.update_team)
+    if not args.orgs:
+        return 0
+    if args.from_snapshot:
+        gh, snapshot = None, Snapshot(args.from_snapshot, read_only=True)
+        # local queries, nothing to gain from a pool
+        workers = 1
+    else:
+        gh, snapshot = get_github3_client(), None
+        workers = args.workers
+    owner_choices = [True, False] if args.both else [args.owners]
+    jobs = [(org, owners) for org in args.orgs for owners in owner_choices]
+
+    def run(job):
+        org, owners = job
+        try:
+            return check_users(
+                gh, org, owners, args.update_team, snapshot, args.workers
+            )
+        except github3.exceptions.NotFoundError:
+            return [f"Org '{org}' does not exist"], False
+        except SnapshotMissing as e:
+            return [f"Error: {e}"], False
+
+    exit_code = added = removed = failed = 0
+    for lines, diff in map_concurrently(run, jobs, workers):
+        print("\n".join(lines))
+        if diff is False:
+            exit_code = 1
+        elif diff and args.update_team:
+            added += len(diff.to_add)
+            removed += len(diff.to_remove)
+            failed += len(diff.failed)
+    if args.update_team and len(jobs) > 1:
+        print(
+            f"\nAcross {len(jobs)} teams: {added} adds and {removed} removes,"
+            f" {failed} failed"
+        )
+    return 1 if failed else exit_code
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.WARN, format="%(asctime)s %(message)s")
-    main()
+    raise SystemExit(main())
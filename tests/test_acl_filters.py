@@ -0,0 +1,144 @@
+import pytest
+
+import acl_filters
+import repo_metadata
+
+BLOB = "https://github.com/{}/blob/47f31f014cf21dc6e7e774ddc28e51a6f9eeba54/{}"
+SEARCH = "https://github.com/search?type=Code&ref=advsearch&q=repo%3A{}+path%3A{}+oremj"
+REPS = "Community%20Analytics%20-%20Reps%20Organization%20-%20Test%201.csv"
+
+
+# the cases from the UserSearch notebook
+@pytest.mark.parametrize(
+    "repo, path, expected",
+    [
+        # file extensions
+        ("mozilla-services/foxsec-results", "bucketlister/README.md", None),
+        ("mozilla-services/product-delivery-tools", "b/README.markdown", None),
+        (
+            "mozilla-services/cloudops-docs",
+            "TeamDiagrams/service_registry.csv",
+            (
+                SEARCH.format(
+                    "mozilla-services/cloudops-docs",
+                    '"TeamDiagrams/service_registry.csv"',
+                ),
+                "mozilla-services/cloudops-docs",
+                "TeamDiagrams",
+                "service_registry.csv",
+            ),
+        ),
+        (
+            "mozilla/participation-metrics-identities",
+            REPS,
+            (
+                SEARCH.format("mozilla/participation-metrics-identities", f'"{REPS}"'),
+                "mozilla/participation-metrics-identities",
+                "",
+                REPS,
+            ),
+        ),
+        # org
+        ("fxos/participation-metrics-identities", REPS, None),
+        # repository regexp
+        ("mozilla-releng/take-home-assignment-no-such-repo", REPS, None),
+        # paths, matched as substrings
+        ("mozilla/participation-metrics-identities", "tests/skip.csv", None),
+        ("Pocket/Android", "sync/src/test/resources/mock/x.json", None),
+        ("mozilla-services/addons-code-corpus", "train/bad/872325/chat/x.js", None),
+        ("mozilla-services/addons-code-corpus", "training/bad/x.js", None),
+        ("Pocket/iOS", "Listen/Listen/Sample/Definitions/PKTListenAppTheme.m", None),
+        ("Pocket/particle", "convert/samples/input/1685443536.txt", None),
+        # file names
+        ("Pocket/particle", "convert/Makefile", None),
+        ("Pocket/particle", "pyproject.toml", None),
+        ("mozilla-it/cloudalerts", "Dockerfile", None),
+        ("mozilla-it/it-sre-bot", "package-lock.json", None),
+        ("mozilla-services/splunk-ops", "httplib2/cacerts.txt", None),
+        ("mozilla-mobile/firefox-android", "values-is/strings.xml", None),
+        # makefile != Makefile
+        (
+            "mozilla-services/cloudops-docs",
+            "TeamDiagrams/makefile",
+            (
+                SEARCH.format(
+                    "mozilla-services/cloudops-docs", '"TeamDiagrams/makefile"'
+                ),
+                "mozilla-services/cloudops-docs",
+                "TeamDiagrams",
+                "makefile",
+            ),
+        ),
+    ],
+)
+def test_search_hit_to_url(repo, path, expected):
+    assert acl_filters.search_hit_to_url(BLOB.format(repo, path), "oremj") == expected
+
+
+def hit(repo, *fragments):
+    return {
+        "html_url": BLOB.format(repo, "acl.txt"),
+        "path": "acl.txt",
+        "repository": repo,
+        "fragments": list(fragments),
+    }
+
+
+class FakeRepo:
+    def __init__(self, full_name, archived=False):
+        self.data = {"full_name": full_name, "archived": archived}
+
+    def as_dict(self):
+        return self.data
+
+
+class FakeGitHub:
+    def __init__(self, repos):
+        self.repos = repos
+        self.calls = []
+
+    def organization(self, name):
+        self.calls.append(("organization", name))
+        gh = self
+
+        class Org:
+            def repositories(self):
+                return [r for r in gh.repos if r.data["full_name"].startswith(name)]
+
+        return Org()
+
+    def repository(self, owner, name):
+        self.calls.append(("repository", owner, name))
+        return FakeRepo(f"{owner}/{name}")
+
+
+def test_prune_uses_one_listing_per_org():
+    gh = FakeGitHub([FakeRepo("mozilla/live"), FakeRepo("mozilla/old", archived=True)])
+    cache = repo_metadata.RepoMetadataCache()
+    hits = [hit("mozilla/live", "owner: oremj")] * 50 + [
+        hit("mozilla/old", "oremj"),
+        hit("mozilla/x-ghsa-1234", "oremj"),
+        hit("mozilla/live", "oremjx"),
+    ]
+    kept = acl_filters.prune_hits_to_ignore(
+        hits, "oremj", acl_filters.archived_check(gh, cache)
+    )
+    assert kept == hits[:50]
+    assert gh.calls == [("organization", "mozilla")]
+
+
+def test_repo_cache_expires():
+    gh = FakeGitHub([FakeRepo("mozilla/live")])
+    cache = repo_metadata.RepoMetadataCache(ttl=60)
+    assert cache.lookup(gh, "mozilla/live")["full_name"] == "mozilla/live"
+    assert cache.lookup(gh, "Mozilla/Live")
+    assert len(gh.calls) == 1
+    # not in the listing: fetched on its own
+    assert cache.lookup(gh, "mozilla/new")
+    assert gh.calls[-1] == ("repository", "mozilla", "new")
+    stamp, data = cache.repos["mozilla/live"]
+    cache.repos["mozilla/live"] = (stamp - 61, data)
+    cache.filled["mozilla"] -= 61
+    assert cache.get("mozilla/live") is None
+    cache.lookup(gh, "mozilla/live")
+    assert gh.calls[-1] == ("organization", "mozilla")
@@ -0,0 +1,137 @@
+import sys
+
+import pytest
+import requests
+
+import acl_search
+
+
+def make_item(n):
+    return {
+        "html_url": f"https://github.com/mozilla/r/blob/abc/f{n}",
+        "path": f"f{n}",
+        "repository": {"full_name": "mozilla/r", "id": 1},
+        "text_matches": [{"fragment": f"user{n}"}],
+    }
+
+
+class FakeSession:
+    """Serve total_count items, failing once on the given page."""
+
+    def __init__(self, total, fail_on=None):
+        self.total = total
+        self.fail_on = fail_on
+        self.pages = []
+
+    def get(self, url, params, headers):
+        page = params["page"]
+        if page == self.fail_on:
+            self.fail_on = None
+            raise requests.ConnectionError("dropped")
+        self.pages.append(page)
+        start = (page - 1) * params["per_page"]
+        end = min(start + params["per_page"], self.total)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = requests.compat.json.dumps(
+            {
+                "total_count": self.total,
+                "incomplete_results": False,
+                "items": [make_item(n) for n in range(start, end)],
+            }
+        ).encode()
+        return response
+
+
+def test_search_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    session = FakeSession(total=250, fail_on=3)
+    search = acl_search.CodeSearch(acl_search.Checkpoint(path), session)
+    with pytest.raises(requests.ConnectionError):
+        search.search("org:mozilla user")
+    assert session.pages == [1, 2]
+
+    # a new process picks up at page 3
+    search = acl_search.CodeSearch(acl_search.Checkpoint(path), session)
+    hits = search.search("org:mozilla user")
+    assert session.pages == [1, 2, 3]
+    assert [h["path"] for h in hits] == [f"f{n}" for n in range(250)]
+    assert hits[0]["fragments"] == ["user0"]
+
+    # finished queries aren't searched again
+    search.search("org:mozilla user")
+    assert session.pages == [1, 2, 3]
+
+
+def test_search_stops_at_result_limit():
+    session = FakeSession(total=5000)
+    search = acl_search.CodeSearch(acl_search.Checkpoint(None), session)
+    assert len(search.search("org:mozilla user")) == acl_search.MAX_RESULTS
+    assert session.pages == list(range(1, 11))
+
+
+def test_plan_packs_terms_and_orgs():
+    terms = [f"login{n}" for n in range(8)]
+    plan = acl_search.plan_queries(acl_search.DEFAULT_ORGS, terms)
+    # 8 terms need two queries (at most 5 ORs each); all orgs fit in each
+    assert len(plan) == 2
+    for query, orgs, query_terms in plan:
+        assert len(query) <= acl_search.MAX_QUERY_LENGTH
+        assert query.count(" OR ") <= acl_search.MAX_OPERATORS
+        assert orgs == acl_search.DEFAULT_ORGS
+    assert [t for _, _, group in plan for t in group] == terms
+    assert plan[0][0].endswith(
+        "login0 OR login1 OR login2 OR login3 OR login4 OR login5"
+    )
+
+
+def test_plan_respects_length():
+    orgs = [f"org-with-a-rather-long-name-{n}" for n in range(20)]
+    plan = acl_search.plan_queries(orgs, ["a b", "c"])
+    assert len(plan) > 1
+    for query, _, _ in plan:
+        assert len(query) <= acl_search.MAX_QUERY_LENGTH
+        assert query.endswith('"a b" OR c')
+    assert [o for _, group, _ in plan for o in group] == orgs
+
+
+def test_no_orgs(monkeypatch, capsys):
+    assert acl_search.plan_queries([], ["a"]) == []
+    monkeypatch.setattr(sys, "argv", ["acl_search.py", "a", "--orgs"])
+    with pytest.raises(SystemExit):
+        acl_search.parse_args()
+    assert "at least one organization" in capsys.readouterr().err
+
+
+def hit(repo, *fragments, path="acl.txt"):
+    return {"repository": repo, "path": path, "fragments": list(fragments)}
+
+
+def test_demultiplex():
+    hits = [
+        hit("mozilla/a", "owners = ['alice', 'bob']"),
+        hit("Mozilla-Services/b", "alice2 is not alice-ish"),
+        hit("mozilla/c", "malice"),
+        hit("mozilla/d", "nothing", path="users/bob.yaml"),
+    ]
+    results = acl_search.demultiplex(
+        hits, ["mozilla", "mozilla-services"], ["alice", "bob"]
+    )
+    assert results[("mozilla", "alice")] == hits[:1]
+    assert results[("mozilla", "bob")] == [hits[0], hits[3]]
+    # "-" is a word boundary for logins too
+    assert results[("mozilla-services", "alice")] == hits[1:2]
+    assert results[("mozilla-services", "bob")] == []
+
+
+def test_packed_query_split_when_truncated():
+    session = FakeSession(total=1500)
+    search = acl_search.CodeSearch(acl_search.Checkpoint(None), session)
+    search.search_packed(["mozilla"], ["alice", "bob"])
+    # one page to learn it's too big, then each term searched separately
+    assert list(search.checkpoint.queries) == [
+        "org:mozilla alice OR bob",
+        "org:mozilla alice",
+        "org:mozilla bob",
+    ]
+    assert search.checkpoint.queries["org:mozilla alice"]["next_page"] == 11
@@ -0,0 +1,141 @@
+import http.server
+import io
+import json
+import threading
+import urllib.parse
+
+import pytest
+import requests
+
+import auditlog
+
+EVENTS = [
+    {"actor": "owner", "action": "org.add_member", "created_at": 1600000000000},
+    {"actor": "owner", "action": "repo.create", "created_at": 1600000001000},
+    {"actor": "member", "action": "org.update_member", "created_at": 1600000002000},
+    {"actor": "ówner", "action": "org.invite_member", "created_at": 1600000003000},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, auditlog.CHUNK_SIZE])
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_iter_events_across_chunks(tmp_path, chunk_size, ndjson):
+    path = tmp_path / "export.json"
+    if ndjson:
+        path.write_text("".join(json.dumps(e) + "\n" for e in EVENTS), "utf-8")
+    else:
+        path.write_text(json.dumps(EVENTS, ensure_ascii=False, indent=2), "utf-8")
+    assert list(auditlog.iter_events(str(path), chunk_size)) == EVENTS
+
+
+def test_truncated_export_raises(tmp_path):
+    path = tmp_path / "export.json"
+    path.write_text(json.dumps(EVENTS)[:-20])
+    with pytest.raises(json.JSONDecodeError):
+        list(auditlog.iter_events(str(path), 16))
+
+
+def test_owner_actions_csv():
+    actions = auditlog.owner_actions(iter(EVENTS), ["owner", "ówner", "absent"])
+    assert [len(actions[o]) for o in ("owner", "ówner", "absent")] == [1, 1, 0]
+    out = io.StringIO()
+    auditlog.write_csv(out, actions["owner"])
+    assert out.getvalue() == '"2020-09-13T12:26:40Z","owner","org.add_member"\n'
+
+
+def test_store_dedups_overlapping_exports():
+    store = auditlog.AuditStore(":memory:")
+    assert store.ingest(iter(EVENTS[:3]), batch_size=2) == (3, 0)
+    with_ids = [dict(e, _document_id=f"doc{n}") for n, e in enumerate(EVENTS)]
+    assert store.ingest(iter(with_ids[2:])) == (2, 0)
+    assert store.ingest(iter(with_ids[2:] + EVENTS[:1])) == (0, 3)
+    assert store.stats() == {
+        "events": 5,
+        "first_day": "2020-09-13",
+        "last_day": "2020-09-13",
+    }
+
+
+def test_store_query():
+    store = auditlog.AuditStore(":memory:")
+    store.ingest(iter(EVENTS))
+    found = store.query(actors=["owner", "ówner"], action="org.*")
+    assert [e["action"] for e in found] == ["org.add_member", "org.invite_member"]
+    assert list(store.query(actors=[])) == []
+    recent = store.query(since=EVENTS[2]["created_at"] / 1000)
+    assert [e["actor"] for e in recent] == ["member", "ówner"]
+
+
+class AuditLogStub(http.server.BaseHTTPRequestHandler):
+    """Serve the events in .server.events like the audit log API, oldest first."""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        assert url.path == "/orgs/mozilla/audit-log"
+        assert query["order"] == "asc"
+        start, per_page = int(query.get("after", 0)), int(query["per_page"])
+        events = self.server.events[start : start + per_page]
+        self.send_response(200)
+        if start + per_page < len(self.server.events):
+            base = f"http://127.0.0.1:{self.server.server_port}{url.path}"
+            after = start + per_page
+            self.send_header(
+                "Link",
+                f'<{base}?per_page={per_page}&order=asc&after={after}>; rel="next"',
+            )
+        self.end_headers()
+        self.wfile.write(json.dumps(events).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def audit_log_api():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AuditLogStub)
+    server.events = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def make_events(start, stop):
+    return [
+        {
+            "_document_id": f"doc{n}",
+            "actor": "owner",
+            "action": "org.update_member",
+            "created_at": 1600000000000 + n,
+        }
+        for n in range(start, stop)
+    ]
+
+
+def test_fetch_only_new_events(audit_log_api, tmp_path):
+    api_url = f"http://127.0.0.1:{audit_log_api.server_port}"
+    session = requests.Session()
+    audit_log_api.events = make_events(0, 250)
+    path, count, cursor = auditlog.fetch_org(
+        session, "mozilla", None, str(tmp_path), api_url
+    )
+    assert count == 250
+    assert list(auditlog.iter_events(path, 64)) == audit_log_api.events
+    assert cursor == {"after": "200", "last_id": "doc249"}
+
+    # nothing new
+    assert auditlog.fetch_org(session, "mozilla", cursor, str(tmp_path), api_url) == (
+        None,
+        0,
+        cursor,
+    )
+
+    audit_log_api.events += make_events(250, 420)
+    path, count, cursor = auditlog.fetch_org(
+        session, "mozilla", cursor, str(tmp_path), api_url
+    )
+    assert count == 170
+    assert [e["_document_id"] for e in auditlog.iter_events(path)] == [
+        f"doc{n}" for n in range(250, 420)
+    ]
+    assert cursor == {"after": "400", "last_id": "doc419"}
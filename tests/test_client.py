@@ -0,0 +1,240 @@
+import json
+import time
+import urllib.parse
+
+import requests
+from github3.session import TokenAuth
+
+import client
+
+
+def make_response(status=200, headers=None, text="", url="https://api.github.com/"):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = text.encode("utf-8")
+    response.url = url
+    return response
+
+
+def rate_headers(resource, limit, remaining, reset):
+    return {
+        "X-RateLimit-Resource": resource,
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+    }
+
+
+def test_resource_for():
+    assert client.resource_for("https://api.github.com/orgs/mozilla") == "core"
+    assert client.resource_for("https://api.github.com/search/users?q=x") == "search"
+    assert client.resource_for("https://api.github.com/search/code?q=x") == (
+        "code_search"
+    )
+    assert client.resource_for("https://api.github.com/graphql") == "graphql"
+
+
+def test_headers_clamp_bucket():
+    """Server reported budget wins over the optimistic local bucket."""
+    scheduler = client.RateLimitScheduler()
+    reset = int(time.time()) + 600
+    response = make_response(headers=rate_headers("core", 5000, 0, reset))
+    assert scheduler.observe(response) is None
+    delay = scheduler.bucket("core").delay(time.time())
+    assert delay >= 590
+    assert scheduler.snapshot()["core"]["remaining"] == 0
+
+
+def test_bucket_refills_after_reset():
+    bucket = client.TokenBucket(10, 60)
+    now = time.time()
+    bucket.update(10, 0, int(now) + 5)
+    assert bucket.delay(now) > 0
+    assert bucket.delay(now + 6) == 0
+
+
+def test_search_bucket_paces():
+    bucket = client.TokenBucket(2, 60)
+    now = time.time()
+    for _ in range(2):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert 0 < bucket.delay(now) <= 30
+
+
+def test_secondary_rate_limit_backoff():
+    scheduler = client.RateLimitScheduler()
+    response = make_response(
+        403, text='{"message": "You have exceeded a secondary rate limit."}'
+    )
+    first = scheduler.observe(response, attempt=0)
+    later = scheduler.observe(response, attempt=3)
+    assert first is not None and later is not None
+    assert later > first - 1
+    assert scheduler.paused_until > time.time()
+
+
+def test_retry_after_honored():
+    scheduler = client.RateLimitScheduler()
+    response = make_response(429, headers={"Retry-After": "30"})
+    delay = scheduler.observe(response)
+    assert 30 <= delay <= 46
+
+
+def test_plain_forbidden_not_retried():
+    scheduler = client.RateLimitScheduler()
+    response = make_response(
+        403,
+        headers=rate_headers("core", 5000, 4000, int(time.time()) + 60),
+        text='{"message": "Must have admin rights to Repository."}',
+    )
+    assert scheduler.observe(response) is None
+    assert scheduler.observe(response, attempt=client.MAX_RETRIES) is None
+
+
+def test_map_concurrently_keeps_order():
+    def slow_square(n):
+        time.sleep(0.01 * (5 - n % 5))
+        return n * n
+
+    items = list(range(20))
+    assert list(client.map_concurrently(slow_square, iter(items), workers=4)) == [
+        n * n for n in items
+    ]
+    assert list(client.map_concurrently(slow_square, items)) == [n * n for n in items]
+
+
+class FakeGitHub(requests.adapters.BaseAdapter):
+    """Serve a fixed body with an ETag, honoring If-None-Match."""
+
+    def __init__(self, body=b"[1, 2, 3]"):
+        super().__init__()
+        self.body = body
+        self.seen = []
+
+    def send(self, request, **kwargs):
+        self.seen.append(request)
+        etag = '"%s"' % hash(self.body)
+        if request.headers.get("If-None-Match") == etag:
+            response = make_response(304, headers={"ETag": etag}, url=request.url)
+        else:
+            response = make_response(
+                200,
+                headers={"ETag": etag, "Content-Type": "application/json"},
+                url=request.url,
+            )
+            response._content = self.body
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def cached_session(cache):
+    session = client.ScheduledSession()
+    session.scheduler = client.RateLimitScheduler()
+    session.http_cache = cache
+    adapter = FakeGitHub()
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+def test_http_cache_replays_not_modified():
+    cache = client.HTTPCache(":memory:")
+    session, adapter = cached_session(cache)
+    url = "https://api.github.com/orgs/mozilla/repos"
+    first = session.get(url, params={"page": 2})
+    second = session.get(url, params={"page": 2})
+    assert first.json() == second.json() == [1, 2, 3]
+    assert second.status_code == 200
+    assert getattr(second, "from_cache", False)
+    assert "If-None-Match" not in adapter.seen[0].headers
+    assert adapter.seen[1].headers["If-None-Match"]
+    # a different page is a different entry
+    session.get(url, params={"page": 3})
+    assert "If-None-Match" not in adapter.seen[2].headers
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_http_cache_keyed_by_github3_token():
+    cache = client.HTTPCache(":memory:")
+    adapter = FakeGitHub()
+    sessions = []
+    for token in ("token-a", "token-b", "token-a"):
+        session = client.ScheduledGitHubSession()
+        session.scheduler = client.RateLimitScheduler()
+        session.http_cache = cache
+        session.auth = TokenAuth(token)
+        session.mount("https://", adapter)
+        sessions.append(session)
+    url = "https://api.github.com/orgs/mozilla/invitations"
+    for session in sessions:
+        session.get(url)
+    # github3 sends the token via session.auth, not a header we're given
+    assert [bool(r.headers.get("If-None-Match")) for r in adapter.seen] == [
+        False,
+        False,
+        True,
+    ]
+
+
+def test_http_cache_leaves_caller_etags_alone():
+    cache = client.HTTPCache(":memory:")
+    session, adapter = cached_session(cache)
+    url = "https://api.github.com/repos/mozilla/x/hooks"
+    etag = session.get(url).headers["ETag"]
+    response = session.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_http_cache_evicts_least_recently_used():
+    cache = client.HTTPCache(":memory:", max_bytes=25)
+    session, adapter = cached_session(cache)
+    for page in range(1, 5):
+        session.get("https://api.github.com/x", params={"page": page})
+    assert cache.total_bytes <= 25
+    assert cache.stats()["evictions"] == 2
+    urls = [row[0] for row in cache.db.execute("SELECT url FROM responses")]
+    assert sorted(urls) == [
+        "https://api.github.com/x?page=3",
+        "https://api.github.com/x?page=4",
+    ]
+
+
+class PagedGitHub(requests.adapters.BaseAdapter):
+    """Serve 250 numbered items, per_page at a time, with Link headers."""
+
+    def send(self, request, **kwargs):
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(request.url).query))
+        page, per_page = int(query.get("page", 1)), int(query["per_page"])
+        items = list(range(250))[(page - 1) * per_page : page * per_page]
+        headers = {}
+        if page * per_page < 250:
+            url = f"https://api.github.com/x?per_page={per_page}&page="
+            last = -(-250 // per_page)
+            link = f'<{url}{page + 1}>; rel="next", <{url}{last}>; rel="last"'
+            headers["Link"] = link
+        response = make_response(200, headers, json.dumps(items), request.url)
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def test_paginate_follows_links():
+    session = requests.Session()
+    session.mount("https://", PagedGitHub())
+    pages = iter(client.paginate(session, "https://api.github.com/x"))
+    assert next(pages) == 0
+    assert list(pages) == list(range(1, 250))
+
+
+def test_paginate_concurrently_keeps_order():
+    session = requests.Session()
+    session.mount("https://", PagedGitHub())
+    items = client.paginate_concurrently(session, "https://api.github.com/x")
+    assert list(items) == list(range(250))
@@ -0,0 +1,112 @@
+import sys
+import types
+
+import github3
+import pytest
+import requests
+
+import client
+import close_pull_requests
+
+
+def server_error():
+    response = requests.Response()
+    response.status_code = 502
+    response._content = b'{"message": "Bad Gateway"}'
+    return github3.exceptions.ServerError(response)
+
+
+class FakePR:
+    def __init__(self, number, comments):
+        self.number = number
+        self.comments = comments
+        self.closed = False
+        self.failures = 1  # the first comment gets through, then errors
+
+    def issue_comments(self):
+        return list(self.comments)
+
+    def create_comment(self, body):
+        self.comments.append(
+            types.SimpleNamespace(user=types.SimpleNamespace(login="me"), body=body)
+        )
+        if self.failures:
+            self.failures -= 1
+            raise server_error()
+
+    def close(self):
+        self.closed = True
+        return True
+
+
+@pytest.fixture
+def fake_gh(monkeypatch, tmp_path):
+    prs = [FakePR(1, []), FakePR(2, [])]
+    repo = types.SimpleNamespace(
+        name="gecko-dev",
+        full_name="mozilla/gecko-dev",
+        pull_requests=lambda state: iter(prs),
+    )
+    gh = types.SimpleNamespace(
+        me=lambda: types.SimpleNamespace(name="Me", login="me"),
+        repository=lambda org, name: repo,
+    )
+    monkeypatch.setattr(close_pull_requests, "get_github3_client", lambda: gh)
+    monkeypatch.setattr(client.time, "sleep", lambda seconds: None)
+    config = tmp_path / "config.yaml"
+    config.write_text(
+        "- organization: mozilla\n  repository: gecko-dev\n  close: true\n"
+    )
+    return prs, str(config)
+
+
+@pytest.mark.parametrize("configured", [True, False])
+def test_comment_not_repeated_on_retry(fake_gh, monkeypatch, configured):
+    prs, config = fake_gh
+    if configured:
+        argv = ["--config", config, "--no-precheck"]
+    else:
+        argv = ["--only", "mozilla/gecko-dev", "--close"]
+    monkeypatch.setattr(sys, "argv", ["close_pull_requests.py"] + argv)
+    close_pull_requests.main()
+    for pr in prs:
+        assert pr.closed
+        assert [c.body for c in pr.comments] == [close_pull_requests.DEFAULT_MESSAGE]
+
+
+class FakeSearch(list):
+    """What gh.search_issues() returns, for one page of results."""
+
+    def __init__(self, repos, total_count=None, incomplete=False):
+        super().__init__(
+            types.SimpleNamespace(
+                issue=types.SimpleNamespace(
+                    as_dict=lambda repo=repo: {
+                        "repository_url": f"https://api.github.com/repos/{repo}"
+                    }
+                )
+            )
+            for repo in repos
+        )
+        self.total_count = len(repos) if total_count is None else total_count
+        self.last_response = requests.Response()
+        self.last_response._content = b'{"incomplete_results": %s}' % (
+            b"true" if incomplete else b"false"
+        )
+
+
+def test_precheck_keeps_groups_it_cant_see_all_of(monkeypatch):
+    monkeypatch.setattr(client, "MAX_QUERY_LENGTH", 60)
+    names = [f"mozilla/repo-{n}" for n in range(6)]
+    groups = client.pack_qualifiers("repo", names, "is:pr is:open")
+    assert len(groups) == 3
+    searches = iter(
+        [
+            FakeSearch(["mozilla/repo-0"]),
+            FakeSearch(["mozilla/repo-2"] * 100, total_count=1500),
+            FakeSearch(["mozilla/repo-4"], incomplete=True),
+        ]
+    )
+    gh = types.SimpleNamespace(search_issues=lambda query: next(searches))
+    busy = close_pull_requests.repos_with_open_prs(gh, names)
+    assert busy == {name.lower() for name in ["mozilla/repo-0"] + groups[1] + groups[2]}
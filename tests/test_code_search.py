@@ -0,0 +1,131 @@
+import io
+import json
+import sys
+
+import pytest
+import requests
+
+import code_search
+
+
+def item(org, repo, path):
+    return {
+        "path": path,
+        "html_url": f"https://github.com/{org}/{repo}/blob/abc/{path}",
+        "repository": {
+            "name": repo,
+            "full_name": f"{org}/{repo}",
+            "owner": {"login": org},
+        },
+    }
+
+
+class FakeSearch:
+    """Serve code search pages of 100 from a fixed list per query."""
+
+    def __init__(self, results, totals=None):
+        self.results = results
+        self.totals = totals or {}
+        self.calls = []
+
+    def get(self, url, params=None):
+        self.calls.append((params["q"], params["page"]))
+        response = requests.Response()
+        if params["q"] not in self.results:
+            response.status_code = 403
+            response._content = b'{"message": "rate limited"}'
+            return response
+        items = self.results[params["q"]]
+        start = (params["page"] - 1) * params["per_page"]
+        response.status_code = 200
+        response._content = json.dumps(
+            {
+                "total_count": self.totals.get(params["q"], len(items)),
+                "incomplete_results": False,
+                "items": items[start : start + params["per_page"]],
+            }
+        ).encode("utf-8")
+        return response
+
+
+def test_stream_pages_dedups_and_projects():
+    mozilla = [item("mozilla", "gecko", f"file{n}.py") for n in range(150)]
+    services = [item("mozilla-services", "x", "a.py"), mozilla[0]]
+    session = FakeSearch({"org:mozilla q": mozilla, "org:mozilla-services q": services})
+    records = list(
+        code_search.stream_results(
+            session,
+            "q",
+            [["mozilla"], ["mozilla-services"]],
+            ["repository.full_name", "path", "missing.field"],
+            workers=2,
+        )
+    )
+    assert len(records) == 151
+    assert {"repository.full_name": "mozilla-services/x", "path": "a.py"}.items() <= (
+        records[[r["path"] for r in records].index("a.py")].items()
+    )
+    assert all(
+        set(r) == {"repository.full_name", "path", "missing.field"} for r in records
+    )
+    assert sorted(session.calls) == [
+        ("org:mozilla q", 1),
+        ("org:mozilla q", 2),
+        ("org:mozilla-services q", 1),
+    ]
+
+
+def test_packed_search_split_past_max_results(caplog):
+    orgs = ["a", "b", "c"]
+    session = FakeSearch(
+        {
+            "org:a org:b org:c q": [item("a", "r", "x.py")],
+            "org:a q": [item("a", "r", "x.py")],
+            "org:b org:c q": [item("b", "r", "y.py")],
+            "org:b q": [item("b", "r", "y.py")],
+            "org:c q": [item("c", "r", "z.py")],
+        },
+        totals={"org:a org:b org:c q": 1500, "org:b org:c q": 1200, "org:c q": 1100},
+    )
+    records = list(code_search.stream_results(session, "q", [orgs], ["path"]))
+    assert sorted(r["path"] for r in records) == ["x.py", "y.py", "z.py"]
+    # the halves are searched concurrently
+    assert sorted(q for q, page in session.calls) == [
+        "org:a org:b org:c q",
+        "org:a q",
+        "org:b org:c q",
+        "org:b q",
+        "org:c q",
+    ]
+    # a single org can't be split, but we say what's missing
+    assert "1100 results, only the first 1000" in caplog.text
+
+
+def test_failed_search_stops_the_run(monkeypatch, capsys):
+    session = FakeSearch({"org:a q": [item("a", "r", f"{n}.py") for n in range(500)]})
+    with pytest.raises(requests.HTTPError):
+        list(code_search.stream_results(session, "q", [["a"], ["b"]], ["path"], 2))
+    monkeypatch.setattr(code_search, "get_requests_session", lambda: session)
+    monkeypatch.setattr(sys, "argv", ["code_search.py", "q", "--orgs", "b"])
+    with pytest.raises(SystemExit) as e:
+        code_search.main()
+    assert e.value.code == 1
+    assert "results are incomplete" in capsys.readouterr().err
+
+
+def test_sinks():
+    record = code_search.project(
+        item("mozilla", "gecko", "a.py"), code_search.DEFAULT_FIELDS
+    )
+    out = io.StringIO()
+    sink = code_search.TextSink(out, code_search.DEFAULT_FIELDS)
+    sink.write(record)
+    header, line = out.getvalue().splitlines()
+    assert header.split() == ["org", "repo", "file", "path"]
+    assert line.split() == ["mozilla", "gecko", "a.py"]
+    out = io.StringIO()
+    code_search.CSVSink(out, ["path"]).write({"path": "a,b.py"})
+    assert out.getvalue().splitlines() == ["path", '"a,b.py"']
+    out = io.StringIO()
+    code_search.NDJSONSink(out, ["path"]).write({"path": "a.py"})
+    assert json.loads(out.getvalue()) == {"path": "a.py"}
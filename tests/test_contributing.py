@@ -0,0 +1,46 @@
+import contributing
+import github_graphql
+
+
+def test_only_changed_repos_are_fetched(monkeypatch, tmp_path):
+    fetched = []
+
+    def fake_root_entries(repos):
+        fetched.extend(repos)
+        return {
+            "mozilla-services/has": ["CONTRIBUTING.md", "LICENSE", "src"],
+            "mozilla-services/lacks": ["README.md"],
+        }
+
+    monkeypatch.setattr(github_graphql, "root_entries", fake_root_entries)
+    cache = contributing.EntriesCache(str(tmp_path / "entries.json"))
+    repos = [
+        {"name": "has", "sha": "1"},
+        {"name": "lacks", "sha": "2"},
+        {"name": "empty", "sha": None},
+    ]
+    entries = contributing.root_entries("mozilla-services", repos, cache)
+    assert entries["empty"] is None
+    assert len(fetched) == 2
+    cache.save()
+
+    # a new run, where only "lacks" has been pushed to
+    fetched.clear()
+    cache = contributing.EntriesCache(str(tmp_path / "entries.json"))
+    repos[1]["sha"] = "3"
+    again = contributing.root_entries("mozilla-services", repos, cache)
+    assert fetched == [("mozilla-services", "lacks")]
+    assert again == entries
+
+
+def test_check_files_patterns():
+    entries = {
+        "b": ["CONTRIBUTING.md", "LICENCE"],
+        "a": ["README.md", "SECURITY.md"],
+        "empty": None,
+    }
+    results = contributing.check_files(entries, contributing.HYGIENE_FILES)
+    assert results["CONTRIBUTING*"] == (["b"], ["a", "empty"])
+    assert results["LICEN[CS]E*"] == (["b"], ["a", "empty"])
+    assert results["SECURITY.md"] == (["a"], ["b", "empty"])
+    assert results["CODE_OF_CONDUCT*"] == ([], ["a", "b", "empty"])
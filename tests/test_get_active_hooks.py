@@ -0,0 +1,107 @@
+import sys
+import time
+
+import get_active_hooks
+from snapshot import Snapshot
+
+
+class Fake:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+    def as_dict(self):
+        return dict(self.data)
+
+
+class HookListing(list):
+    """What repo.hooks() returns: an iterator knowing its response's etag."""
+
+    def __init__(self, hooks, etag, last_status):
+        super().__init__(hooks)
+        self.etag = etag
+        self.last_status = last_status
+
+
+def make_hook(url, pinged):
+    data = {"name": "web", "active": True, "config": {"url": url}}
+    return Fake(data=data, active=True, ping=lambda: pinged.append(url) or True)
+
+
+def make_repo(repo_id, name, pushed_at, urls, pinged):
+    repo = Fake(
+        id=repo_id,
+        name=name,
+        data={"id": repo_id, "name": name, "pushed_at": pushed_at, "updated_at": "u"},
+        etags=[],
+    )
+
+    def hooks(etag=None):
+        repo.etags.append(etag)
+        if etag == f"etag-{name}":
+            return HookListing([], etag, 304)
+        hooks = [make_hook(url, pinged) for url in urls]
+        return HookListing(hooks, f"etag-{name}", 200)
+
+    repo.hooks = hooks
+    return repo
+
+
+def make_gh(repos):
+    org = Fake(login="mozilla", data={"login": "mozilla"})
+    org.repositories = lambda: iter(repos)
+    return Fake(organization=lambda name: org)
+
+
+def test_refresh_only_changed_repos(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    pinged = []
+    gecko = make_repo(1, "gecko", "p1", ["https://ci.example.com/hook"], pinged)
+    old = make_repo(2, "old", "p1", [], pinged)
+    get_active_hooks.report_hooks(make_gh([gecko, old]), "mozilla", workers=2)
+    assert "    https://ci.example.com:None" in capsys.readouterr().out
+    gecko.data["pushed_at"] = "p2"
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla", workers=2)
+    # unchanged repos aren't asked, changed ones are asked conditionally
+    assert gecko.etags == [None, "etag-gecko"]
+    assert old.etags == [None]
+    assert "    https://ci.example.com:None" in capsys.readouterr().out
+    with get_active_hooks.HookCache("mozilla-hooks.sqlite") as cache:
+        assert cache.get(2) is None
+
+
+def test_old_entries_revalidated_by_default(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    pinged = []
+    gecko = make_repo(1, "gecko", "p1", ["https://ci.example.com/hook"], pinged)
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla")
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla")
+    assert gecko.etags == [None]
+    # a day later, the unchanged repo is asked again -- conditionally
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 25 * 3600)
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla")
+    assert gecko.etags == [None, "etag-gecko"]
+    out = capsys.readouterr().out
+    assert out.count("    https://ci.example.com:None") == 3
+
+
+def test_ping_refetches_unconditionally(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    pinged = []
+    gecko = make_repo(1, "gecko", "p1", ["https://ci.example.com/hook"], pinged)
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla")
+    assert pinged == []
+    get_active_hooks.report_hooks(make_gh([gecko]), "mozilla", do_ping=True)
+    assert gecko.etags == [None, None]
+    assert pinged == ["https://ci.example.com/hook"]
+    assert "  pinged 1 (0 failed)" in capsys.readouterr().out
+
+
+def test_org_missing_from_snapshot(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "snapshot.sqlite")
+    Snapshot(path).close()
+    monkeypatch.setattr(
+        sys, "argv", ["get_active_hooks.py", "--from-snapshot", path, "missing"]
+    )
+    assert get_active_hooks.main() == 1
+    assert "Error: org 'missing' not in snapshot" in capsys.readouterr().err
@@ -1,6 +1,12 @@
-import get_org_info
+import sys
+import threading
+import time
+import types
+
 import pytest
 
+import get_org_info
+
 
 def test_encoding_succeeds(capsys):
     """Base64 encoding broke on move to py3 - make sure it stays fixed"""
@@ -8,3 +14,73 @@ def test_encoding_succeeds(capsys):
     captured = capsys.readouterr()
     token = "MDEyOk9yZ2FuaXphdGlvbjEzMTUyNA=="  # nosec
     assert token in captured.out  # nosec
+
+
+class FakeGitHub:
+    """Orgs sharing owners; counts the owner detail lookups."""
+
+    def __init__(self, owners):
+        self.owners = owners
+        self.lookups = []
+        self.lock = threading.Lock()
+
+    def organization(self, name):
+        org = types.SimpleNamespace(
+            members=lambda role: [
+                types.SimpleNamespace(login=login) for login in self.owners[name]
+            ]
+        )
+        org.as_dict = lambda: {
+            "login": name,
+            "name": name.title(),
+            "id": 1,
+            "node_id": "O_1",
+            "type": "Organization",
+        }
+        return org
+
+    def user(self, login):
+        with self.lock:
+            self.lookups.append(login)
+        time.sleep(0.01)  # long enough for the other orgs to ask too
+        return types.SimpleNamespace(
+            name=login.title(), login=login, id=2, node_id="U_2", email=None
+        )
+
+
+def test_owner_details_fetched_once(monkeypatch, capsys):
+    monkeypatch.setattr(get_org_info, "OWNER_DETAILS", {})
+    owners = {f"org{n}": ["alice", "bob", f"owner{n}"] for n in range(6)}
+    gh = FakeGitHub(owners)
+    monkeypatch.setattr(get_org_info, "get_github3_client", lambda: gh)
+    monkeypatch.setattr(
+        sys, "argv", ["get_org_info.py", "--owners", "--workers", "4"] + list(owners)
+    )
+    get_org_info.main()
+    assert sorted(gh.lookups) == sorted(
+        ["alice", "bob"] + [f"owner{n}" for n in range(6)]
+    )
+    out = capsys.readouterr().out
+    # printed in the order asked for, each with its owners
+    assert [line.split()[-1] for line in out.splitlines() if "Processing" in line] == [
+        f"org{n}" for n in range(6)
+    ]
+    assert out.count("Alice (alice)") == 6
+
+
+def test_failed_owner_lookup_is_retried(monkeypatch):
+    monkeypatch.setattr(get_org_info, "OWNER_DETAILS", {})
+    gh = FakeGitHub({})
+    calls = []
+
+    def flaky_user(login):
+        calls.append(login)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return FakeGitHub.user(gh, login)
+
+    gh.user = flaky_user
+    with pytest.raises(RuntimeError):
+        get_org_info.owner_details(gh, "alice")
+    assert get_org_info.owner_details(gh, "alice")["login"] == "alice"
+    assert calls == ["alice", "alice"]
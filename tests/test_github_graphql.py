@@ -0,0 +1,75 @@
+import github_graphql
+
+
+def page(logins, permission="ADMIN", cursor=None):
+    return {
+        "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+        "edges": [{"permission": permission, "node": {"login": l}} for l in logins],
+    }
+
+
+def test_repo_collaborators_batches_and_follows_pages(monkeypatch):
+    calls = []
+
+    def fake_run_query(query, variables=None, allow_partial=False):
+        calls.append(variables)
+        if len(calls) == 1:
+            assert variables == {
+                "o0": "mozilla",
+                "n0": "big",
+                "c0": None,
+                "o1": "mozilla",
+                "n1": "small",
+                "c1": None,
+                "o2": "mozilla",
+                "n2": "hidden",
+                "c2": None,
+            }
+            return {
+                "r0": {"collaborators": page(["a", "b"], cursor="next")},
+                "r1": {"collaborators": page(["c"], permission="WRITE")},
+                "r2": None,
+            }
+        # only the repository with more pages is asked for again
+        assert variables == {"o0": "mozilla", "n0": "big", "c0": "next"}
+        return {"r0": {"collaborators": page(["d"])}}
+
+    monkeypatch.setattr(github_graphql, "run_query", fake_run_query)
+    result = github_graphql.repo_collaborators(
+        [("mozilla", "big"), ("mozilla", "small"), ("mozilla", "hidden")]
+    )
+    assert len(calls) == 2
+    assert [c["login"] for c in result["mozilla/big"]] == ["a", "b", "d"]
+    assert result["mozilla/small"] == [{"login": "c", "permission": "WRITE"}]
+    assert "mozilla/hidden" not in result
+
+
+def test_org_members_filters_role(monkeypatch):
+    def fake_run_query(query, variables=None, allow_partial=False):
+        edges = [
+            {
+                "role": role,
+                "node": {
+                    "login": login,
+                    "name": None,
+                    "email": "",
+                    "id": "MDQ6",
+                    "databaseId": 1,
+                },
+            }
+            for login, role in (("owner", "ADMIN"), ("member", "MEMBER"))
+        ]
+        return {
+            "organization": {
+                "membersWithRole": {
+                    "pageInfo": {"hasNextPage": False, "endCursor": None},
+                    "edges": edges,
+                }
+            }
+        }
+
+    monkeypatch.setattr(github_graphql, "run_query", fake_run_query)
+    owners = list(github_graphql.org_members("mozilla", role="admin"))
+    assert [o["login"] for o in owners] == ["owner"]
+    assert owners[0]["email"] is None
+    assert len(list(github_graphql.org_members("mozilla"))) == 2
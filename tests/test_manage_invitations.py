@@ -0,0 +1,122 @@
+import sys
+import time
+
+import pytest
+import requests
+
+import manage_invitations
+from snapshot import Snapshot
+
+API = manage_invitations.API
+DAY = 24 * 3600
+
+
+def stamp(days_ago):
+    return time.strftime(
+        "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - days_ago * DAY)
+    )
+
+
+def org_invite(invite_id, login, days_ago):
+    return {
+        "id": invite_id,
+        "login": login,
+        "email": f"{login}@example.com",
+        "role": "direct_member",
+        "inviter": {"login": "admin"},
+        "created_at": stamp(days_ago),
+    }
+
+
+def repo_invite(invite_id, login, days_ago):
+    return {
+        "id": invite_id,
+        "invitee": {"login": login},
+        "inviter": {"login": "admin"},
+        "permissions": "write",
+        "created_at": stamp(days_ago),
+    }
+
+
+class FakeSession:
+    def __init__(self, failing=()):
+        self.deleted = []
+        self.failing = failing
+
+    def delete(self, url):
+        self.deleted.append(url)
+        response = requests.Response()
+        response.status_code = 404 if url in self.failing else 204
+        return response
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    listings = {
+        f"{API}/orgs/mozilla/invitations": [
+            org_invite(1, "old-member", 30),
+            org_invite(2, "new-member", 1),
+        ],
+        f"{API}/orgs/mozilla/repos": [{"name": n} for n in ("a", "b", "c-ghsa-1")],
+        f"{API}/repos/mozilla/a/invitations": [repo_invite(3, "old-a", 20)],
+        f"{API}/repos/mozilla/b/invitations": [
+            repo_invite(4, "new-b", 2),
+            repo_invite(5, "old-b", 40),
+        ],
+    }
+
+    def paginate(session, url, params=None, per_page=100):
+        if url not in listings:
+            response = requests.Response()
+            response.status_code = 404
+            raise requests.HTTPError(response=response)
+        return iter(listings[url])
+
+    monkeypatch.setattr(manage_invitations, "paginate", paginate)
+    return listings
+
+
+def test_cutoff_and_humanize():
+    now = 1_600_000_000
+    assert manage_invitations.get_cutoff_time("weeks=-2", now) == now - 14 * DAY
+    with pytest.raises(ValueError):
+        manage_invitations.get_cutoff_time("fortnights=-1")
+    assert manage_invitations.humanize(30) == "seconds ago"
+    assert manage_invitations.humanize(3 * DAY) == "3 days ago"
+    assert manage_invitations.humanize(35 * DAY) == "a month ago"
+    assert manage_invitations.humanize(800 * DAY) == "2 years ago"
+
+
+def test_parse_timestamp_offsets():
+    parse = manage_invitations.parse_timestamp
+    assert parse("2016-11-30T06:46:10-08:00") == parse("2016-11-30T14:46:10Z")
+
+
+def test_report_in_listing_order(listings, capsys):
+    manage_invitations.check_invites(FakeSession(), "mozilla", workers=3)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines] == ["old-member", "old-a", "old-b"]
+    assert lines[0].endswith("by admin")
+    assert lines[2].endswith("for write access.")
+
+
+def test_cancel_to_json(listings):
+    session = FakeSession(failing={f"{API}/repos/mozilla/a/invitations/3"})
+    rows = []
+    manage_invitations.check_invites(session, "mozilla", cancel=True, rows=rows)
+    assert [(r["repo"], r["login"], r["cancelled"]) for r in rows] == [
+        ("", "old-member", True),
+        ("a", "old-a", False),
+        ("b", "old-b", True),
+    ]
+    assert f"{API}/orgs/mozilla/invitations/1" in session.deleted
+
+
+def test_org_missing_from_snapshot(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "snapshot.sqlite")
+    Snapshot(path).close()
+    monkeypatch.setattr(
+        sys, "argv", ["manage_invitations.py", "--from-snapshot", path, "missing"]
+    )
+    assert manage_invitations.main() == 1
+    assert "Error: org 'missing' not in snapshot" in capsys.readouterr().err
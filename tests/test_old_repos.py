@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+import time
+
+import old_repos
+from client import map_concurrently
+from snapshot import Snapshot
+
+DAY = 24 * 3600
+
+
+def repo(name, days_ago, size=10, issues=0, pushed_days_ago=None, **flags):
+    def stamp(days):
+        return time.strftime(
+            "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - days * DAY)
+        )
+
+    return {
+        "name": name,
+        "size": size,
+        "open_issues_count": issues,
+        "updated_at": stamp(days_ago),
+        "pushed_at": None if pushed_days_ago is None else stamp(pushed_days_ago),
+        "archived": flags.get("archived", False),
+        "fork": flags.get("fork", False),
+    }
+
+
+def test_rules_in_one_pass():
+    args = argparse.Namespace(
+        max_size=50, small_age=31, untouched_age=730, unpushed_age=365, fork_age=180
+    )
+    table = old_repos.RepoTable(
+        "mozilla",
+        [
+            repo("empty", 40),
+            repo("busy-but-small", 40, issues=3, pushed_days_ago=40),
+            repo("ancient", 1000, size=5000, pushed_days_ago=1000),
+            repo("fresh-fork", 1, pushed_days_ago=1, fork=True),
+            repo("old-fork", 200, size=500, pushed_days_ago=200, fork=True),
+        ],
+    )
+    table.extend(old_repos.RepoTable("other", [repo("Ancient", 800, archived=True)]))
+    matches = old_repos.evaluate(table, old_repos.make_rules(old_repos.RULES, args))
+    named = {
+        rule: [f"{table.orgs[i]}/{table.names[i]}" for i in indexes]
+        for rule, indexes in matches.items()
+    }
+    assert named == {
+        "small": ["mozilla/empty", "other/Ancient"],
+        "untouched": ["mozilla/ancient", "other/Ancient"],
+        # never pushed counts as not pushed
+        "unpushed": ["mozilla/ancient", "mozilla/empty", "other/Ancient"],
+        "stale-fork": ["mozilla/old-fork"],
+        "archived": ["other/Ancient"],
+    }
+    matches = old_repos.evaluate(
+        table, old_repos.make_rules(["small"], args), skip_archived=True
+    )
+    assert matches == {"small": [0]}
+
+
+def test_load_orgs_from_snapshot_concurrently(tmp_path):
+    snap = Snapshot(str(tmp_path / "snapshot.sqlite"))
+    with snap.db:
+        for n, org in enumerate(("mozilla", "mozilla-services", "mozilla-mobile")):
+            snap.db.execute("INSERT INTO orgs VALUES (?, '{}', 0)", (org,))
+            snap.db.execute(
+                "INSERT INTO repos VALUES (?, ?, ?, NULL, NULL, 0, ?)",
+                (org, n, f"{org}-repo", json.dumps(repo(f"{org}-repo", 40))),
+            )
+    orgs = ["mozilla", "mozilla-services", "mozilla-mobile"]
+    tables = map_concurrently(
+        lambda org: old_repos.load_org(org, None, snapshot=snap), orgs, 8
+    )
+    assert [t.names for t in tables] == [[f"{org}-repo"] for org in orgs]
+
+
+def test_org_missing_from_snapshot(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "snapshot.sqlite")
+    Snapshot(path).close()
+    monkeypatch.setattr(
+        sys, "argv", ["old_repos.py", "--from-snapshot", path, "missing"]
+    )
+    assert old_repos.main() == 1
+    assert "Error: org 'missing' not in snapshot" in capsys.readouterr().err
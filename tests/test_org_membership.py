@@ -0,0 +1,122 @@
+import types
+
+import github3
+import pytest
+import requests
+
+import org_membership
+from snapshot import Snapshot
+
+
+def github_error(cls, status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'{"message": "nope"}'
+    return cls(response)
+
+
+def users(*logins):
+    return [types.SimpleNamespace(login=login) for login in logins]
+
+
+@pytest.fixture
+def gh(monkeypatch):
+    orgs = {
+        "mozilla": {
+            "outside": users("Carol"),
+            "all": users("alice", "bob"),
+            "admin": users("alice"),
+        },
+        "mozilla-services": {"outside": [], "all": users("bob"), "admin": []},
+    }
+
+    def organization(name):
+        if name == "gone":
+            raise github_error(github3.exceptions.NotFoundError, 404)
+        if name == "secret":
+            raise github_error(github3.exceptions.ForbiddenError, 403)
+        people = orgs[name]
+        return types.SimpleNamespace(
+            login=name,
+            people=people,
+            members=lambda role="all": people[role],
+        )
+
+    monkeypatch.setattr(
+        org_membership, "OutsideCollaboratorIterator", lambda org: org.people["outside"]
+    )
+    return types.SimpleNamespace(organization=organization)
+
+
+def test_load_skips_orgs_we_cant_see(gh):
+    index = org_membership.MembershipIndex.load(
+        gh, ["mozilla", "gone", "secret", "mozilla-services", "mozilla"], workers=4
+    )
+    assert sorted(index.orgs) == ["mozilla", "mozilla-services"]
+    assert index.skipped["gone"] == "no such organization"
+    assert index.skipped["secret"].startswith("not enough permissions")
+    assert index.lookup("ALICE") == [("mozilla", "owner")]
+    assert index.lookup("bob") == [
+        ("mozilla", "member"),
+        ("mozilla-services", "member"),
+    ]
+    assert index.lookup("carol") == [("mozilla", "outside_collaborator")]
+    assert index.lookup("dave") == []
+
+
+def test_from_snapshot(tmp_path):
+    snap = Snapshot(str(tmp_path / "snapshot.sqlite"))
+    with snap.db:
+        snap.db.execute(
+            """INSERT INTO orgs VALUES ('Mozilla', '{"login": "Mozilla"}', 0)"""
+        )
+        snap.db.executemany(
+            "INSERT INTO members (org, login, role) VALUES ('Mozilla', ?, ?)",
+            [("alice", "admin"), ("bob", "member")],
+        )
+        snap.db.execute("INSERT INTO outside_collaborators VALUES ('Mozilla', 'carol')")
+    index = org_membership.MembershipIndex.from_snapshot(snap, ["mozilla"])
+    assert index.orgs == ["Mozilla"]
+    assert index.lookup_many(["alice", "bob", "carol"]) == {
+        "alice": [("Mozilla", "owner")],
+        "bob": [("Mozilla", "member")],
+        "carol": [("Mozilla", "outside_collaborator")],
+    }
+
+
+def test_save_and_load_saved(gh, tmp_path, monkeypatch):
+    path = str(tmp_path / "cache" / "membership.json")
+    index = org_membership.MembershipIndex.load(gh, ["mozilla", "gone"])
+    index.save(path)
+    load_saved = org_membership.MembershipIndex.load_saved
+    saved = load_saved(path, org_names=["Mozilla", "gone"])
+    assert saved.lookup("alice") == [("mozilla", "owner")]
+    assert saved.skipped == {"gone": "no such organization"}
+    # an org it wasn't built for
+    assert load_saved(path, org_names=["mozilla", "mozilla-services"]) is None
+    # too old
+    assert load_saved(path, max_age=-1) is None
+    assert load_saved(str(tmp_path / "missing.json")) is None
+
+    # get() reuses the saved index while it's fresh & covers the orgs
+    monkeypatch.setattr(gh, "organization", None)
+    assert org_membership.MembershipIndex.get(gh, ["mozilla"], path).loaded_at == (
+        index.loaded_at
+    )
+
+
+def test_check_login_perms(gh):
+    index = org_membership.MembershipIndex.load(gh, ["mozilla"])
+    lines, found = org_membership.check_login_perms(
+        index, ["alice", "carol", "dave"], headers=["Offboarding"]
+    )
+    text = "\n".join(lines)
+    assert found == {"alice", "carol"}
+    assert lines[:2] == ["=" * 30, "Offboarding"]
+    assert "Checking 3 usernames for membership in 1 orgs" in text
+    assert "FOUND! mozilla has alice as a member" in text
+    assert "NOTE: alice is an OWNER of mozilla" in text
+    assert "FOUND! mozilla has carol as a collaborator" in text
+    assert "No permissions found for dave" in text
+    lines, found = org_membership.check_login_perms(index, [])
+    assert lines[-1] == "\nFound no valid usernames" and not found
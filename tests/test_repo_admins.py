@@ -0,0 +1,119 @@
+import importlib.machinery
+import importlib.util
+import os
+
+import pytest
+import requests
+
+from snapshot import Snapshot
+
+PATH = os.path.join(os.path.dirname(__file__), os.pardir, "repo-admins")
+
+
+@pytest.fixture
+def repo_admins(monkeypatch):
+    # the script has no .py extension, so load it by hand
+    loader = importlib.machinery.SourceFileLoader("repo_admins", PATH)
+    spec = importlib.util.spec_from_loader("repo_admins", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    monkeypatch.setattr(module, "fetch_owners", lambda org: {"owner"})
+    return module
+
+
+def not_found():
+    response = requests.Response()
+    response.status_code = 404
+    return requests.HTTPError(response=response)
+
+
+def test_all_repos_from_snapshot(repo_admins, tmp_path):
+    snap = Snapshot(str(tmp_path / "snapshot.sqlite"))
+    names = [f"repo{n:02}" for n in range(20)]
+    with snap.db:
+        snap.db.execute("INSERT INTO orgs VALUES ('mozilla', '{}', 0)")
+        for n, name in enumerate(names):
+            snap.db.execute(
+                "INSERT INTO repos VALUES ('mozilla', ?, ?, NULL, NULL, 0, ?)",
+                (n, name, f'{{"name": "{name}"}}'),
+            )
+            snap.db.executemany(
+                "INSERT INTO collaborators VALUES ('mozilla', ?, ?, 'admin')",
+                [(name, "owner"), (name, f"admin-of-{name}")],
+            )
+    repo_admins.snapshot = snap
+    assert list(repo_admins.audit_org("mozilla", workers=8)) == [
+        (name, {f"admin-of-{name}"}) for name in names
+    ]
+
+
+def test_graphql_misses_fall_back_to_rest(repo_admins, monkeypatch):
+    monkeypatch.setattr(repo_admins, "org_repos", lambda org: ["seen", "unseen"])
+    monkeypatch.setattr(
+        repo_admins,
+        "fetch_admins_bulk",
+        lambda owner_repos: {"mozilla/seen": {"owner", "alice"}},
+    )
+    rest = []
+
+    def fetch_admins(owner, repo):
+        rest.append(repo)
+        return {"bob"}
+
+    monkeypatch.setattr(repo_admins, "fetch_admins", fetch_admins)
+    assert list(repo_admins.audit_org("mozilla", use_graphql=True)) == [
+        ("seen", {"alice"}),
+        ("unseen", {"bob"}),
+    ]
+    assert rest == ["unseen"]
+
+
+def test_invisible_repos_are_skipped(repo_admins, monkeypatch, capsys):
+    monkeypatch.setattr(repo_admins, "org_repos", lambda org: ["a", "a-ghsa-xxxx", "b"])
+
+    def fetch_admins(owner, repo):
+        if "-ghsa-" in repo:
+            raise not_found()
+        return {"owner", f"{repo}-admin"}
+
+    monkeypatch.setattr(repo_admins, "fetch_admins", fetch_admins)
+    args = repo_admins.parse_args(["--all-repos", "mozilla"])
+    repo_admins.report_org("mozilla", args)
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["mozilla/a,a-admin", "mozilla/b,b-admin"]
+    assert "a-ghsa-xxxx" in err
+
+
+def test_org_missing_from_snapshot(repo_admins, tmp_path, capsys):
+    path = str(tmp_path / "snapshot.sqlite")
+    Snapshot(path).close()
+    args = ["--from-snapshot", path, "--all-repos", "missing"]
+    assert repo_admins.main(args) == 1
+    assert "Error: org 'missing' not in snapshot" in capsys.readouterr().err
+
+
+def test_unknown_admins_in_snapshot(repo_admins, tmp_path, capsys):
+    path = str(tmp_path / "snapshot.sqlite")
+    snap = Snapshot(path)
+    with snap.db:
+        snap.db.execute("INSERT INTO orgs VALUES ('mozilla', '{}', 0)")
+        snap.db.executemany(
+            "INSERT INTO repos VALUES ('mozilla', ?, ?, NULL, NULL, 0, ?)",
+            [
+                (n, name, f'{{"name": "{name}"}}')
+                for n, name in enumerate(["seen", "unseen"])
+            ],
+        )
+        snap.db.execute(
+            "INSERT INTO collaborators VALUES ('mozilla', 'seen', 'alice', 'admin')"
+        )
+    snap.close()
+    args = ["--from-snapshot", path, "--all-repos", "mozilla"]
+    assert repo_admins.main(args) == 0
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["mozilla/seen,alice"]
+    assert "Couldn't check 1 repositories: unseen" in err
+    assert repo_admins.main(["--from-snapshot", path, "seen", "never-crawled"]) == 1
+    out, err = capsys.readouterr()
+    assert out.splitlines() == ["mozilla/seen:", "alice"]
+    assert "repository 'mozilla/never-crawled' not in snapshot" in err
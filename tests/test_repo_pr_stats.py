@@ -0,0 +1,92 @@
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import time
+
+import pytest
+
+PATH = os.path.join(os.path.dirname(__file__), os.pardir, "repo-pr-stats.py")
+HOUR = 3600
+
+
+@pytest.fixture
+def pr_stats():
+    # the script's name isn't importable, so load it by hand
+    loader = importlib.machinery.SourceFileLoader("repo_pr_stats", PATH)
+    spec = importlib.util.spec_from_loader("repo_pr_stats", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def pull(pull_id, created, merged_hours_later):
+    def stamp(seconds):
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+    return {
+        "id": pull_id,
+        "created_at": stamp(created),
+        "merged_at": (
+            None
+            if merged_hours_later is None
+            else stamp(created + merged_hours_later * HOUR)
+        ),
+    }
+
+
+JAN = 1_672_531_200  # 2023-01-01
+FEB = 1_675_209_600  # 2023-02-01
+
+PULLS = {
+    "mozilla/a": [pull(1, JAN, 1), pull(2, JAN, None), pull(3, FEB, 3)],
+    "mozilla/b": [pull(4, FEB, 2), pull(5, FEB, 10)],
+}
+
+
+def test_aggregation(pr_stats):
+    times = pr_stats.MergeTimes()
+    for pulls in PULLS.values():
+        for p in pulls:
+            if p["merged_at"]:
+                times.add(p)
+    summary = times.summary()
+    assert summary["count"] == 4
+    assert summary["mean"] == 4 * HOUR
+    assert summary["median"] == 2.5 * HOUR
+    assert summary["p90"] == pytest.approx(7.9 * HOUR)
+    months = times.by_month()
+    assert list(months) == ["2023-01", "2023-02"]
+    assert [len(m) for m in months.values()] == [1, 3]
+    assert pr_stats.MergeTimes().summary()["mean"] is None
+    assert pr_stats.percentile([1, 2, 3, 4], 50) == 2.5
+
+
+def test_verbose_output_in_order(pr_stats, monkeypatch, capsys):
+    def paginate_concurrently(session, url, params=None, workers=4):
+        name = "/".join(url.split("/")[-3:-1])
+        # the first repository finishes last
+        time.sleep(0.05 if name == "mozilla/a" else 0)
+        return iter(PULLS[name])
+
+    monkeypatch.setattr(pr_stats, "get_requests_session", lambda: None)
+    monkeypatch.setattr(pr_stats, "paginate_concurrently", paginate_concurrently)
+    monkeypatch.setattr(
+        sys, "argv", ["repo-pr-stats.py", "--verbose", "mozilla/a", "mozilla/b"]
+    )
+    pr_stats.main()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[:7] == [
+        "Pull 1 review took 1:00:00 to merge",
+        "Pull 3 review took 3:00:00 to merge",
+        "mozilla/a: 2 pulls, mean 2:00:00, median 2:00:00, p90 2:48:00," " p99 2:58:48",
+        "Pull 4 review took 2:00:00 to merge",
+        "Pull 5 review took 10:00:00 to merge",
+        "mozilla/b: 2 pulls, mean 6:00:00, median 6:00:00, p90 9:12:00," " p99 9:55:12",
+        "",
+    ]
+    assert lines[7].startswith("Total (2 repos): 4 pulls, mean 4:00:00")
+    assert lines[-2:] == [
+        "  2023-01: 1 pulls, mean 1:00:00, median 1:00:00, p90 1:00:00, p99 1:00:00",
+        "  2023-02: 3 pulls, mean 5:00:00, median 3:00:00, p90 8:36:00, p99 9:51:36",
+    ]
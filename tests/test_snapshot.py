@@ -0,0 +1,131 @@
+import sqlite3
+
+import pytest
+
+import client
+import github_graphql
+import snapshot
+
+
+class Fake:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+    def as_dict(self):
+        return dict(self.data)
+
+
+def make_repo(repo_id, name, pushed_at, hooks=()):
+    repo = Fake(
+        id=repo_id,
+        name=name,
+        data={"id": repo_id, "name": name, "pushed_at": pushed_at, "updated_at": "u"},
+        fetched=0,
+    )
+
+    def fetch_hooks():
+        repo.fetched += 1
+        return [Fake(data=h) for h in hooks]
+
+    repo.hooks = fetch_hooks
+    repo.invitations = lambda: []
+    return repo
+
+
+def make_gh(repos):
+    team = Fake(slug="admin-all-org-owners", name="admin-all-org-owners", id=7)
+    team.members = lambda: [Fake(login="alice")]
+    org = Fake(login="mozilla", data={"login": "mozilla", "id": 1})
+    org.repositories = lambda: iter(repos)
+    org.teams = lambda: [team]
+    org.invitations = lambda: []
+    return Fake(organization=lambda name: org)
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    members = [
+        {"login": "alice", "role": "ADMIN", "name": "A", "email": "a@x", "id": 1},
+        {"login": "bob", "role": "MEMBER", "name": None, "email": None, "id": 2},
+    ]
+    for m in members:
+        m["node_id"] = f"node{m['id']}"
+    monkeypatch.setattr(github_graphql, "org_members", lambda org: iter(members))
+    monkeypatch.setattr(
+        github_graphql,
+        "repo_collaborators",
+        lambda repos: {
+            f"{o}/{r}": [{"login": "carol", "permission": "ADMIN"}] for o, r in repos
+        },
+    )
+    monkeypatch.setattr(
+        snapshot, "OutsideCollaboratorIterator", lambda org: [Fake(login="dave")]
+    )
+
+
+def test_crawl_and_query(fake_api):
+    snap = snapshot.Snapshot(":memory:")
+    hook = {"name": "web", "active": True, "config": {"url": "https://x"}}
+    repos = [make_repo(10, "gecko", "p1", [hook]), make_repo(11, "empty", "p1")]
+    assert snap.crawl(make_gh(repos), "mozilla") == 2
+    assert snap.orgs() == ["mozilla"]
+    assert [m["login"] for m in snap.members("Mozilla", role="admin")] == ["alice"]
+    assert snap.member("BOB")["role"] == "member"
+    assert snap.outside_collaborators("mozilla") == ["dave"]
+    assert snap.team_members("mozilla", "admin-all-org-owners") == ["alice"]
+    assert [r["name"] for r in snap.repos("mozilla")] == ["empty", "gecko"]
+    assert snap.collaborators("mozilla", "gecko", permission="admin") == ["carol"]
+    assert snap.hooks("mozilla") == {"gecko": [hook]}
+    with pytest.raises(snapshot.SnapshotMissing):
+        snap.repos("mozilla-services")
+
+
+def test_refresh_is_incremental(fake_api):
+    snap = snapshot.Snapshot(":memory:")
+    gecko, empty = make_repo(10, "gecko", "p1"), make_repo(11, "empty", "p1")
+    snap.crawl(make_gh([gecko, empty]), "mozilla")
+    # gecko pushed to, empty deleted, one new repo
+    gecko.data["pushed_at"] = "p2"
+    new = make_repo(12, "new", "p1")
+    assert snap.crawl(make_gh([gecko, new]), "mozilla") == 2
+    assert (gecko.fetched, empty.fetched, new.fetched) == (2, 1, 1)
+    assert [r["name"] for r in snap.repos("mozilla")] == ["gecko", "new"]
+    assert snap.collaborators("mozilla", "empty") == []
+    # nothing changed, but everything is too old
+    assert snap.crawl(make_gh([gecko, new]), "mozilla") == 0
+    assert snap.crawl(make_gh([gecko, new]), "mozilla", max_age=-1) == 2
+
+
+def test_unchanged_repos_refreshed_daily(fake_api):
+    # a collaborator or hook change doesn't touch pushed_at/updated_at
+    snap = snapshot.Snapshot(":memory:")
+    gecko = make_repo(10, "gecko", "p1")
+    snap.crawl(make_gh([gecko]), "mozilla")
+    assert snap.crawl(make_gh([gecko]), "mozilla") == 0
+    with snap.db:
+        snap.db.execute("UPDATE repos SET crawled_at = crawled_at - 25 * 3600")
+    assert snap.crawl(make_gh([gecko]), "mozilla") == 1
+    assert gecko.fetched == 2
+
+
+def test_queries_from_worker_threads(fake_api, tmp_path):
+    snap = snapshot.Snapshot(str(tmp_path / "snapshot.sqlite"))
+    snap.crawl(make_gh([make_repo(10, "gecko", "p1")]), "mozilla")
+    logins = client.map_concurrently(
+        lambda repo: snap.collaborators("mozilla", repo), ["gecko"] * 20, 8
+    )
+    assert list(logins) == [["carol"]] * 20
+
+
+def test_read_only(fake_api, tmp_path):
+    path = tmp_path / "snapshot.sqlite"
+    with pytest.raises(sqlite3.OperationalError):
+        snapshot.Snapshot(str(tmp_path / "mistyped.sqlite"), read_only=True)
+    assert not (tmp_path / "mistyped.sqlite").exists()
+    snap = snapshot.Snapshot(str(path))
+    snap.crawl(make_gh([make_repo(10, "gecko", "p1")]), "mozilla")
+    snap.close()
+    snap = snapshot.Snapshot(str(path), read_only=True)
+    assert snap.collaborators("mozilla", "gecko") == ["carol"]
+    with pytest.raises(sqlite3.OperationalError):
+        snap.crawl(make_gh([make_repo(10, "gecko", "p2")]), "mozilla")
@@ -0,0 +1,139 @@
+import sys
+
+import github3
+import pytest
+
+import team_update
+from client import map_concurrently
+from snapshot import Snapshot
+
+
+class FakeResponse:
+    status_code = 404
+    headers = {}
+    content = b""
+
+    def json(self):
+        return {"message": "Not Found"}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / "snapshot.sqlite")
+    snap = Snapshot(path)
+    with snap.db:
+        snap.db.execute("INSERT INTO orgs VALUES ('mozilla', '{}', 0)")
+        snap.db.executemany(
+            "INSERT INTO members (org, login, role) VALUES ('mozilla', ?, ?)",
+            [("alice", "admin"), ("bob", "member"), ("carol", "member")],
+        )
+        snap.db.executemany(
+            "INSERT INTO team_members VALUES ('mozilla', ?, ?)",
+            [
+                ("admin-all-org-owners", "alice"),
+                ("admin-all-org-owners", "dave"),
+                ("admin-all-org-members", "bob"),
+            ],
+        )
+    snap.close()
+    return path
+
+
+def test_both_teams_from_snapshot(snapshot_path, monkeypatch, capsys):
+    # main() sets these, have them put back afterwards
+    monkeypatch.setattr(team_update, "VERBOSE", False)
+    monkeypatch.setattr(team_update, "TEAM", team_update.TEAM)
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["team_update.py", "--both", "--verbose", "--from-snapshot", snapshot_path]
+        + ["mozilla", "missing"],
+    )
+    assert team_update.main() == 1
+    out = capsys.readouterr().out
+    assert "There are 1 owners for org mozilla:" in out
+    assert "    dave has departed" in out
+    assert "There are 3 members for org mozilla:" in out
+    assert "    carol is new" in out
+    assert "Error: org 'missing' not in snapshot" in out
+
+
+def test_both_needs_a_team_prefix(monkeypatch, capsys):
+    monkeypatch.setattr(
+        sys, "argv", ["team_update.py", "--both", "--team", "org-admins"]
+    )
+    with pytest.raises(SystemExit):
+        team_update.parse_args()
+    assert "--both needs a --team prefix" in capsys.readouterr().err
+    monkeypatch.setattr(sys, "argv", ["team_update.py", "--both", "--team", "org_"])
+    assert team_update.parse_args().team == "org_"
+
+
+def test_snapshot_queries_from_workers(snapshot_path):
+    snap = Snapshot(snapshot_path)
+    results = map_concurrently(
+        lambda owners: team_update.check_users(None, "mozilla", owners, snapshot=snap),
+        [True, False] * 4,
+        4,
+    )
+    assert [lines[0] for lines, _ in results] == [
+        "There are 1 owners for org mozilla:",
+        "There are 3 members for org mozilla:",
+    ] * 4
+
+
+def test_snapshot_team_found_by_slug(snapshot_path, monkeypatch):
+    monkeypatch.setattr(team_update, "TEAM", "Admin-All-Org-")
+    monkeypatch.setattr(team_update, "VERBOSE", True)
+    snap = Snapshot(snapshot_path)
+    lines, diff = team_update.check_users(None, "mozilla", True, snapshot=snap)
+    assert diff.to_remove == ["dave"]
+    assert diff.no_change == ["alice"]
+
+
+def test_existing_team_matched_by_name():
+    class Team:
+        def __init__(self, name, slug):
+            self.name, self.slug = name, slug
+
+    class Org:
+        login = "mozilla"
+
+        def __init__(self):
+            self.created = []
+
+        def team_by_name(self, slug):
+            raise github3.exceptions.NotFoundError(FakeResponse())
+
+        def teams(self):
+            return iter([Team("Other", "other"), Team("Owners (all)", "owners-all")])
+
+        def create_team(self, name):
+            self.created.append(name)
+            return Team(name, None)
+
+    org = Org()
+    assert team_update.get_or_create_team(org, "owners (all)").slug == "owners-all"
+    assert org.created == []
+    assert team_update.get_or_create_team(org, "new").name == "new"
+    assert org.created == ["new"]
+
+
+def test_apply_diff_records_failures():
+    class Team:
+        def __init__(self):
+            self.calls = []
+
+        def add_or_update_membership(self, login):
+            self.calls.append(("add", login))
+            return login != "bob"
+
+        def revoke_membership(self, login):
+            self.calls.append(("remove", login))
+            return True
+
+    team = Team()
+    diff = team_update.TeamDiff(["alice", "dave"], ["alice", "bob", "carol"])
+    team_update.apply_diff(team, diff, workers=3)
+    assert sorted(team.calls) == [("add", "bob"), ("add", "carol"), ("remove", "dave")]
+    assert diff.failed == [("add", "bob")]
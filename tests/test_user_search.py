@@ -0,0 +1,59 @@
+import json
+import time
+
+import requests
+
+import user_search
+
+
+class FakeSearch:
+    def __init__(self, total=2):
+        self.total = total
+        self.queries = []
+
+    def get(self, url, params=None):
+        self.queries.append(params["q"])
+        items = [
+            {"login": f"user{n}", "id": n, "type": "User", "html_url": "", "score": 1}
+            for n in range(min(self.total, params["per_page"]))
+        ]
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(
+            {"total_count": self.total, "items": items}
+        ).encode("utf-8")
+        return response
+
+
+def test_repeat_searches_come_from_disk(tmp_path):
+    path = str(tmp_path / "users.sqlite")
+    session = FakeSearch()
+    search = user_search.UserSearch(user_search.UserSearchCache(path), session)
+    assert search.logins("Jane  Doe") == ["user0", "user1"]
+    # a new session (e.g. after a kernel restart) & a differently typed term
+    search = user_search.UserSearch(user_search.UserSearchCache(path), session)
+    assert search.logins("jane doe") == ["user0", "user1"]
+    assert session.queries == ["type:user jane doe"]
+    assert search.cache.stats()["hits"] == 1
+
+
+def test_too_many_is_empty():
+    session = FakeSearch(total=500)
+    search = user_search.UserSearch(user_search.UserSearchCache(":memory:"), session)
+    total, users = search.search("smith")
+    assert total == 500 and len(users) == user_search.MAX_USABLE_USERS + 1
+    assert search.logins("smith") == []
+    assert search.logins("smith", kind="org") == []
+    assert session.queries == ["type:user smith", "type:org smith"]
+
+
+def test_ttl_and_size_eviction():
+    cache = user_search.UserSearchCache(":memory:", ttl=60, max_entries=2)
+    for n in range(3):
+        cache.put(f"type:user {n}", 0, [])
+        time.sleep(0.01)
+    assert cache.get("type:user 0") is None
+    assert cache.get("type:user 2") == (0, [])
+    cache.ttl = 0
+    assert cache.get("type:user 2") is None
+    assert cache.stats()["evictions"] == 1
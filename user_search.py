@@ -0,0 +1,160 @@
+"""Search for GitHub users, remembering the answers on disk.
+
+Offboarding searches for every variant of a departing person's name and
+email, and the search API allows only 30 requests a minute. The answers
+rarely change within a day, so each search's results are kept in an
+SQLite file for ttl seconds -- a restarted notebook kernel, or the next
+offboarding of the day, reuses them. The least recently used searches
+are evicted past max_entries.
+
+Requests go through the shared session, which paces them against the
+search budget GitHub reports, rather than sleeping a fixed interval.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from client import get_requests_session
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "cache", "user_search.sqlite")
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 10000
+SEARCH_URL = "https://api.github.com/search/users"
+# more matches than this are too many to be useful, so don't fetch them
+MAX_USABLE_USERS = 10
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(term, kind="user"):
+    """The search for term, with case & whitespace differences removed."""
+    return f"type:{kind} " + " ".join(term.lower().split())
+
+
+class UserSearchCache:
+    """Search results on disk, by normalized query, expiring after ttl."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS searches (
+            query TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            users TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used);
+    """
+
+    def __init__(
+        self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+
+    def get(self, query):
+        """Return (total count, users) if query is cached & fresh, else None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT total, users, fetched_at FROM searches WHERE query = ?",
+                (query,),
+            ).fetchone()
+            if row is None or time.time() - row[2] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute(
+                "UPDATE searches SET last_used = ? WHERE query = ?",
+                (time.time(), query),
+            )
+            self.db.commit()
+        return row[0], json.loads(row[1])
+
+    def put(self, query, total, users):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?)",
+                (query, total, json.dumps(users), now, now),
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        # expired entries first, then the least recently used
+        cursor = self.db.execute(
+            "DELETE FROM searches WHERE fetched_at < ?", (time.time() - self.ttl,)
+        )
+        self.evictions += cursor.rowcount
+        (count,) = self.db.execute("SELECT COUNT(*) FROM searches").fetchone()
+        if count > self.max_entries:
+            cursor = self.db.execute(
+                "DELETE FROM searches WHERE query IN"
+                " (SELECT query FROM searches ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.evictions += cursor.rowcount
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM searches")
+            self.db.commit()
+
+    def stats(self):
+        (entries,) = self.db.execute("SELECT COUNT(*) FROM searches").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+class UserSearch:
+    """search_users(), answered from the cache where possible."""
+
+    def __init__(self, cache=None, session=None, max_users=MAX_USABLE_USERS):
+        self.cache = cache if cache is not None else UserSearchCache()
+        self.session = session or get_requests_session()
+        self.max_users = max_users
+
+    def search(self, term, kind="user"):
+        """Return (total count, [{"login", "id", "type", "html_url"}, ...]).
+
+        At most max_users + 1 users are returned; compare the total with
+        max_users to tell whether there were too many to be useful.
+        """
+        query = normalize_query(term, kind)
+        cached = self.cache.get(query)
+        if cached is not None:
+            return cached
+        response = self.session.get(
+            SEARCH_URL, params={"q": query, "per_page": self.max_users + 1}
+        )
+        response.raise_for_status()
+        body = response.json()
+        users = [
+            {k: item[k] for k in ("login", "id", "type", "html_url")}
+            for item in body.get("items", [])
+        ]
+        total = body.get("total_count", len(users))
+        logger.debug("%s: %d users", query, total)
+        self.cache.put(query, total, users)
+        return total, users
+
+    def logins(self, term, kind="user"):
+        """The matching logins, or [] if there are too many to be useful."""
+        total, users = self.search(term, kind)
+        if total > self.max_users:
+            return []
+        return [u["login"] for u in users]